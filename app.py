@@ -1,25 +1,41 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core import datetime_helpers
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
 import datetime
 import re
-import requests
-from bs4 import BeautifulSoup
 import os
 if os.path.exists(".env"):
     from dotenv import load_dotenv
     load_dotenv()
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import json
 import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import uuid
+import hashlib
+import bisect
+import itertools
+import unicodedata
 import base64
-from pypdf import PdfReader
-import io
 from config import Config
+from services.gemini_service import (
+    chunk_segments, configure_mapping_cache, extract_records, generate_json, get_cached_mapping, mapping_cache_key,
+    mapping_cache_stats, split_import_records, store_cached_mapping, stream_extract_records
+)
+from services.tabular_service import (
+    CUSTOMER_COLUMN_FIELDS, INVOICE_COLUMN_FIELDS, TABULAR_IMPORT_FORMATS, build_customer_records, build_invoice_records,
+    column_mapping_schema, header_fingerprint, read_table, resolve_column_mapping, table_to_csv_lines
+)
+from services.pdf_service import iter_pdf_page_texts
+from services.upload_service import (
+    UploadTooLargeError, read_spooled_text, spool_base64_to_file, spool_stream_to_file, spool_text_to_file
+)
+from services.scraping_service import extract_product_cards, fetch_collection_pages, fetch_storefront_pages
 
 app = Flask(__name__)
 CORS(app)
@@ -79,6 +95,202 @@ except Exception as e:
     raise e
 
 
+# --- Firestore Batch Helpers ---
+# Firestore accepts at most 500 writes per batch commit.
+FIRESTORE_BATCH_SIZE = 500
+
+def _add_to_batch(batch, action, doc_ref, data):
+    if action == 'delete':
+        batch.delete(doc_ref)
+    elif action == 'update':
+        batch.update(doc_ref, data)
+    elif action == 'create':
+        batch.create(doc_ref, data)
+    else:
+        batch.set(doc_ref, data, merge=(action == 'merge'))
+
+def commit_in_batches(operations, batch_size=FIRESTORE_BATCH_SIZE):
+    """
+    Commits a list of (action, doc_ref, data) writes using batched writes.
+    action is one of 'set', 'merge', 'create', 'update' or 'delete' (data is ignored for deletes).
+    Returns the number of batch commits made.
+    """
+    commit_count = 0
+    for start in range(0, len(operations), batch_size):
+        batch = db.batch()
+        for action, doc_ref, data in operations[start:start + batch_size]:
+            _add_to_batch(batch, action, doc_ref, data)
+        batch.commit()
+        commit_count += 1
+    return commit_count
+
+def commit_batches_concurrently(operations, max_workers=4, batch_size=FIRESTORE_BATCH_SIZE):
+    """
+    Commits (action, doc_ref, data) writes in batches of batch_size, running up to max_workers
+    commits at once. A batch that fails is split in half and each half retried, down to single
+    writes, so one bad record does not fail the rest of its batch. Writes the client rejects
+    while the batch is built (e.g. an invalid field path) fail the same way. Returns, in operation
+    order, None for each write that succeeded and the error message for each that failed.
+    """
+    def commit_group(group):
+        try:
+            batch = db.batch()
+            for action, doc_ref, data in group:
+                _add_to_batch(batch, action, doc_ref, data)
+            batch.commit()
+            return [None] * len(group)
+        except Exception as e:
+            if len(group) == 1:
+                return [str(e)]
+            print(f"Batch commit of {len(group)} writes failed, retrying in halves: {e}")
+        middle = len(group) // 2
+        return commit_group(group[:middle]) + commit_group(group[middle:])
+
+    groups = [operations[start:start + batch_size] for start in range(0, len(operations), batch_size)]
+    if not groups:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as executor:
+        return [error for group_results in executor.map(commit_group, groups) for error in group_results]
+
+# Number of document references sent per get_all call.
+FIRESTORE_GET_ALL_CHUNK_SIZE = 100
+
+def existing_document_ids(collection_name, doc_ids, chunk_size=FIRESTORE_GET_ALL_CHUNK_SIZE):
+    """
+    Returns the subset of doc_ids that exist in the collection. Only the referenced documents
+    are read, using get_all in chunks, with an empty field mask so no document data is transferred.
+    """
+    collection_ref = db.collection(collection_name)
+    # Document IDs cannot contain '/', so such values can never match an existing document.
+    unique_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if isinstance(doc_id, str) and doc_id and '/' not in doc_id]
+
+    existing_ids = set()
+    for start in range(0, len(unique_ids), chunk_size):
+        doc_refs = [collection_ref.document(doc_id) for doc_id in unique_ids[start:start + chunk_size]]
+        for doc in db.get_all(doc_refs, field_paths=[]):
+            if doc.exists:
+                existing_ids.add(doc.id)
+    return existing_ids
+
+
+# --- Conditional Writes ---
+# Mutations of single documents send a write precondition instead of reading the document
+# first. Without If-Match the write only requires the document to exist (NotFound -> 404); with
+# If-Match it requires the document's update time to equal the ETag from an earlier GET
+# (FailedPrecondition -> 409).
+def document_etag(update_time):
+    """ETag for a document version: its update time as an RFC 3339 timestamp."""
+    if isinstance(update_time, datetime_helpers.DatetimeWithNanoseconds):
+        return update_time.rfc3339()
+    return datetime_helpers.to_rfc3339(update_time)
+
+def set_document_etag(response, update_time):
+    if update_time is not None:
+        response.set_etag(document_etag(update_time))
+    return response
+
+def write_precondition():
+    """
+    Returns the write option for updating or deleting an existing document, based on the
+    request's If-Match header. Raises ValueError when If-Match does not carry exactly one
+    ETag issued by document_etag.
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return db.write_option(exists=True)
+    etags = if_match.as_set()
+    if len(etags) != 1:
+        raise ValueError("If-Match must carry a single strong ETag.")
+    try:
+        last_update_time = datetime_helpers.DatetimeWithNanoseconds.from_rfc3339(etags.pop())
+    except ValueError:
+        raise ValueError("If-Match does not carry an ETag returned by this API.")
+    return db.write_option(last_update_time=last_update_time)
+
+
+# --- Bulk Mutations ---
+# POST /invoices:batch and /customers:batch apply many update, delete and upsert operations in
+# one request. Documents targeted by updates and deletes are checked with get_all (no document
+# data is transferred) and the writes are committed as concurrent batches, so one request costs
+# about one existence check and one commit per 500 operations.
+BULK_OPERATION_ACTIONS = {'update': 'update', 'delete': 'delete', 'upsert': 'merge'}
+BULK_OPERATION_STATUSES = {'update': 'updated', 'delete': 'deleted', 'upsert': 'upserted'}
+
+def apply_bulk_operations(collection_name, id_field, operations, prepare_fields):
+    """
+    Commits a list of {"op": "update"|"delete"|"upsert", <id_field>: doc_id, "data": {...}}
+    operations against a collection. prepare_fields(op, doc_id, data) returns the fields to write
+    for updates and upserts. Returns (results, written): one result per operation in request
+    order, and the (op, doc_id, fields) of every write that was committed.
+    """
+    results = [None] * len(operations)
+    pending = []
+    seen_ids = set()
+    for operation_index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        doc_id = operation.get(id_field) if isinstance(operation, dict) else None
+        data = operation.get('data') if isinstance(operation, dict) else None
+        result = {"index": operation_index, id_field: doc_id, "op": op}
+        if op not in BULK_OPERATION_ACTIONS:
+            error = "op must be one of update, delete or upsert"
+        elif not isinstance(doc_id, str) or not doc_id or '/' in doc_id:
+            error = f"{id_field} must be a non-empty string without '/'"
+        elif op != 'delete' and (not isinstance(data, dict) or not data):
+            error = "data must be a non-empty object"
+        elif doc_id in seen_ids:
+            error = f"Only one operation per {id_field} is allowed in a request"
+        else:
+            error = None
+        if error:
+            results[operation_index] = {**result, "status": "invalid", "error": error}
+            continue
+        seen_ids.add(doc_id)
+        pending.append((operation_index, op, doc_id, data, result))
+
+    existing_ids = existing_document_ids(collection_name, [doc_id for _, op, doc_id, _, _ in pending if op != 'upsert'])
+    collection_ref = db.collection(collection_name)
+    writes = []
+    for operation_index, op, doc_id, data, result in pending:
+        if op != 'upsert' and doc_id not in existing_ids:
+            results[operation_index] = {**result, "status": "not_found", "error": f"{doc_id} not found"}
+            continue
+        fields = None if op == 'delete' else prepare_fields(op, doc_id, data)
+        writes.append((operation_index, op, doc_id, fields, result))
+
+    write_errors = commit_batches_concurrently(
+        [(BULK_OPERATION_ACTIONS[op], collection_ref.document(doc_id), fields) for _, op, doc_id, fields, _ in writes],
+        max_workers=app.config['FIRESTORE_COMMIT_WORKERS']
+    )
+    written = []
+    for (operation_index, op, doc_id, fields, result), write_error in zip(writes, write_errors):
+        if write_error:
+            results[operation_index] = {**result, "status": "failed", "error": write_error}
+        else:
+            results[operation_index] = {**result, "status": BULK_OPERATION_STATUSES[op]}
+            written.append((op, doc_id, fields))
+    return results, written
+
+def read_bulk_operations():
+    """
+    Reads the "operations" list of a bulk request. Returns (operations, error_response).
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not operations or not isinstance(operations, list):
+        return None, (jsonify({"error": "operations must be a non-empty list"}), 400)
+    max_operations = app.config['BULK_MAX_OPERATIONS']
+    if len(operations) > max_operations:
+        return None, (jsonify({"error": f"At most {max_operations} operations are allowed per request"}), 400)
+    return operations, None
+
+def bulk_response(results):
+    succeeded_count = sum(1 for result in results if result['status'] in BULK_OPERATION_STATUSES.values())
+    return jsonify({
+        "succeeded_count": succeeded_count,
+        "failed_count": len(results) - succeeded_count,
+        "results": results
+    }), 200
+
 
 # --- Models ---
 class Category:
@@ -105,38 +317,126 @@ allCategories = [
 
 # --- Scraping Service ---
 def scrape_products():
-    all_products_data = []
-    page = 1
+    return flatten_catalog_pages(scrape_product_pages())
 
-    while True:
-        try:
-            scrape_url = f"{NALAM_FOODS_URL}/collections/all?page={page}"
-            print(f"Scraping page {page}: {scrape_url}")
-            response = requests.get(scrape_url)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            product_elements = soup.find_all('div', class_='product-card-wrapper') or \
-                               soup.find_all('div', class_='product-card')
-            if not product_elements:
-                break
-
-            for product_element in product_elements:
-                product_name, product_price = parse_product(product_element)
-                category_id = match_category(product_name)
-                safe_id = re.sub(r'[^\w-]', '', product_name.replace(' ', '_').lower())
-                all_products_data.append({
-                    "id": safe_id,
-                    "name": product_name,
-                    "price": product_price,
-                    "categoryId": category_id
-                })
-            page += 1
-        except Exception as e:
-            print(f"Error scraping page {page}: {e}")
-            break
+def scrape_product_pages(previous_pages=None):
+    """
+    Scrapes the HTML collection pages. Pages unchanged since previous_pages (a 304 response or
+    an identical body fingerprint) reuse their stored products instead of being parsed again.
+    Returns page state keyed by page number as a string, or an empty dict on error.
+    """
+    previous_pages = previous_pages or {}
+
+    try:
+        page_results = fetch_collection_pages(
+            NALAM_FOODS_URL,
+            max_workers=app.config['SCRAPER_MAX_WORKERS'],
+            timeout=app.config['SCRAPER_TIMEOUT_SECONDS'],
+            max_retries=app.config['SCRAPER_MAX_RETRIES'],
+            page_validators={int(page): page_state for page, page_state in previous_pages.items()}
+        )
+    except Exception as e:
+        print(f"Error scraping collection pages: {e}")
+        return {}
+
+    pages = {}
+    for page, page_result in page_results.items():
+        previous_page = previous_pages.get(str(page))
+        if _catalog_page_is_unchanged(page_result, previous_page):
+            pages[str(page)] = _catalog_page_state(page_result, previous_page['products'], changed=False)
+            continue
+
+        page_products = []
+        product_elements = extract_product_cards(page_result['text'])
+        if not product_elements:
+            print(f"No products found on page {page}.")
+
+        for product_element in product_elements:
+            product_name, product_price = parse_product(product_element)
+            page_products.append(build_product_record(product_name, product_price))
+        pages[str(page)] = _catalog_page_state(page_result, page_products, changed=True)
+
+    return pages
+
+def fetch_storefront_json_pages(previous_pages=None):
+    """
+    Reads the storefront's products.json feed, reusing stored products for unchanged pages.
+    Returns page state keyed by page number as a string, or an empty dict on error.
+    """
+    previous_pages = previous_pages or {}
+
+    try:
+        page_results = fetch_storefront_pages(
+            NALAM_FOODS_URL,
+            timeout=app.config['SCRAPER_TIMEOUT_SECONDS'],
+            max_retries=app.config['SCRAPER_MAX_RETRIES'],
+            page_validators={int(page): page_state for page, page_state in previous_pages.items()},
+            max_pages=app.config['SCRAPER_MAX_PAGES']
+        )
+    except Exception as e:
+        print(f"Error fetching storefront products feed: {e}")
+        return {}
+
+    pages = {}
+    for page, page_result in page_results.items():
+        previous_page = previous_pages.get(str(page))
+        if _catalog_page_is_unchanged(page_result, previous_page):
+            pages[str(page)] = _catalog_page_state(page_result, previous_page['products'], changed=False)
+            continue
+
+        page_products = []
+        for storefront_product in page_result['products']:
+            product_name = (storefront_product.get('title') or '').strip() or "Unknown Product"
+            # Collection pages show the lowest variant price, so use the same here.
+            variant_prices = [float(variant['price']) for variant in storefront_product.get('variants', []) if variant.get('price')]
+            product_price = min(variant_prices) if variant_prices else 0.0
+            page_products.append(build_product_record(product_name, product_price))
+        pages[str(page)] = _catalog_page_state(page_result, page_products, changed=True)
 
-    return all_products_data
+    print(f"Fetched {len(flatten_catalog_pages(pages))} products from the storefront JSON feed.")
+    return pages
+
+def fetch_catalog_pages(previous_pages=None):
+    """
+    Fetches the catalog from the source selected by CATALOG_SOURCE ('shopify_json' or 'html').
+    The HTML scraper is used as a fallback when the JSON feed returns nothing.
+    Returns (source, pages).
+    """
+    if app.config['CATALOG_SOURCE'] == 'shopify_json':
+        pages = fetch_storefront_json_pages(previous_pages)
+        if flatten_catalog_pages(pages):
+            return 'shopify_json', pages
+        print("Storefront JSON feed returned no products. Falling back to HTML scraping.")
+        # Page state from the JSON feed does not apply to the collection pages.
+        return 'html', scrape_product_pages()
+    return 'html', scrape_product_pages(previous_pages)
+
+def flatten_catalog_pages(pages):
+    return [product for page_state in pages.values() for product in page_state['products']]
+
+def _catalog_page_is_unchanged(page_result, previous_page):
+    if previous_page is None:
+        return False
+    return page_result['text'] is None or page_result['fingerprint'] == previous_page.get('fingerprint')
+
+def _catalog_page_state(page_result, products, changed):
+    return {
+        "etag": page_result.get('etag'),
+        "lastModified": page_result.get('lastModified'),
+        "fingerprint": page_result.get('fingerprint'),
+        "itemCount": page_result.get('itemCount'),
+        "products": products,
+        "changed": changed
+    }
+
+def build_product_record(product_name, product_price):
+    safe_id = re.sub(r'[^\w-]', '', product_name.replace(' ', '_').lower())
+    return {
+        "id": safe_id,
+        "name": product_name,
+        "price": product_price,
+        "categoryId": match_category(product_name)
+    }
 
 def parse_product(element):
     name_tag = element.find('a', class_='full-width-link')
@@ -177,48 +477,168 @@ def get_hardcoded_products():
 
 
 # --- Product Synchronization Service ---
-def synchronize_products():
+# Fields copied from the catalog source onto each product document. A hash of these
+# fields is stored as 'contentHash' so unchanged products are skipped without comparing fields.
+PRODUCT_SYNC_FIELDS = ('name', 'price', 'categoryId')
+
+def product_content_hash(product):
+    content = json.dumps({field: product.get(field) for field in PRODUCT_SYNC_FIELDS}, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def diff_products(scraped_products, firestore_products):
+    """
+    Compares scraped products with the products stored in Firestore.
+    Returns (added, updated, deleted_ids, unchanged_count), where added is a list of full
+    product documents and updated is a list of (product_id, changed_fields) tuples.
+    """
+    # The last record wins if two scraped products map to the same document ID.
+    scraped_by_id = {product['id']: product for product in scraped_products}
+
+    added = []
+    updated = []
+    unchanged_count = 0
+    for product_id, product in scraped_by_id.items():
+        content_hash = product_content_hash(product)
+        firestore_product = firestore_products.get(product_id)
+
+        if firestore_product is None:
+            added.append(dict(product, contentHash=content_hash))
+            continue
+        if firestore_product.get('contentHash') == content_hash:
+            unchanged_count += 1
+            continue
+
+        changed_fields = {
+            field: product.get(field)
+            for field in PRODUCT_SYNC_FIELDS
+            if firestore_product.get(field) != product.get(field)
+        }
+        if changed_fields:
+            changed_fields['contentHash'] = content_hash
+            updated.append((product_id, changed_fields))
+        else:
+            unchanged_count += 1
+
+    deleted_ids = [product_id for product_id in firestore_products if product_id not in scraped_by_id]
+    return added, updated, deleted_ids, unchanged_count
+
+# Per-page validators, fingerprints and products from the last sync, used to skip unchanged pages.
+CATALOG_SYNC_STATE_COLLECTION = 'sync_state'
+CATALOG_SYNC_STATE_DOCUMENT = 'product_catalog'
+
+def load_catalog_sync_state():
+    state_doc = db.collection(CATALOG_SYNC_STATE_COLLECTION).document(CATALOG_SYNC_STATE_DOCUMENT).get()
+    return state_doc.to_dict() if state_doc.exists else {}
+
+def save_catalog_sync_state(state):
+    db.collection(CATALOG_SYNC_STATE_COLLECTION).document(CATALOG_SYNC_STATE_DOCUMENT).set(state)
+
+def synchronize_products(force_full=False):
+    """
+    Syncs the products collection with the catalog source and returns a dict of diff counts and timings.
+    Between full syncs (every CATALOG_FULL_SYNC_INTERVAL_HOURS, or when force_full is set) pages are
+    fetched conditionally, and nothing is parsed, diffed or written when no page has changed.
+    """
     print("--- DEBUG: Starting hourly product synchronization... ---")
     if db is None:
         print("Error: Firestore not initialized. Skipping synchronization.")
-        return
+        return {"status": "error", "error": "Firestore not initialized"}
     try:
-        scraped_products = scrape_products()
+        started_at = time.monotonic()
+        sync_state = load_catalog_sync_state()
+        full_sync_interval_seconds = app.config['CATALOG_FULL_SYNC_INTERVAL_HOURS'] * 3600
+        full_sync = force_full or \
+                    not sync_state.get('pages') or \
+                    sync_state.get('source') != app.config['CATALOG_SOURCE'] or \
+                    time.time() - sync_state.get('lastFullSyncAt', 0) >= full_sync_interval_seconds
+        previous_pages = None if full_sync else sync_state['pages']
+
+        source, pages = fetch_catalog_pages(previous_pages)
+        scraped_products = flatten_catalog_pages(pages)
+        fetched_at = time.monotonic()
         if not scraped_products:
             print("No products scraped. Skipping synchronization.")
-            return
+            return {"status": "skipped", "reason": "No products scraped"}
+
+        changed_pages = [page for page, page_state in pages.items() if page_state['changed']]
+        stored_pages = {page: {key: value for key, value in page_state.items() if key != 'changed'} for page, page_state in pages.items()}
+        stats = {
+            "status": "success",
+            "mode": "full" if full_sync else "incremental",
+            "source": source,
+            "pagesFetched": len(pages),
+            "pagesChanged": len(changed_pages)
+        }
+
+        if not full_sync and not changed_pages and pages.keys() == previous_pages.keys():
+            if stored_pages != previous_pages:
+                # Validators can change without the content changing.
+                save_catalog_sync_state(dict(sync_state, pages=stored_pages, lastSyncAt=time.time()))
+            finished_at = time.monotonic()
+            stats.update({
+                "scraped": len(scraped_products),
+                "added": 0,
+                "updated": 0,
+                "deleted": 0,
+                "unchanged": len(scraped_products),
+                "commits": 0,
+                "fetchSeconds": round(fetched_at - started_at, 3),
+                "diffSeconds": 0.0,
+                "writeSeconds": 0.0,
+                "totalSeconds": round(finished_at - started_at, 3)
+            })
+            print(f"--- DEBUG: Catalog unchanged, nothing to synchronize: {stats} ---")
+            return stats
 
         product_ref = db.collection('products')
         
         firestore_products = {doc.id: doc.to_dict() for doc in product_ref.stream()}
-        scraped_product_ids = {p['id'] for p in scraped_products}
-
-        for product in scraped_products:
-            product_id = product['id']
-            if product_id in firestore_products:
-                firestore_product = firestore_products[product_id]
-                if firestore_product.get('price') != product['price'] or \
-                   firestore_product.get('categoryId') != product['categoryId']:
-                    print(f"Updating product: {product_id}")
-                    product_ref.document(product_id).update({
-                        'name': product['name'],
-                        'price': product['price'],
-                        'categoryId': product['categoryId'],
-                        'lastUpdated': firestore.SERVER_TIMESTAMP
-                    })
-            else:
-                print(f"Adding new product: {product_id}")
-                product_ref.document(product_id).set(product)
-
-        for product_id in firestore_products.keys():
-            if product_id not in scraped_product_ids:
-                print(f"Deleting product: {product_id}")
-                product_ref.document(product_id).delete()
-
-        print("--- DEBUG: Product synchronization complete. ---")
+        added, updated, deleted_ids, unchanged_count = diff_products(scraped_products, firestore_products)
+        diffed_at = time.monotonic()
+
+        operations = []
+        for product in added:
+            print(f"Adding new product: {product['id']}")
+            operations.append(('set', product_ref.document(product['id']), dict(product, lastUpdated=firestore.SERVER_TIMESTAMP)))
+        for product_id, changed_fields in updated:
+            print(f"Updating product: {product_id} ({', '.join(field for field in changed_fields if field != 'contentHash')})")
+            operations.append(('update', product_ref.document(product_id), dict(changed_fields, lastUpdated=firestore.SERVER_TIMESTAMP)))
+        for product_id in deleted_ids:
+            print(f"Deleting product: {product_id}")
+            operations.append(('delete', product_ref.document(product_id), None))
+
+        commit_count = commit_in_batches(operations)
+        finished_at = time.monotonic()
+
+        if operations:
+            invalidate_product_catalog()
+
+        now = time.time()
+        save_catalog_sync_state({
+            "source": source,
+            "pages": stored_pages,
+            "lastSyncAt": now,
+            "lastFullSyncAt": now if full_sync else sync_state.get('lastFullSyncAt', now)
+        })
+
+        stats.update({
+            "scraped": len(scraped_products),
+            "added": len(added),
+            "updated": len(updated),
+            "deleted": len(deleted_ids),
+            "unchanged": unchanged_count,
+            "commits": commit_count,
+            "fetchSeconds": round(fetched_at - started_at, 3),
+            "diffSeconds": round(diffed_at - fetched_at, 3),
+            "writeSeconds": round(finished_at - diffed_at, 3),
+            "totalSeconds": round(finished_at - started_at, 3)
+        })
+        print(f"--- DEBUG: Product synchronization complete: {stats} ---")
+        return stats
 
     except Exception as e:
         print(f"Error during product synchronization: {e}")
+        return {"status": "error", "error": str(e)}
 
 def start_scheduler():
     synchronize_products()
@@ -228,9 +648,190 @@ def start_scheduler():
 
 
 
+# Running the scheduler thread on every Cloud Run instance would multiply the sync load by the
+# instance count. Production syncs are triggered by an external cron through /tasks/sync-products.
 # threading.Thread(target=start_scheduler, daemon=True).start()
 
 
+# --- Product Catalog Cache ---
+# The catalog only changes when synchronize_products runs, so /products is served from a
+# process-wide cache of the serialized response. The cache is refreshed after
+# PRODUCT_CACHE_TTL_SECONDS, or kept current by a Firestore snapshot listener when
+# PRODUCT_CACHE_USE_LISTENER is enabled.
+_product_catalog_cache = None
+_product_catalog_lock = threading.Lock()
+_product_catalog_watch = None
+
+def _build_product_catalog_cache(products):
+    from_firestore = bool(products)
+    if not from_firestore:
+        products = get_hardcoded_products()
+    body = app.json.dumps(products, separators=(",", ":")).encode('utf-8')
+    return {
+        "body": body,
+        "etag": hashlib.sha256(body).hexdigest(),
+        "count": len(products),
+        "from_firestore": from_firestore,
+        "loaded_at": time.monotonic()
+    }
+
+def load_product_catalog():
+    """
+    Reads the products collection and replaces the cached catalog.
+    """
+    global _product_catalog_cache
+    products = [doc.to_dict() for doc in db.collection('products').stream()]
+    _product_catalog_cache = _build_product_catalog_cache(products)
+    print(f"Product catalog cache loaded with {_product_catalog_cache['count']} products.")
+    return _product_catalog_cache
+
+def _product_catalog_is_fresh(cache):
+    if cache is None:
+        return False
+    if _product_catalog_watch is not None:
+        return True
+    return time.monotonic() - cache['loaded_at'] < app.config['PRODUCT_CACHE_TTL_SECONDS']
+
+def get_product_catalog():
+    cache = _product_catalog_cache
+    if _product_catalog_is_fresh(cache):
+        return cache
+    with _product_catalog_lock:
+        # Another thread may have reloaded the catalog while we waited for the lock.
+        cache = _product_catalog_cache
+        if _product_catalog_is_fresh(cache):
+            return cache
+        return load_product_catalog()
+
+def invalidate_product_catalog():
+    global _product_catalog_cache
+    if _product_catalog_watch is None:
+        _product_catalog_cache = None
+
+def _on_products_snapshot(docs, changes, read_time):
+    global _product_catalog_cache
+    _product_catalog_cache = _build_product_catalog_cache([doc.to_dict() for doc in docs])
+    print(f"Product catalog cache refreshed from snapshot with {_product_catalog_cache['count']} products.")
+
+def start_product_catalog_listener():
+    global _product_catalog_watch
+    if _product_catalog_watch is None:
+        _product_catalog_watch = db.collection('products').on_snapshot(_on_products_snapshot)
+        print("Product catalog snapshot listener started.")
+
+if app.config['PRODUCT_CACHE_USE_LISTENER']:
+    start_product_catalog_listener()
+
+
+# --- Scheduled Sync Task ---
+# A lease document makes sure only one instance runs the product sync at a time. An instance that
+# dies mid-sync only blocks others until the lease expires.
+SYNC_LEASE_COLLECTION = 'sync_state'
+SYNC_LEASE_DOCUMENT = 'product_sync_lease'
+SYNC_RUNS_COLLECTION = 'sync_runs'
+
+@firestore.transactional
+def _acquire_product_sync_lease(transaction, lease_ref, holder, lease_seconds, min_interval_seconds):
+    lease_doc = lease_ref.get(transaction=transaction)
+    lease = lease_doc.to_dict() if lease_doc.exists else {}
+    now = time.time()
+
+    if lease.get('holder') and lease.get('expiresAt', 0) > now:
+        return 'locked', lease
+    if now - lease.get('lastSuccessAt', 0) < min_interval_seconds:
+        return 'recent', lease
+
+    transaction.set(lease_ref, {
+        'holder': holder,
+        'acquiredAt': now,
+        'expiresAt': now + lease_seconds
+    }, merge=True)
+    return 'acquired', lease
+
+@firestore.transactional
+def _release_product_sync_lease(transaction, lease_ref, holder, last_run):
+    lease_doc = lease_ref.get(transaction=transaction)
+    lease = lease_doc.to_dict() if lease_doc.exists else {}
+
+    lease_update = {'lastRun': last_run}
+    if last_run['status'] == 'success':
+        lease_update['lastSuccessAt'] = last_run['finishedAt']
+    # Only clear the lease if it is still ours; it may have expired and been taken over.
+    if lease.get('holder') == holder:
+        lease_update['holder'] = None
+        lease_update['expiresAt'] = 0
+    transaction.set(lease_ref, lease_update, merge=True)
+
+def run_product_sync_task(force=False, force_full=False):
+    """
+    Runs synchronize_products under the Firestore lease.
+    Returns (status, details) where status is 'locked', 'recent' or the sync status.
+    """
+    lease_ref = db.collection(SYNC_LEASE_COLLECTION).document(SYNC_LEASE_DOCUMENT)
+    holder = str(uuid.uuid4())
+    min_interval_seconds = 0 if force else app.config['SYNC_MIN_INTERVAL_SECONDS']
+
+    lease_status, lease = _acquire_product_sync_lease(
+        db.transaction(), lease_ref, holder, app.config['SYNC_LEASE_SECONDS'], min_interval_seconds
+    )
+    if lease_status == 'locked':
+        print("Product sync skipped: another instance holds the lease.")
+        return 'locked', {"leaseExpiresAt": lease.get('expiresAt')}
+    if lease_status == 'recent':
+        print("Product sync skipped: last successful run is recent.")
+        return 'recent', {"lastSuccessAt": lease.get('lastSuccessAt')}
+
+    started_at = time.time()
+    try:
+        stats = synchronize_products(force_full=force_full)
+    except Exception as e:
+        stats = {"status": "error", "error": str(e)}
+    finished_at = time.time()
+
+    last_run = {
+        "holder": holder,
+        "status": stats.get('status'),
+        "startedAt": started_at,
+        "finishedAt": finished_at,
+        "durationSeconds": round(finished_at - started_at, 3),
+        "stats": stats
+    }
+    _release_product_sync_lease(db.transaction(), lease_ref, holder, last_run)
+    db.collection(SYNC_RUNS_COLLECTION).document().set(dict(last_run, timestamp=firestore.SERVER_TIMESTAMP))
+    return stats.get('status'), last_run
+
+@app.route('/tasks/sync-products', methods=['GET', 'POST'])
+def sync_products_task():
+    """
+    Entry point for the external cron that keeps the products collection in sync.
+    Pass ?force=1 to ignore the minimum interval and ?full=1 to force a full sync. force is only
+    honoured when SYNC_TASK_TOKEN is configured, so unauthenticated callers cannot bypass the limit.
+    """
+    if db is None:
+        print("Error: Firestore not initialized in sync_products_task.")
+        return jsonify({"error": "Firestore not initialized"}), 500
+
+    task_token = app.config['SYNC_TASK_TOKEN']
+    if task_token and request.headers.get('X-Task-Token') != task_token:
+        return jsonify({"error": "Forbidden"}), 403
+
+    try:
+        status, details = run_product_sync_task(
+            force=bool(task_token) and request.args.get('force') == '1',
+            force_full=request.args.get('full') == '1'
+        )
+        if status == 'locked':
+            return jsonify({"status": "skipped", "reason": "Another sync is in progress", **details}), 200
+        if status == 'recent':
+            return jsonify({"status": "skipped", "reason": "Last successful sync is recent", **details}), 200
+        if status == 'error':
+            return jsonify(details), 500
+        return jsonify(details), 200
+    except Exception as e:
+        print(f"Error running product sync task: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/healthz')
 def healthz():
     """A simple health check endpoint."""
@@ -245,14 +846,17 @@ def get_products_route():
         return jsonify({"error": "Firestore not initialized"}), 500
     
     try:
-        docs = db.collection('products').stream()
-        products = [doc.to_dict() for doc in docs]
-        if products:
-            print(f"Returning {len(products)} products from Firestore.")
-            return jsonify(products), 200
-        else:
+        catalog = get_product_catalog()
+        if not catalog['from_firestore']:
             print("No products found in Firestore. Returning hardcoded products.")
-            return jsonify(get_hardcoded_products()), 200
+
+        if request.if_none_match.contains_weak(catalog['etag']):
+            response = Response(status=304)
+        else:
+            response = Response(catalog['body'], status=200, mimetype='application/json')
+        response.set_etag(catalog['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
     except Exception as e:
         print(f"Error fetching products from Firestore: {e}")
@@ -269,12 +873,7 @@ def create_invoice():
         data = request.get_json()
         
         today_str = datetime.datetime.now().strftime("%Y%m%d")
-        
-        invoices_today_docs = db.collection('invoices').where(filter=firestore.FieldFilter('invoiceDatePrefix', '==', today_str)).get()
-        count_today = len(invoices_today_docs)
-        
-        invoice_suffix = str(count_today + 1).zfill(3)
-        invoice_number = f"{today_str}{invoice_suffix}"
+        invoice_number = reserve_invoice_numbers(today_str)[0]
         
         days_due = data.get('daysDue', 1)
         invoice_date = datetime.datetime.now()
@@ -290,10 +889,15 @@ def create_invoice():
         data['balanceAmount'] = data.get('totalAmount', 0.0)
         data['payments'] = []
         
-        db.collection('invoices').document(invoice_number).set(data)
+        # create() rather than set(): if the counter ever falls behind, a colliding number fails
+        # instead of overwriting an existing invoice.
+        db.collection('invoices').document(invoice_number).create(data)
         
         print(f"Invoice saved to Firestore with ID: {invoice_number}")
         return jsonify({"invoiceNumber": invoice_number}), 201
+    except AlreadyExists:
+        print(f"Invoice number {invoice_number} is already in use; invoice not saved.")
+        return jsonify({"error": f"Invoice number {invoice_number} is already in use. Please try again."}), 409
     except Exception as e:
         print(f"Error saving invoice: {e}")
         return jsonify({"error": str(e)}), 500
@@ -311,7 +915,7 @@ def get_invoice(invoice_number):
         if invoice_doc.exists:
             invoice_data = invoice_doc.to_dict()
             print(f"Invoice {invoice_number} fetched successfully.")
-            return jsonify(invoice_data), 200
+            return set_document_etag(jsonify(invoice_data), invoice_doc.update_time), 200
         else:
             print(f"Invoice {invoice_number} not found.")
             return jsonify({"error": f"Invoice {invoice_number} not found"}), 404
@@ -320,64 +924,184 @@ def get_invoice(invoice_number):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/invoices', methods=['GET'])
-def get_invoices():
-    if db is None:
-        print("Error: Firestore not initialized in get_invoices.")
-        return jsonify({"error": "Firestore not initialized"}), 500
-    try:
-        mobile_number_filter = request.args.get('mobileNumber')
-        date_filter = request.args.get('date')
-        invoice_number_filter = request.args.get('invoiceNumber')
-        year_filter = request.args.get('year')
-        month_filter = request.args.get('month')
+# --- Streaming Responses ---
+# Large collections can be written to the socket one document at a time as Firestore's
+# stream() yields them, so memory per request stays constant.
+NDJSON_MIMETYPE = 'application/x-ndjson'
 
-        query = db.collection('invoices')
+def wants_streamed_response():
+    return request.args.get('stream') == '1' or \
+           request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
 
-        if mobile_number_filter:
-            query = query.where(filter=firestore.FieldFilter('mobileNumber', '==', mobile_number_filter))
-        if date_filter:
-            query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '==', date_filter.replace('-', '')))
-        if invoice_number_filter:
-            query = query.where(filter=firestore.FieldFilter('invoiceNumber', '==', invoice_number_filter))
-        
-        if year_filter:
-            start_date_prefix = f"{year_filter}0101"
-            end_date_prefix = f"{year_filter}1231"
-            query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '>=', start_date_prefix))
-            query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '<=', end_date_prefix))
-
-        if month_filter and month_filter != 'All':
-            if not year_filter:
-                return jsonify({"error": "Month filter requires a year filter."}), 400
-            
-            start_date_prefix = f"{year_filter}{month_filter.zfill(2)}01"
-            last_day_of_month = (datetime.date(int(year_filter), int(month_filter) % 12 + 1, 1) - datetime.timedelta(days=1)).day
-            end_date_prefix = f"{year_filter}{month_filter.zfill(2)}{last_day_of_month}"
-            
-            query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '>=', start_date_prefix))
-            query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '<=', end_date_prefix))
+def stream_documents_response(docs, serialize):
+    """
+    Streams documents as NDJSON when the client accepts application/x-ndjson,
+    otherwise as a chunked JSON array that parses the same as the buffered response.
+    The first document is read before the response starts, so query errors (a missing index,
+    a permission problem) are raised to the caller instead of truncating a 200 body.
+    """
+    as_ndjson = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+    docs = iter(docs)
+    first_doc = next(docs, None)
+    if first_doc is not None:
+        docs = itertools.chain([first_doc], docs)
+
+    def generate_ndjson():
+        for doc in docs:
+            yield app.json.dumps(serialize(doc), separators=(",", ":")) + "\n"
+
+    def generate_json_array():
+        yield "["
+        separator = ""
+        for doc in docs:
+            yield separator + app.json.dumps(serialize(doc), separators=(",", ":"))
+            separator = ","
+        yield "]"
+
+    if as_ndjson:
+        return Response(generate_ndjson(), status=200, mimetype=NDJSON_MIMETYPE)
+    return Response(generate_json_array(), status=200, mimetype='application/json')
+
+# Server-Sent Events, for pushing results to the browser while a long request is still running.
+SSE_MIMETYPE = 'text/event-stream'
+
+def format_sse_event(event, data):
+    return f"event: {event}\ndata: {app.json.dumps(data, separators=(',', ':'))}\n\n"
+
+def sse_response(events):
+    # X-Accel-Buffering stops proxies from holding events back until the response ends.
+    return Response(events, status=200, mimetype=SSE_MIMETYPE,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# --- Invoice Queries ---
+# Columns needed by the invoice list view; used for ?fields=summary.
+INVOICE_SUMMARY_FIELDS = [
+    'invoiceNumber', 'invoiceDate', 'dueDate', 'billToName', 'mobileNumber', 'invoiceType',
+    'paymentType', 'status', 'totalAmount', 'totalPaid', 'balanceAmount'
+]
+INVOICE_PAGE_SIZE_MAX = 500
+
+def build_invoice_query(args):
+    """
+    Builds the invoices query for the mobileNumber/date/invoiceNumber/year/month filters.
+    Raises ValueError for invalid filter combinations.
+    """
+    mobile_number_filter = args.get('mobileNumber')
+    date_filter = args.get('date')
+    invoice_number_filter = args.get('invoiceNumber')
+    year_filter = args.get('year')
+    month_filter = args.get('month')
+
+    query = db.collection('invoices')
+
+    if mobile_number_filter:
+        query = query.where(filter=firestore.FieldFilter('mobileNumber', '==', mobile_number_filter))
+    if date_filter:
+        query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '==', date_filter.replace('-', '')))
+    if invoice_number_filter:
+        query = query.where(filter=firestore.FieldFilter('invoiceNumber', '==', invoice_number_filter))
+    
+    if year_filter:
+        start_date_prefix = f"{year_filter}0101"
+        end_date_prefix = f"{year_filter}1231"
+        query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '>=', start_date_prefix))
+        query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '<=', end_date_prefix))
+
+    if month_filter and month_filter != 'All':
+        if not year_filter:
+            raise ValueError("Month filter requires a year filter.")
         
-        docs = query.order_by('invoiceNumber', direction=firestore.Query.DESCENDING).stream()
+        start_date_prefix = f"{year_filter}{month_filter.zfill(2)}01"
+        last_day_of_month = (datetime.date(int(year_filter), int(month_filter) % 12 + 1, 1) - datetime.timedelta(days=1)).day
+        end_date_prefix = f"{year_filter}{month_filter.zfill(2)}{last_day_of_month}"
         
-        invoices = []
-        for doc in docs:
-            invoice = doc.to_dict()
-            invoice['invoiceNumber'] = doc.id
-            
-            if 'timestamp' in invoice and isinstance(invoice['timestamp'], datetime.datetime):
-                invoice['timestamp'] = invoice['timestamp'].isoformat()
-            
-            if 'invoiceDate' in invoice and isinstance(invoice['invoiceDate'], datetime.datetime):
-                invoice['invoiceDate'] = invoice['invoiceDate'].isoformat()
+        query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '>=', start_date_prefix))
+        query = query.where(filter=firestore.FieldFilter('invoiceDatePrefix', '<=', end_date_prefix))
+
+    return query
+
+def serialize_invoice(doc):
+    invoice = doc.to_dict()
+    invoice['invoiceNumber'] = doc.id
+    for key in ('timestamp', 'invoiceDate', 'dueDate'):
+        if isinstance(invoice.get(key), datetime.datetime):
+            invoice[key] = invoice[key].isoformat()
+    return invoice
+
+def encode_page_token(invoice_number):
+    return base64.urlsafe_b64encode(invoice_number.encode('utf-8')).decode('ascii')
+
+def decode_page_token(page_token):
+    try:
+        return base64.urlsafe_b64decode(page_token.encode('ascii')).decode('utf-8')
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid pageToken.")
+
+def parse_invoice_fields(fields_param):
+    if not fields_param:
+        return None
+    if fields_param == 'summary':
+        return INVOICE_SUMMARY_FIELDS
+    return [field.strip() for field in fields_param.split(',') if field.strip()]
 
-            if 'dueDate' in invoice and isinstance(invoice['dueDate'], datetime.datetime):
-                invoice['dueDate'] = invoice['dueDate'].isoformat()
 
-            invoices.append(invoice)
+@app.route('/invoices', methods=['GET'])
+def get_invoices():
+    """
+    Lists invoices matching the filters, newest invoice number first.
+    Optional paging: ?limit=N&pageToken=... returns {"invoices": [...], "nextPageToken": ...}.
+    Optional projection: ?fields=a,b,c (or ?fields=summary) returns only those fields.
+    Unpaged results are streamed for Accept: application/x-ndjson or ?stream=1.
+    """
+    if db is None:
+        print("Error: Firestore not initialized in get_invoices.")
+        return jsonify({"error": "Firestore not initialized"}), 500
+    try:
+        try:
+            query = build_invoice_query(request.args)
+            fields = parse_invoice_fields(request.args.get('fields'))
+            limit = request.args.get('limit')
+            if limit is not None:
+                try:
+                    limit = int(limit)
+                except ValueError:
+                    raise ValueError("limit must be an integer.")
+                if limit < 1:
+                    raise ValueError("limit must be at least 1.")
+            page_token = request.args.get('pageToken')
+            start_after_invoice_number = decode_page_token(page_token) if page_token else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        query = query.order_by('invoiceNumber', direction=firestore.Query.DESCENDING)
+        if fields:
+            query = query.select(fields)
+        if start_after_invoice_number:
+            query = query.start_after({'invoiceNumber': start_after_invoice_number})
+
+        paginated = limit is not None or page_token is not None
+        if paginated:
+            limit = min(limit or INVOICE_PAGE_SIZE_MAX, INVOICE_PAGE_SIZE_MAX)
+            # Fetch one extra invoice to know whether another page exists.
+            query = query.limit(limit + 1)
+
+        if not paginated and wants_streamed_response():
+            print("Streaming invoices from Firestore with filters.")
+            return stream_documents_response(query.stream(), serialize_invoice)
+
+        invoices = [serialize_invoice(doc) for doc in query.stream()]
         
-        print(f"Fetched {len(invoices)} invoices from Firestore with filters.")
-        return jsonify(invoices), 200
+        if not paginated:
+            print(f"Fetched {len(invoices)} invoices from Firestore with filters.")
+            return jsonify(invoices), 200
+
+        next_page_token = None
+        if len(invoices) > limit:
+            invoices = invoices[:limit]
+            next_page_token = encode_page_token(invoices[-1]['invoiceNumber'])
+        print(f"Fetched a page of {len(invoices)} invoices from Firestore with filters.")
+        return jsonify({"invoices": invoices, "nextPageToken": next_page_token}), 200
     except Exception as e:
         print(f"Error fetching invoices: {e}")
         return jsonify({"error": str(e)}), 500
@@ -386,6 +1110,8 @@ def get_invoices():
 def update_invoice(invoice_number):
     """
     Updates a full invoice document with all fields from the request body.
+    An If-Match header with the invoice's ETag makes the update fail with 409 when the
+    invoice has changed since it was read.
     """
     if db is None:
         print("Error: Firestore not initialized in update_invoice.")
@@ -394,17 +1120,20 @@ def update_invoice(invoice_number):
     try:
         data = request.get_json()
         invoice_ref = db.collection('invoices').document(invoice_number)
-        invoice_doc = invoice_ref.get()
-
-        if not invoice_doc.exists:
-            print(f"Invoice {invoice_number} not found for update.")
-            return jsonify({"error": f"Invoice {invoice_number} not found"}), 404
-
-        invoice_ref.update(data)
+        write_result = invoice_ref.update(data, option=write_precondition())
         
         print(f"Invoice {invoice_number} updated with data: {data}")
-        return jsonify({"message": f"Invoice {invoice_number} updated successfully"}), 200
+        response = jsonify({"message": f"Invoice {invoice_number} updated successfully"})
+        return set_document_etag(response, write_result.update_time), 200
     
+    except NotFound:
+        print(f"Invoice {invoice_number} not found for update.")
+        return jsonify({"error": f"Invoice {invoice_number} not found"}), 404
+    except FailedPrecondition:
+        print(f"Invoice {invoice_number} changed since it was read; update rejected.")
+        return jsonify({"error": f"Invoice {invoice_number} was changed or deleted since it was read"}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error updating invoice: {e}")
         return jsonify({"error": str(e)}), 500
@@ -420,20 +1149,483 @@ def delete_invoice(invoice_number):
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
         invoice_ref = db.collection('invoices').document(invoice_number)
-        invoice_doc = invoice_ref.get()
-
-        if not invoice_doc.exists:
-            print(f"Invoice {invoice_number} not found for deletion.")
-            return jsonify({"error": f"Invoice {invoice_number} not found"}), 404
-
-        invoice_ref.delete()
+        invoice_ref.delete(option=write_precondition())
         print(f"Invoice {invoice_number} deleted successfully from Firestore.")
         return jsonify({"message": f"Invoice {invoice_number} deleted successfully"}), 200
+    except NotFound:
+        print(f"Invoice {invoice_number} not found for deletion.")
+        return jsonify({"error": f"Invoice {invoice_number} not found"}), 404
+    except FailedPrecondition:
+        print(f"Invoice {invoice_number} changed since it was read; deletion rejected.")
+        return jsonify({"error": f"Invoice {invoice_number} was changed or deleted since it was read"}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error deleting invoice {invoice_number}: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/invoices:batch', methods=['POST'])
+def batch_invoices():
+    """
+    Applies a list of invoice operations in one request, e.g. marking many invoices paid or
+    deleting test data. Upserts merge the given fields into the invoice, creating it if needed.
+    """
+    if db is None:
+        print("Error: Firestore not initialized in batch_invoices.")
+        return jsonify({"error": "Firestore not initialized"}), 500
+    operations, error_response = read_bulk_operations()
+    if error_response:
+        return error_response
+
+    def prepare_fields(op, invoice_number, data):
+        if op == 'upsert':
+            return {**data, 'invoiceNumber': invoice_number}
+        return data
+
+    try:
+        results, written = apply_bulk_operations('invoices', 'invoiceNumber', operations, prepare_fields)
+    except Exception as e:
+        print(f"Error applying invoice batch: {e}")
+        return jsonify({"error": str(e)}), 500
+    print(f"Invoice batch: {len(written)} of {len(operations)} operations applied.")
+    return bulk_response(results)
+
+
+# --- Invoice Payments ---
+# Payments are recorded server-side in one transaction: the payment is appended with ArrayUnion,
+# the totals are adjusted with Increment and the status is derived from the stored total, so
+# concurrent payments on the same invoice cannot overwrite each other. Every payment carries a
+# paymentId, which keeps identical payments distinct in the array and makes client retries safe.
+PAYMENT_AMOUNT_TOLERANCE = 0.005
+
+def derive_invoice_status(total_amount, total_paid):
+    if total_paid <= PAYMENT_AMOUNT_TOLERANCE:
+        return 'Unpaid'
+    if total_paid >= total_amount - PAYMENT_AMOUNT_TOLERANCE:
+        return 'Paid'
+    return 'Partially Paid'
+
+def build_payment(data):
+    """
+    Validates a payment request body and returns the payment to store.
+    Raises ValueError when the amount or date is invalid.
+    """
+    amount = data.get('amount')
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+        raise ValueError("'amount' must be a positive number.")
+
+    payment_date = data.get('date')
+    if payment_date:
+        try:
+            payment_date = datetime.datetime.fromisoformat(str(payment_date).replace('Z', '+00:00')).isoformat()
+        except ValueError:
+            raise ValueError("'date' must be an ISO 8601 date.")
+    else:
+        payment_date = datetime.datetime.now().isoformat()
+
+    payment = {
+        'paymentId': str(data.get('paymentId') or uuid.uuid4()),
+        'amount': float(amount),
+        'date': payment_date
+    }
+    if data.get('type'):
+        payment['type'] = data['type']
+    return payment
+
+@firestore.transactional
+def _record_invoice_payment(transaction, invoice_ref, payment):
+    invoice_doc = invoice_ref.get(transaction=transaction)
+    if not invoice_doc.exists:
+        return None, False
+    invoice = invoice_doc.to_dict()
+
+    total_amount = float(invoice.get('totalAmount') or 0.0)
+    total_paid = float(invoice.get('totalPaid') or 0.0)
+    recorded_payment = next((
+        existing_payment for existing_payment in invoice.get('payments') or []
+        if isinstance(existing_payment, dict) and existing_payment.get('paymentId') == payment['paymentId']
+    ), None)
+    if recorded_payment is not None:
+        return {
+            "payment": recorded_payment,
+            "totalPaid": total_paid,
+            "balanceAmount": invoice.get('balanceAmount'),
+            "status": invoice.get('status')
+        }, False
+
+    total_paid += payment['amount']
+    status = derive_invoice_status(total_amount, total_paid)
+    payment_update = {
+        'payments': firestore.ArrayUnion([payment]),
+        'totalPaid': firestore.Increment(payment['amount']),
+        'status': status
+    }
+    if isinstance(invoice.get('balanceAmount'), (int, float)):
+        balance_amount = invoice['balanceAmount'] - payment['amount']
+        payment_update['balanceAmount'] = firestore.Increment(-payment['amount'])
+    else:
+        # Older invoices may lack balanceAmount; an increment would start it from zero.
+        balance_amount = total_amount - total_paid
+        payment_update['balanceAmount'] = balance_amount
+    transaction.update(invoice_ref, payment_update)
+    return {
+        "payment": payment,
+        "totalPaid": round(total_paid, 2),
+        "balanceAmount": round(balance_amount, 2),
+        "status": status
+    }, True
+
+@app.route('/invoices/<invoice_number>/payments', methods=['POST'])
+def record_invoice_payment(invoice_number):
+    """
+    Records a payment on an invoice: {"amount": ..., "date": ..., "type": ..., "paymentId": ...}.
+    Only amount is required. Returns 201 with the new totals and status, or 200 when a payment
+    with the same paymentId was already recorded.
+    """
+    if db is None:
+        print("Error: Firestore not initialized in record_invoice_payment.")
+        return jsonify({"error": "Firestore not initialized"}), 500
+
+    try:
+        payment = build_payment(request.get_json() or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        invoice_ref = db.collection('invoices').document(invoice_number)
+        payment_result, recorded = _record_invoice_payment(db.transaction(), invoice_ref, payment)
+        if payment_result is None:
+            print(f"Invoice {invoice_number} not found for payment.")
+            return jsonify({"error": f"Invoice {invoice_number} not found"}), 404
+
+        if recorded:
+            print(f"Recorded payment of {payment['amount']} on invoice {invoice_number}; status is now {payment_result['status']}.")
+        return jsonify({"invoiceNumber": invoice_number, "recorded": recorded, **payment_result}), 201 if recorded else 200
+    except Exception as e:
+        print(f"Error recording payment on invoice {invoice_number}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+# --- Invoice Reports ---
+# /reports/summary answers the dashboard's totals with Firestore aggregation queries, which
+# return a single row however many invoices match. Payments are stored in an array on each
+# invoice, which aggregation queries cannot reach, so the payment-type breakdown streams a
+# projection of only the payment fields. All queries of a report run concurrently.
+INVOICE_STATUSES = ('Unpaid', 'Partially Paid', 'Paid')
+REPORT_QUERY_WORKERS = 8
+
+def aggregate_invoice_totals(query):
+    """
+    Returns the invoice count and amount totals for a query, using one aggregation query.
+    The outstanding amount sums the stored balanceAmount, which payments and edits keep current.
+    """
+    aggregation = query.count(alias='invoiceCount') \
+        .sum('totalAmount', alias='totalAmount') \
+        .sum('totalPaid', alias='totalPaid') \
+        .sum('balanceAmount', alias='balanceAmount')
+    values = {result.alias: result.value for result in aggregation.get()[0]}
+    return {
+        "invoiceCount": int(values.get('invoiceCount') or 0),
+        "totalAmount": round(values.get('totalAmount') or 0.0, 2),
+        "totalPaid": round(values.get('totalPaid') or 0.0, 2),
+        "outstandingAmount": round(values.get('balanceAmount') or 0.0, 2)
+    }
+
+def summarize_payment_types(query):
+    """
+    Sums payments by type, streaming only the payment fields of each invoice. Invoices with a
+    totalPaid but no payment entries are counted under the invoice's paymentType.
+    """
+    breakdown = {}
+    def add_payment(payment_type, amount):
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+            return
+        entry = breakdown.setdefault(payment_type or 'Unknown', {"type": payment_type or 'Unknown', "amount": 0.0, "paymentCount": 0})
+        entry['amount'] += amount
+        entry['paymentCount'] += 1
+
+    for doc in query.select(['payments', 'paymentType', 'totalPaid']).stream():
+        invoice = doc.to_dict()
+        payments = [payment for payment in invoice.get('payments') or [] if isinstance(payment, dict)]
+        for payment in payments:
+            add_payment(payment.get('type') or payment.get('paymentType') or invoice.get('paymentType'), payment.get('amount'))
+        if not payments and invoice.get('totalPaid'):
+            add_payment(invoice.get('paymentType'), invoice['totalPaid'])
+
+    for entry in breakdown.values():
+        entry['amount'] = round(entry['amount'], 2)
+    return sorted(breakdown.values(), key=lambda entry: entry['amount'], reverse=True)
+
+@app.route('/reports/summary', methods=['GET'])
+def get_report_summary():
+    """
+    Revenue and receivables for the invoices matching the year/month/mobileNumber filters of
+    GET /invoices: overall totals, totals per status, per month (for a year without a month)
+    and amounts collected per payment type. A breakdown whose index is missing is left out.
+    """
+    if db is None:
+        print("Error: Firestore not initialized in get_report_summary.")
+        return jsonify({"error": "Firestore not initialized"}), 500
+    try:
+        try:
+            query = build_invoice_query(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        year_filter = request.args.get('year')
+        month_filter = request.args.get('month')
+        months = []
+        if year_filter and (not month_filter or month_filter == 'All'):
+            months = [str(month) for month in range(1, 13)]
+
+        with ThreadPoolExecutor(max_workers=REPORT_QUERY_WORKERS) as executor:
+            payment_types_future = executor.submit(summarize_payment_types, query)
+            totals_future = executor.submit(aggregate_invoice_totals, query)
+            status_futures = {
+                status: executor.submit(aggregate_invoice_totals, query.where(filter=firestore.FieldFilter('status', '==', status)))
+                for status in INVOICE_STATUSES
+            }
+            month_futures = {
+                month: executor.submit(aggregate_invoice_totals, build_invoice_query({**request.args.to_dict(), 'month': month}))
+                for month in months
+            }
+
+            summary = totals_future.result()
+            # The breakdowns combine filters that need the composite indexes in
+            # firestore.indexes.json; until they are deployed the report leaves them out.
+            try:
+                summary['statuses'] = {status: future.result() for status, future in status_futures.items()}
+            except FailedPrecondition as e:
+                print(f"Leaving the status breakdown out of the report summary: {e}")
+            if months:
+                try:
+                    summary['months'] = [{"month": int(month), **future.result()} for month, future in month_futures.items()]
+                except FailedPrecondition as e:
+                    print(f"Leaving the monthly breakdown out of the report summary: {e}")
+            summary['paymentTypes'] = payment_types_future.result()
+
+        print(f"Report summary computed for {summary['invoiceCount']} invoices.")
+        return jsonify(summary), 200
+    except Exception as e:
+        print(f"Error computing report summary: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+# --- Customer Search Index ---
+# Type-ahead search is answered from a process-wide index instead of Firestore range queries,
+# which are case-sensitive and apply the limit before filtering. Normalized names, each word of
+# a name, and mobile-number digits are kept in sorted arrays of (key, customer_id) so a prefix
+# lookup is a bisect plus a short scan. A snapshot listener keeps the index current; with
+# CUSTOMER_INDEX_USE_LISTENER disabled it is instead rebuilt in the background after
+# CUSTOMER_INDEX_TTL_SECONDS, while the old index keeps answering searches (writes from this
+# instance are applied immediately either way).
+_customer_index = None
+_customer_index_lock = threading.RLock()
+_customer_index_load_lock = threading.Lock()
+_customer_index_watch = None
+_customer_index_refreshing = False
+# While a rebuild reads the collection, writes from this instance are recorded here and
+# replayed onto the new index before it replaces the old one.
+_customer_index_pending_writes = None
+
+def normalize_search_text(text):
+    decomposed = unicodedata.normalize('NFKD', str(text or ''))
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(without_accents.casefold().split())
+
+def _customer_index_keys(customer_id, customer_data):
+    name_key = normalize_search_text(customer_data.get('name'))
+    word_keys = name_key.split()[1:]
+    mobile_digits = re.sub(r'\D', '', customer_data.get('mobileNumber') or customer_id or '')
+    return name_key, word_keys, mobile_digits
+
+def _new_customer_index(customers):
+    index = {"customers": {}, "names": [], "words": [], "mobiles": [], "loaded_at": time.monotonic()}
+    for customer_id, customer_data in customers.items():
+        name_key, word_keys, mobile_digits = _customer_index_keys(customer_id, customer_data)
+        index['customers'][customer_id] = customer_data
+        index['names'].append((name_key, customer_id))
+        index['words'].extend((word_key, customer_id) for word_key in word_keys)
+        if mobile_digits:
+            index['mobiles'].append((mobile_digits, customer_id))
+    index['names'].sort()
+    index['words'].sort()
+    index['mobiles'].sort()
+    return index
+
+def _remove_sorted_entry(entries, entry):
+    position = bisect.bisect_left(entries, entry)
+    if position < len(entries) and entries[position] == entry:
+        del entries[position]
+
+def _index_customer(index, customer_id, customer_data):
+    _unindex_customer(index, customer_id)
+    name_key, word_keys, mobile_digits = _customer_index_keys(customer_id, customer_data)
+    index['customers'][customer_id] = customer_data
+    bisect.insort(index['names'], (name_key, customer_id))
+    for word_key in word_keys:
+        bisect.insort(index['words'], (word_key, customer_id))
+    if mobile_digits:
+        bisect.insort(index['mobiles'], (mobile_digits, customer_id))
+
+def _unindex_customer(index, customer_id):
+    customer_data = index['customers'].pop(customer_id, None)
+    if customer_data is None:
+        return
+    name_key, word_keys, mobile_digits = _customer_index_keys(customer_id, customer_data)
+    _remove_sorted_entry(index['names'], (name_key, customer_id))
+    for word_key in word_keys:
+        _remove_sorted_entry(index['words'], (word_key, customer_id))
+    if mobile_digits:
+        _remove_sorted_entry(index['mobiles'], (mobile_digits, customer_id))
+
+def _apply_customer_write(index, customer_id, customer_fields):
+    """Applies a merge write (or a delete, when customer_fields is None) to an index."""
+    if customer_fields is None:
+        _unindex_customer(index, customer_id)
+        return
+    customer_data = dict(index['customers'].get(customer_id, {}))
+    for field, value in customer_fields.items():
+        if value is firestore.SERVER_TIMESTAMP:
+            value = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        customer_data[field] = value
+    customer_data['mobileNumber'] = customer_id
+    _index_customer(index, customer_id, customer_data)
+
+def load_customer_index():
+    """
+    Reads the customers collection and replaces the search index. The collection is read
+    without holding _customer_index_lock, so searches keep using the current index meanwhile.
+    """
+    global _customer_index, _customer_index_pending_writes
+    with _customer_index_lock:
+        _customer_index_pending_writes = []
+    try:
+        customers = {doc.id: serialize_customer(doc) for doc in db.collection('customers').stream()}
+        index = _new_customer_index(customers)
+        with _customer_index_lock:
+            for customer_id, customer_fields in _customer_index_pending_writes:
+                _apply_customer_write(index, customer_id, customer_fields)
+            _customer_index = index
+    finally:
+        with _customer_index_lock:
+            _customer_index_pending_writes = None
+    print(f"Customer search index loaded with {len(customers)} customers.")
+    return index
+
+def _refresh_customer_index():
+    global _customer_index_refreshing
+    try:
+        with _customer_index_load_lock:
+            load_customer_index()
+    except Exception as e:
+        print(f"Error rebuilding customer search index: {e}")
+    finally:
+        _customer_index_refreshing = False
+
+def _customer_index_is_fresh(index):
+    return index is not None and (_customer_index_watch is not None or
+                                  time.monotonic() - index['loaded_at'] < app.config['CUSTOMER_INDEX_TTL_SECONDS'])
+
+def get_customer_index():
+    """
+    Returns the search index. Only callers arriving before the first load wait for it; an
+    expired index is returned as-is while one background thread rebuilds it.
+    """
+    global _customer_index_refreshing
+    index = _customer_index
+    if _customer_index_is_fresh(index):
+        return index
+    if index is None:
+        with _customer_index_load_lock:
+            # Another thread may have loaded the index while we waited for the lock.
+            return _customer_index if _customer_index is not None else load_customer_index()
+    with _customer_index_lock:
+        if _customer_index_refreshing:
+            return index
+        _customer_index_refreshing = True
+    threading.Thread(target=_refresh_customer_index, daemon=True).start()
+    return index
+
+def _prefix_matches(entries, prefix):
+    position = bisect.bisect_left(entries, (prefix,))
+    while position < len(entries) and entries[position][0].startswith(prefix):
+        yield entries[position][1]
+        position += 1
+
+def search_customer_index(query_text, limit=10):
+    """
+    Returns up to `limit` customers whose mobile number, name, or any word of their name starts
+    with query_text (case- and accent-insensitive), ranked in that order and then alphabetically.
+    """
+    index = get_customer_index()
+    name_prefix = normalize_search_text(query_text)
+    digits_prefix = re.sub(r'\D', '', query_text)
+    if not name_prefix:
+        return []
+
+    candidate_groups = []
+    if digits_prefix and digits_prefix == re.sub(r'[\s()+-]', '', query_text):
+        candidate_groups.append(index['mobiles'])
+    candidate_groups.extend([index['names'], index['words']])
+
+    results = []
+    seen_ids = set()
+    with _customer_index_lock:
+        for entries in candidate_groups:
+            prefix = digits_prefix if entries is index['mobiles'] else name_prefix
+            for customer_id in _prefix_matches(entries, prefix):
+                if customer_id in seen_ids:
+                    continue
+                seen_ids.add(customer_id)
+                results.append(dict(index['customers'][customer_id]))
+                if len(results) >= limit:
+                    return results
+    return results
+
+def update_customer_index(customer_id, customer_fields):
+    """
+    Applies a merge write made by this instance to the index.
+    """
+    with _customer_index_lock:
+        if _customer_index_pending_writes is not None:
+            _customer_index_pending_writes.append((customer_id, dict(customer_fields)))
+        if _customer_index is not None:
+            _apply_customer_write(_customer_index, customer_id, customer_fields)
+
+def remove_from_customer_index(customer_id):
+    with _customer_index_lock:
+        if _customer_index_pending_writes is not None:
+            _customer_index_pending_writes.append((customer_id, None))
+        if _customer_index is not None:
+            _apply_customer_write(_customer_index, customer_id, None)
+
+def _on_customers_snapshot(docs, changes, read_time):
+    global _customer_index
+    with _customer_index_lock:
+        if _customer_index is None or _customer_index.get('from_listener') is not True:
+            # The first snapshot delivers every document; build the index in bulk.
+            _customer_index = _new_customer_index({doc.id: serialize_customer(doc) for doc in docs})
+            _customer_index['from_listener'] = True
+            print(f"Customer search index built from snapshot with {len(_customer_index['customers'])} customers.")
+            return
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                _unindex_customer(_customer_index, change.document.id)
+            else:
+                _index_customer(_customer_index, change.document.id, serialize_customer(change.document))
+
+def start_customer_index_listener():
+    global _customer_index_watch
+    if _customer_index_watch is None:
+        _customer_index_watch = db.collection('customers').on_snapshot(_on_customers_snapshot)
+        print("Customer search index snapshot listener started.")
+
+if app.config['CUSTOMER_INDEX_USE_LISTENER']:
+    start_customer_index_listener()
+
+
 # --- Customer Routes (Integrated directly into app.py) ---
 @app.route('/customers', methods=['POST'])
 def save_or_update_customer():
@@ -454,7 +1646,7 @@ def save_or_update_customer():
             return jsonify({"error": "Mobile number is required"}), 400
 
         customer_ref = db.collection('customers').document(mobile_number)
-        customer_ref.set({
+        customer_fields = {
             'name': name,
             'address': address,
             'email': email,
@@ -462,7 +1654,9 @@ def save_or_update_customer():
             'taxNumber': tax_number,
             'isGeneratedId': is_generated_id,
             'lastUpdated': firestore.SERVER_TIMESTAMP
-        }, merge=True)
+        }
+        customer_ref.set(customer_fields, merge=True)
+        update_customer_index(mobile_number, customer_fields)
 
         print(f"Customer {mobile_number} details saved/updated.")
         return jsonify({"message": "Customer details saved/updated"}), 200
@@ -470,11 +1664,19 @@ def save_or_update_customer():
         print(f"Error saving/updating customer: {e}")
         return jsonify({"error": str(e)}), 500
 
+def serialize_customer(doc):
+    customer_data = doc.to_dict()
+    customer_data['mobileNumber'] = doc.id
+    if isinstance(customer_data.get('lastUpdated'), datetime.datetime):
+        customer_data['lastUpdated'] = customer_data['lastUpdated'].isoformat()
+    return customer_data
+
 @app.route('/customers', methods=['GET'])
 def get_all_customers_or_search():
     """
     Fetches all customers if no search parameters are provided,
     otherwise searches by name (case-insensitive, starts with) or mobile number.
+    The full listing is streamed for Accept: application/x-ndjson or ?stream=1.
     """
     if db is None:
         print("Error: Firestore not initialized in get_all_customers_or_search.")
@@ -485,26 +1687,22 @@ def get_all_customers_or_search():
 
     try:
         query = db.collection('customers')
+
+        if not search_name and not mobile_number_filter and wants_streamed_response():
+            print("Streaming all customers.")
+            return stream_documents_response(query.stream(), serialize_customer)
         
         if search_name:
-            end_name = search_name + '\uf8ff'
-            query = query.where(filter=firestore.FieldFilter('name', '>=', search_name)).where(filter=firestore.FieldFilter('name', '<', end_name)).limit(10)
-        elif mobile_number_filter:
+            customers = search_customer_index(search_name, limit=10)
+            print(f"Found {len(customers)} customers.")
+            return jsonify(customers), 200
+
+        if mobile_number_filter:
             query = query.where(filter=firestore.FieldFilter('mobileNumber', '==', mobile_number_filter)).limit(1)
         
         docs = query.stream()
         
-        customers = []
-        for doc in docs:
-            customer_data = doc.to_dict()
-            customer_data['mobileNumber'] = doc.id
-            
-            if search_name and not customer_data['name'].lower().startswith(search_name.lower()):
-                continue
-
-            if 'lastUpdated' in customer_data and isinstance(customer_data['lastUpdated'], datetime.datetime):
-                customer_data['lastUpdated'] = customer_data['lastUpdated'].isoformat()
-            customers.append(customer_data)
+        customers = [serialize_customer(doc) for doc in docs]
         
         print(f"Found {len(customers)} customers.")
         return jsonify(customers), 200
@@ -527,7 +1725,7 @@ def get_customer_by_mobile(mobile_number):
             customer_data = customer_doc.to_dict()
             customer_data['mobileNumber'] = customer_doc.id
             print(f"Customer {mobile_number} fetched successfully.")
-            return jsonify(customer_data), 200
+            return set_document_etag(jsonify(customer_data), customer_doc.update_time), 200
         else:
             print(f"Customer {mobile_number} not found.")
             return jsonify({"error": f"Customer {mobile_number} not found"}), 404
@@ -546,56 +1744,157 @@ def delete_customer(mobile_number):
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
         customer_ref = db.collection('customers').document(mobile_number)
-        customer_doc = customer_ref.get()
-
-        if not customer_doc.exists:
-            print(f"Customer {mobile_number} not found for deletion.")
-            return jsonify({"error": f"Customer {mobile_number} not found"}), 404
-
-        customer_ref.delete()
+        customer_ref.delete(option=write_precondition())
+        remove_from_customer_index(mobile_number)
         print(f"Customer {mobile_number} deleted successfully from Firestore.")
         return jsonify({"message": f"Customer {mobile_number} deleted successfully"}), 200
+    except NotFound:
+        print(f"Customer {mobile_number} not found for deletion.")
+        return jsonify({"error": f"Customer {mobile_number} not found"}), 404
+    except FailedPrecondition:
+        print(f"Customer {mobile_number} changed since it was read; deletion rejected.")
+        return jsonify({"error": f"Customer {mobile_number} was changed or deleted since it was read"}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error deleting customer {mobile_number}: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/customers/import/analyze', methods=['POST'])
-def analyze_customers_for_import():
+CUSTOMER_EDITABLE_FIELDS = ('name', 'address', 'email', 'taxId', 'taxNumber', 'isGeneratedId')
+
+@app.route('/customers:batch', methods=['POST'])
+def batch_customers():
+    """
+    Applies a list of customer operations in one request. Only the fields that
+    POST /customers accepts are written; the customer search index is kept in step.
+    """
     if db is None:
-        print("Error: Firestore not initialized in analyze_customers_for_import.")
+        print("Error: Firestore not initialized in batch_customers.")
         return jsonify({"error": "Firestore not initialized"}), 500
+    operations, error_response = read_bulk_operations()
+    if error_response:
+        return error_response
 
-    data = request.get_json()
-    file_content_raw = data.get('file_content')
-    file_format = data.get('file_format')
-
-    if not file_content_raw:
-        return jsonify({"error": "No file content provided"}), 400
-
-    content_for_llm = ""
-    if file_format == 'pdf':
-        try:
-            pdf_bytes = base64.b64decode(file_content_raw)
-            reader = PdfReader(io.BytesIO(pdf_bytes))
-            for page in reader.pages:
-                content_for_llm += page.extract_text() + "\n"
-            if not content_for_llm.strip():
-                return jsonify({"error": "Could not extract text from PDF. It might be an image-based PDF or corrupted."}), 400
-            print("Successfully extracted text from PDF for LLM analysis.")
-        except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
-            return jsonify({"error": f"Failed to process PDF file: {e}"}), 400
-    else:
-        content_for_llm = file_content_raw
+    def prepare_fields(op, mobile_number, data):
+        customer_fields = {field: data[field] for field in CUSTOMER_EDITABLE_FIELDS if field in data}
+        customer_fields['lastUpdated'] = firestore.SERVER_TIMESTAMP
+        return customer_fields
 
     try:
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash-latest"
-        )
-        
-        customer_schema = {
-            "type": "array",
-            "items": {
+        results, written = apply_bulk_operations('customers', 'mobileNumber', operations, prepare_fields)
+    except Exception as e:
+        print(f"Error applying customer batch: {e}")
+        return jsonify({"error": str(e)}), 500
+    for op, mobile_number, customer_fields in written:
+        if op == 'delete':
+            remove_from_customer_index(mobile_number)
+        else:
+            update_customer_index(mobile_number, customer_fields)
+    print(f"Customer batch: {len(written)} of {len(operations)} operations applied.")
+    return bulk_response(results)
+
+# --- Import Mapping ---
+# Schemas and prompts used to map uploaded files onto customers and invoices with Gemini.
+# Bump IMPORT_PROMPT_VERSION whenever the prompts or schemas change to invalidate cached mappings.
+IMPORT_PROMPT_VERSION = 1
+LLM_MAPPING_CACHE_COLLECTION = 'llm_mapping_cache'
+
+configure_mapping_cache(
+    max_entries=app.config['LLM_CACHE_MAX_ENTRIES'],
+    ttl_seconds=app.config['LLM_CACHE_TTL_HOURS'] * 3600,
+    persistent_collection=db.collection(LLM_MAPPING_CACHE_COLLECTION) if app.config['LLM_CACHE_PERSISTENT'] else None
+)
+
+CUSTOMER_IMPORT_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "mobileNumber": {"type": "string", "nullable": True},
+            "name": {"type": "string"},
+            "address": {"type": "string", "nullable": True},
+            "email": {"type": "string", "nullable": True},
+            "taxId": {"type": "string", "nullable": True},
+            "taxNumber": {"type": "string", "nullable": True},
+        },
+        "required": ["name"]
+    }
+}
+
+def build_customer_import_prompt(content_for_llm, file_format):
+    return f"""
+    You are an expert data mapper. Your task is to extract customer information from the provided text and format it as a JSON array of customer objects.
+    Each customer object must adhere to the following JSON schema:
+    {json.dumps(CUSTOMER_IMPORT_SCHEMA, indent=2)}
+
+    If a field is not present in the input text, it should be omitted or set to null.
+    The 'name' field is required. If 'name' is missing for a record, discard that record.
+    Combine address lines into a single string separated by newlines if multiple lines are implied.
+    If a mobile number is not explicitly found, set 'mobileNumber' to null.
+
+    Input data (original format: {file_format}):
+    ---
+    {content_for_llm}
+    ---
+
+    Please return ONLY the JSON array.
+    """
+
+# Define the desired JSON schema for invoice and customer data
+# Each item in the array will represent an invoice, and can optionally include customer details
+INVOICE_IMPORT_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "invoice": {
+                "type": "object",
+                "properties": {
+                    "invoiceNumber": {"type": "string", "nullable": True}, # Can be null for new invoices
+                    "billToName": {"type": "string"},
+                    "billToAddress": {"type": "string", "nullable": True},
+                    "mobileNumber": {"type": "string", "nullable": True},
+                    "paymentType": {"type": "string", "nullable": True},
+                    "items": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "productId": {"type": "string", "nullable": True},
+                                "name": {"type": "string"},
+                                "price": {"type": "number"},
+                                "quantity": {"type": "integer"},
+                                "subtotal": {"type": "number"},
+                            },
+                            "required": ["name", "price", "quantity", "subtotal"]
+                        }
+                    },
+                    "totalAmount": {"type": "number"},
+                    "invoiceDate": {"type": "string"}, # ISO format
+                    "invoiceTaxPercentage": {"type": "number", "nullable": True},
+                    "invoiceShippingCost": {"type": "number", "nullable": True},
+                    "invoiceDiscountPercentage": {"type": "number", "nullable": True},
+                    "status": {"type": "string", "nullable": True},
+                    "dueDate": {"type": "string", "nullable": True}, # ISO format
+                    "totalPaid": {"type": "number", "nullable": True},
+                    "payments": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "amount": {"type": "number"},
+                                "date": {"type": "string"}, # ISO format
+                                "type": {"type": "string", "nullable": True}
+                            },
+                            "required": ["amount", "date"]
+                        }
+                    },
+                    "daysDue": {"type": "integer", "nullable": True},
+                    "invoiceType": {"type": "string", "nullable": True},
+                },
+                "required": ["billToName", "items", "totalAmount", "invoiceDate"]
+            },
+            "customer": { # Extracted customer details, potentially for saving
                 "type": "object",
                 "properties": {
                     "mobileNumber": {"type": "string", "nullable": True},
@@ -607,104 +1906,707 @@ def analyze_customers_for_import():
                 },
                 "required": ["name"]
             }
-        }
+        },
+        "required": ["invoice", "customer"] # Each analyzed item must have an invoice and customer part
+    }
+}
+
+def build_invoice_import_prompt(content_for_llm, file_format):
+    return f"""
+    You are an expert data mapper for invoices and customers. Your task is to extract invoice and associated customer information from the provided text and format it as a JSON array.
+    Each item in the array must be an object containing an 'invoice' object and a 'customer' object, adhering to the following JSON schema:
+    {json.dumps(INVOICE_IMPORT_SCHEMA, indent=2)}
+
+    For the 'invoice' object:
+    - 'invoiceNumber' can be null if not explicitly found.
+    - 'invoiceDate' and 'dueDate' must be in ISO 8601 format (e.g., "YYYY-MM-DDTHH:MM:SS"). If time is not specified, use "00:00:00". If date is not specified, use today's date.
+    - 'totalAmount' should be the final total after all calculations.
+    - 'items' should be a list of product items. If subtotal is not explicit, calculate it as price * quantity.
+    - 'payments' should be a list of payment records. 'date' in payments must also be ISO 8601.
+    - Set numeric fields (tax, shipping, discount, totalPaid) to 0.0 if not found.
+    - Set 'status' to 'Unpaid' if not found.
+    - Set 'invoiceType' to 'Invoice' if not found.
+    - Set 'daysDue' to 1 if not found.
+
+    For the 'customer' object:
+    - 'mobileNumber' can be null if not explicitly found.
+    - 'name' is required. If 'name' is missing for a customer, discard that customer record.
+    - Combine address lines into a single string separated by newlines if multiple lines are implied.
+
+    If a field is not present in the input text, it should be omitted or set to null, unless a default is specified above.
+    If an invoice record cannot be fully parsed (e.g., missing billToName, items, totalAmount, or invoiceDate), discard that entire invoice record.
+
+    Input data (original format: {file_format}):
+    ---
+    {content_for_llm}
+    ---
+
+    Please return ONLY the JSON array.
+    """
 
-        prompt = f"""
-        You are an expert data mapper. Your task is to extract customer information from the provided text and format it as a JSON array of customer objects.
-        Each customer object must adhere to the following JSON schema:
-        {json.dumps(customer_schema, indent=2)}
+# --- Import Uploads ---
+# Import files can be sent as multipart/form-data (a 'file' part plus an optional 'file_format'
+# field), as a raw request body (?file_format=... or a matching Content-Type), or, as before,
+# inside a JSON body as text or base64. Every form is spooled to a temporary file that the
+# analysis reads from disk, so no full copy of a large file is held in memory.
+IMPORT_BINARY_FORMATS = ('pdf', 'xlsx')
+IMPORT_CONTENT_TYPE_FORMATS = {
+    'application/pdf': 'pdf',
+    'text/csv': 'csv',
+    'text/tab-separated-values': 'tsv',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+    'application/json': 'json',
+    'text/plain': 'text',
+}
+IMPORT_EXTENSION_FORMATS = {'pdf': 'pdf', 'csv': 'csv', 'tsv': 'tsv', 'xlsx': 'xlsx', 'json': 'json', 'txt': 'text'}
+
+def detect_import_format(filename=None, content_type=None):
+    if filename and '.' in filename:
+        extension_format = IMPORT_EXTENSION_FORMATS.get(filename.rsplit('.', 1)[1].lower())
+        if extension_format:
+            return extension_format
+    return IMPORT_CONTENT_TYPE_FORMATS.get(content_type)
+
+def _spool_import_upload(max_bytes):
+    if request.mimetype == 'multipart/form-data':
+        # Werkzeug spools file parts to disk while parsing; refuse bodies far beyond the limit up front.
+        request.max_content_length = max_bytes + 1024 * 1024
+        uploaded_file = request.files.get('file')
+        if uploaded_file is None:
+            raise ValueError("No file content provided")
+        file_format = request.form.get('file_format') or detect_import_format(uploaded_file.filename, uploaded_file.mimetype)
+        if not file_format:
+            raise ValueError("Could not determine the file format; pass a 'file_format' field.")
+        return spool_stream_to_file(uploaded_file.stream, max_bytes, suffix=file_format), file_format
+
+    if request.mimetype == 'application/json' and 'file_format' not in request.args:
+        # get_json reads the whole body into memory; base64 content is 4/3 the size of the file.
+        request.max_content_length = max_bytes * 4 // 3 + 1024 * 1024
+        data = request.get_json()
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be a JSON object.")
+        file_content_raw = data.get('file_content')
+        file_format = data.get('file_format')
+        if not file_content_raw:
+            raise ValueError("No file content provided")
+        if not isinstance(file_content_raw, str):
+            raise ValueError("file_content must be a string.")
+        if file_format in IMPORT_BINARY_FORMATS:
+            return spool_base64_to_file(file_content_raw, max_bytes, suffix=file_format), file_format
+        return spool_text_to_file(file_content_raw, max_bytes, suffix=file_format), file_format
+
+    file_format = request.args.get('file_format') or detect_import_format(content_type=request.mimetype)
+    if not file_format:
+        raise ValueError("Could not determine the file format; pass ?file_format=...")
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+    return spool_stream_to_file(request.stream, max_bytes, suffix=file_format), file_format
+
+def receive_import_upload():
+    """
+    Spools the uploaded import file. Returns (path, file_format, error_response); error_response
+    is set, and path is None, when the upload is missing, unreadable or too large.
+    The caller deletes the file once the analysis no longer needs it.
+    """
+    try:
+        import_path, file_format = _spool_import_upload(app.config['IMPORT_MAX_UPLOAD_BYTES'])
+        return import_path, file_format, None
+    except (UploadTooLargeError, RequestEntityTooLarge):
+        return None, None, (jsonify({"error": f"File is larger than the {app.config['IMPORT_MAX_UPLOAD_BYTES']} byte upload limit."}), 413)
+    except ValueError as e:
+        return None, None, (jsonify({"error": str(e)}), 400)
+
+def discard_import_upload(import_path):
+    try:
+        os.unlink(import_path)
+    except OSError as e:
+        print(f"Error removing spooled import file {import_path}: {e}")
 
-        If a field is not present in the input text, it should be omitted or set to null.
-        The 'name' field is required. If 'name' is missing for a record, discard that record.
-        Combine address lines into a single string separated by newlines if multiple lines are implied.
-        If a mobile number is not explicitly found, set 'mobileNumber' to null.
+def extract_pdf_pages(import_path):
+    """
+    Returns an iterator over the page texts of a spooled PDF, extracted in the PDF process pool,
+    enforcing the configured size and page limits.
+    """
+    pdf_size = os.path.getsize(import_path)
+    if pdf_size > app.config['PDF_MAX_BYTES']:
+        raise ValueError(f"PDF is {pdf_size} bytes; the limit is {app.config['PDF_MAX_BYTES']} bytes.")
+    return iter_pdf_page_texts(
+        import_path,
+        max_pages=app.config['PDF_MAX_PAGES'],
+        max_workers=app.config['PDF_EXTRACT_WORKERS'],
+        pages_per_task=app.config['PDF_PAGES_PER_TASK']
+    )
+
+def load_import_segments(import_path, file_format):
+    """
+    Turns a spooled import file into (header, segments) for the LLM chunker:
+    one segment per page for PDFs, one per record otherwise. PDF pages are an iterator,
+    extracted as the chunker reaches them.
+    """
+    if file_format == 'pdf':
+        return None, extract_pdf_pages(import_path)
+    if file_format == 'xlsx':
+        return table_to_csv_lines(*read_table(import_path, file_format))
+    return split_import_records(read_spooled_text(import_path), file_format)
 
-        Input data (original format: {file_format}):
-        ---
-        {content_for_llm}
-        ---
+def chunk_import_segments(import_header, import_segments):
+    return chunk_segments(import_segments, app.config['LLM_CHUNK_MAX_CHARS'], header=import_header)
 
-        Please return ONLY the JSON array.
-        """
+def load_import_chunks(import_path, file_format):
+    """
+    Extracts and chunks a spooled import file for the LLM. Returns (chunks, error), where error
+    is a 400 body when the file cannot be read or a PDF has no extractable text.
+    """
+    try:
+        chunks = chunk_import_segments(*load_import_segments(import_path, file_format))
+    except Exception as e:
+        print(f"Error extracting text from PDF: {e}")
+        return None, {"error": f"Failed to process PDF file: {e}"}
+    if file_format == 'pdf' and not any(chunk.strip() for chunk in chunks):
+        return None, {"error": "Could not extract text from PDF. It might be an image-based PDF or corrupted."}
+    return chunks, None
+
+def map_import_records(chunks, file_format, response_schema, build_prompt, progress=None):
+    print(f"Sending {len(chunks)} chunks to the LLM for mapping.")
+    if progress is not None:
+        progress(0, len(chunks))
+    return extract_records(
+        lambda chunk: build_prompt(chunk, file_format),
+        response_schema,
+        chunks,
+        max_workers=app.config['LLM_MAX_WORKERS'],
+        max_retries=app.config['LLM_MAX_RETRIES'],
+        timeout=app.config['LLM_REQUEST_TIMEOUT_SECONDS'],
+        prompt_version=IMPORT_PROMPT_VERSION,
+        progress=progress
+    )
+
+# --- Tabular Import Fast Path ---
+# CSV/TSV/XLSX files are parsed locally and the LLM only maps their column headers onto the
+# import fields. Mappings are cached by header fingerprint, so later files with the same layout
+# are imported without any LLM call.
+TABULAR_SAMPLE_ROWS = 5
+TABULAR_REQUIRED_FIELDS = {
+    'customers': [['name']],
+    'invoices': [['billToName', 'customerName'], ['itemName']]
+}
+
+def build_column_mapping_prompt(headers, sample_rows, kind):
+    target_fields = CUSTOMER_COLUMN_FIELDS if kind == 'customers' else INVOICE_COLUMN_FIELDS
+    sample_lines = "\n".join(json.dumps(dict(zip(headers, row))) for row in sample_rows)
+    return f"""
+    You are an expert data mapper. A spreadsheet of {kind} has the columns listed below.
+    Map each of these target fields to the column(s) that hold its value: {", ".join(target_fields)}.
+    Fields prefixed with 'item' describe one invoice line item per row; fields prefixed with 'customer' describe the customer.
+    Use the exact column names. List several columns for a field only when their values should be joined (e.g. address lines).
+    Leave a field empty when no column matches. Set 'dateFormat' to the Python strptime format of the date columns, or null.
+
+    Columns: {json.dumps(headers)}
+
+    Sample rows:
+    {sample_lines}
+
+    Please return ONLY the JSON object.
+    """
 
-        max_retries = 5
-        llm_output_text = ""
-        for i in range(max_retries):
-            try:
-                response = model.generate_content(
-                    contents=[{"parts": [{"text": prompt}]}],
-                    generation_config={
-                        "response_mime_type": "application/json",
-                        "response_schema": customer_schema
-                    },
-                    safety_settings={
-                        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                    },
-                    request_options={"timeout": 300} # Add this line
-                )
-                
-                if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                    llm_output_text = response.candidates[0].content.parts[0].text
-                    break
-                else:
-                    raise ValueError("LLM response is empty or malformed.")
-            except Exception as e:
-                print(f"LLM call failed (attempt {i+1}/{max_retries}): {e}")
-                if i < max_retries - 1:
-                    time.sleep(2 ** i)
-                else:
-                    raise
+def get_column_mapping(headers, rows, kind):
+    """
+    Returns the resolved {field: [column indexes]} mapping for a table layout, asking the LLM only
+    when no mapping is cached for the header fingerprint.
+    """
+    target_fields = CUSTOMER_COLUMN_FIELDS if kind == 'customers' else INVOICE_COLUMN_FIELDS
+    response_schema = column_mapping_schema(target_fields)
+    cache_key = mapping_cache_key(f"columns:{kind}:{header_fingerprint(headers)}", response_schema, IMPORT_PROMPT_VERSION)
+    column_mapping = get_cached_mapping(cache_key)
+    if column_mapping is not None:
+        return column_mapping
+
+    llm_mapping = generate_json(
+        build_column_mapping_prompt(headers, rows[:TABULAR_SAMPLE_ROWS], kind),
+        response_schema,
+        max_retries=app.config['LLM_MAX_RETRIES'],
+        timeout=app.config['LLM_REQUEST_TIMEOUT_SECONDS']
+    )
+    if not isinstance(llm_mapping, dict):
+        raise ValueError("LLM did not return a JSON object.")
+    column_mapping = resolve_column_mapping(llm_mapping, headers, target_fields)
+    store_cached_mapping(cache_key, column_mapping)
+    return column_mapping
+
+def map_tabular_import(import_table, kind):
+    """
+    Maps a parsed table into import records without sending its rows to the LLM. Returns None
+    when no usable column mapping is found, so the caller falls back to row-by-row mapping.
+    """
+    headers, rows = import_table
+    if not headers or not rows:
+        return None
+    try:
+        column_mapping = get_column_mapping(headers, rows, kind)
+    except Exception as e:
+        print(f"Error mapping import columns: {e}")
+        return None
+    if not all(any(field in column_mapping for field in alternatives) for alternatives in TABULAR_REQUIRED_FIELDS[kind]):
+        print(f"Column mapping for {kind} import is missing required fields; falling back to row-by-row mapping.")
+        return None
+
+    if kind == 'customers':
+        records = build_customer_records(rows, column_mapping)
+    else:
+        records = build_invoice_records(rows, column_mapping)
+    print(f"Mapped {len(rows)} {kind} rows locally using the column mapping.")
+    return records
+
+def read_tabular_import(import_path, file_format, kind):
+    """
+    Runs the fast path for tabular formats. Returns (records, error): records is None when the
+    file is not tabular or needs row-by-row mapping; error is a 400 body when it cannot be read.
+    """
+    if file_format not in TABULAR_IMPORT_FORMATS:
+        return None, None
+    try:
+        import_table = read_table(import_path, file_format)
+    except Exception as e:
+        print(f"Error reading {file_format} import file: {e}")
+        return None, {"error": f"Failed to read {file_format.upper()} file: {e}"}
+    return map_tabular_import(import_table, kind), None
+
+def analyze_customer_record(customer_data, existing_customer_ids):
+    """
+    Marks a mapped customer as 'new' or 'updated'. Returns False when the record has no name
+    and must be left out of the analysis.
+    """
+    if not customer_data.get('name'):
+        print(f"Skipping record during analysis due to missing name: {customer_data}")
+        return False
+
+    mobile_number = customer_data.get('mobileNumber')
+    if mobile_number and mobile_number in existing_customer_ids:
+        customer_data['_status'] = 'updated'
+    else:
+        customer_data['_status'] = 'new'
+    return True
+
+def analyze_invoice_record(item, existing_customer_ids, existing_invoice_ids):
+    """
+    Marks the customer and invoice of a mapped {invoice, customer} item as 'new', 'updated' or
+    'skipped', and fills in missing or unparseable dates. Returns False when the item lacks an
+    invoice or a customer and must be left out of the analysis.
+    """
+    invoice_data = item.get('invoice')
+    customer_data = item.get('customer')
+
+    if not invoice_data or not customer_data:
+        print(f"Skipping record due to missing invoice or customer data: {item}")
+        return False
+
+    # --- Analyze Customer ---
+    customer_mobile_number = customer_data.get('mobileNumber')
+    customer_name = customer_data.get('name')
+
+    if not customer_name:
+        print(f"Skipping customer analysis for record due to missing name: {customer_data}")
+        customer_data['_status'] = 'skipped' # Mark customer as skipped
+    elif customer_mobile_number and customer_mobile_number in existing_customer_ids:
+        customer_data['_status'] = 'updated'
+    else:
+        customer_data['_status'] = 'new'
+
+    # --- Analyze Invoice ---
+    invoice_number = invoice_data.get('invoiceNumber')
+
+    if not invoice_data.get('billToName') or not invoice_data.get('items') or not invoice_data.get('totalAmount') or not invoice_data.get('invoiceDate'):
+        print(f"Skipping invoice analysis for record due to missing required fields: {invoice_data}")
+        invoice_data['_status'] = 'skipped' # Mark invoice as skipped
+        return True
+
+    # Ensure dates are in correct format for comparison
+    try:
+        invoice_date_str = invoice_data['invoiceDate']
+        datetime.datetime.fromisoformat(invoice_date_str.replace('Z', '+00:00'))
+    except ValueError:
+        invoice_data['invoiceDate'] = datetime.datetime.now().isoformat()
+        print(f"Corrected invoiceDate format for {invoice_number}")
+
+    if invoice_data.get('dueDate'):
+        try:
+            due_date_str = invoice_data['dueDate']
+            datetime.datetime.fromisoformat(due_date_str.replace('Z', '+00:00'))
+        except ValueError:
+            invoice_data['dueDate'] = (datetime.datetime.now() + datetime.timedelta(days=invoice_data.get('daysDue', 1))).isoformat()
+            print(f"Corrected dueDate format for {invoice_number}")
+    else:
+        invoice_data['dueDate'] = (datetime.datetime.now() + datetime.timedelta(days=invoice_data.get('daysDue', 1))).isoformat()
+
+    if invoice_number and invoice_number in existing_invoice_ids:
+        invoice_data['_status'] = 'updated'
+    else:
+        invoice_data['_status'] = 'new'
+    return True
+
+@app.route('/llm-cache/stats', methods=['GET'])
+def get_llm_cache_stats():
+    """
+    Returns hit/miss counters for the LLM import mapping cache.
+    """
+    return jsonify(mapping_cache_stats()), 200
+
+
+# --- Import Jobs ---
+# Import analysis can spend minutes in LLM calls, so clients may run it as a background job
+# (?async=1 or "Prefer: respond-async") instead of holding a request thread. Job state lives in
+# Firestore so any instance can answer the poll; analyzed records go to a results subcollection
+# to stay under the document size limit.
+IMPORT_JOBS_COLLECTION = 'import_jobs'
+IMPORT_JOB_RESULTS_COLLECTION = 'results'
+IMPORT_JOB_RESULTS_PER_DOCUMENT = 200
+
+_import_job_executor = ThreadPoolExecutor(
+    max_workers=app.config['IMPORT_JOB_WORKERS'], thread_name_prefix='import-job'
+)
+_import_job_slots = threading.BoundedSemaphore(app.config['IMPORT_JOB_MAX_PENDING'])
+
+def wants_async_import():
+    return request.args.get('async') == '1' or 'respond-async' in request.headers.get('Prefer', '')
+
+def _import_job_expiry():
+    return datetime.datetime.now(datetime.timezone.utc) + \
+        datetime.timedelta(hours=app.config['IMPORT_JOB_RETENTION_HOURS'])
+
+def _import_job_is_stale(job):
+    # Running jobs write progress as each chunk completes; queued jobs may wait behind others.
+    return job.get('status') == 'running' and \
+        time.time() - job.get('updatedAt', 0) > app.config['IMPORT_JOB_STALE_SECONDS']
+
+def _update_import_job(job_ref, **fields):
+    fields['updatedAt'] = time.time()
+    job_ref.update(fields)
+
+def submit_import_job(kind, import_path, file_format):
+    """
+    Queues an import analysis and returns the 202 response pointing at its status URL.
+    Returns 503 when the queue is full. The job takes over the spooled file and deletes it.
+    """
+    if not _import_job_slots.acquire(blocking=False):
+        discard_import_upload(import_path)
+        response = jsonify({"error": "Too many import jobs are queued. Please try again later."})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    try:
+        job_ref = db.collection(IMPORT_JOBS_COLLECTION).document()
+        now = time.time()
+        job_ref.set({
+            "kind": kind,
+            "fileFormat": file_format,
+            "status": "queued",
+            "progress": {"stage": "queued"},
+            "createdAt": now,
+            "updatedAt": now,
+            "expiresAt": _import_job_expiry()
+        })
+        _import_job_executor.submit(run_import_job, job_ref, kind, import_path, file_format)
+    except Exception:
+        _import_job_slots.release()
+        discard_import_upload(import_path)
+        raise
+
+    status_url = f"/jobs/{job_ref.id}"
+    response = jsonify({"jobId": job_ref.id, "status": "queued", "statusUrl": status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+def run_import_job(job_ref, kind, import_path, file_format):
+    """
+    Runs an import analysis on the job executor and records progress and results on the job.
+    """
+    def report_progress(completed_chunks, total_chunks):
+        try:
+            _update_import_job(job_ref, progress={
+                "stage": "mapping",
+                "completedChunks": completed_chunks,
+                "totalChunks": total_chunks
+            })
+        except Exception as e:
+            print(f"Error updating progress of import job {job_ref.id}: {e}")
+
+    try:
+        _update_import_job(job_ref, status='running', startedAt=time.time(), progress={"stage": "extracting"})
+        analyze = analyze_customer_import if kind == 'customers' else analyze_invoice_import
+        result, status_code = analyze(import_path, file_format, progress=report_progress)
+
+        if status_code != 200:
+            _update_import_job(
+                job_ref, status='failed', httpStatus=status_code, error=result.get('error'), finishedAt=time.time()
+            )
+            return
+
+        analyzed_data = result.pop('analyzed_data')
+        expires_at = _import_job_expiry()
+        results_collection = job_ref.collection(IMPORT_JOB_RESULTS_COLLECTION)
+        commit_in_batches([
+            ('set', results_collection.document(f"{start // IMPORT_JOB_RESULTS_PER_DOCUMENT:05d}"), {
+                "records": analyzed_data[start:start + IMPORT_JOB_RESULTS_PER_DOCUMENT],
+                "expiresAt": expires_at
+            })
+            for start in range(0, len(analyzed_data), IMPORT_JOB_RESULTS_PER_DOCUMENT)
+        ])
+        _update_import_job(
+            job_ref,
+            status='succeeded',
+            httpStatus=200,
+            summary=result,
+            recordCount=len(analyzed_data),
+            progress={"stage": "complete"},
+            finishedAt=time.time()
+        )
+        print(f"Import job {job_ref.id} finished with {len(analyzed_data)} analyzed records.")
+    except Exception as e:
+        print(f"Error running import job {job_ref.id}: {e}")
+        try:
+            _update_import_job(job_ref, status='failed', httpStatus=500, error=str(e), finishedAt=time.time())
+        except Exception as update_error:
+            print(f"Error recording failure of import job {job_ref.id}: {update_error}")
+    finally:
+        discard_import_upload(import_path)
+        _import_job_slots.release()
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """
+    Returns the status and progress of an import job. Once the job has succeeded, 'result' holds
+    the same body the synchronous analyze route returns. A running job that has not been updated
+    within IMPORT_JOB_STALE_SECONDS is reported as failed.
+    """
+    if db is None:
+        print("Error: Firestore not initialized in get_import_job.")
+        return jsonify({"error": "Firestore not initialized"}), 500
 
-        if not llm_output_text:
-            return jsonify({"error": "AI mapping failed to produce output."}), 500
+    try:
+        job_doc = db.collection(IMPORT_JOBS_COLLECTION).document(job_id).get()
+        if not job_doc.exists:
+            return jsonify({"error": "Job not found"}), 404
+
+        job = job_doc.to_dict()
+        job.pop('expiresAt', None)
+        job['jobId'] = job_id
+        if _import_job_is_stale(job):
+            job.update(status='failed', httpStatus=500,
+                       error="The import job stopped responding. Please upload the file again.")
+        if job.get('status') == 'succeeded':
+            result_docs = sorted(
+                job_doc.reference.collection(IMPORT_JOB_RESULTS_COLLECTION).stream(), key=lambda doc: doc.id
+            )
+            job['result'] = dict(
+                job.pop('summary', {}),
+                analyzed_data=[record for doc in result_docs for record in doc.to_dict().get('records', [])]
+            )
+        return jsonify(job), 200
+    except Exception as e:
+        print(f"Error fetching import job {job_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/customers/import/analyze', methods=['POST'])
+def analyze_customers_for_import():
+    if db is None:
+        print("Error: Firestore not initialized in analyze_customers_for_import.")
+        return jsonify({"error": "Firestore not initialized"}), 500
+
+    import_path, file_format, upload_error = receive_import_upload()
+    if upload_error:
+        return upload_error
+
+    if wants_async_import():
+        return submit_import_job('customers', import_path, file_format)
+    try:
+        result, status_code = analyze_customer_import(import_path, file_format)
+    finally:
+        discard_import_upload(import_path)
+    return jsonify(result), status_code
+
+def analyze_customer_import(import_path, file_format, progress=None):
+    """
+    Extracts, maps and checks an uploaded customer file. Returns (result, status_code), where
+    result is the response body the analyze route sends.
+    """
+    mapped_customers_data, read_error = read_tabular_import(import_path, file_format, 'customers')
+    if read_error:
+        return read_error, 400
 
-        mapped_customers_data = json.loads(llm_output_text)
+    if mapped_customers_data is None:
+        chunks, chunk_error = load_import_chunks(import_path, file_format)
+        if chunk_error:
+            return chunk_error, 400
 
-        if not isinstance(mapped_customers_data, list):
-            raise ValueError("LLM did not return a JSON array.")
+    try:
+        if mapped_customers_data is None:
+            mapped_customers_data = map_import_records(
+                chunks, file_format, CUSTOMER_IMPORT_SCHEMA, build_customer_import_prompt, progress=progress
+            )
 
         new_customers_count = 0
         updated_customers_count = 0
         analyzed_customers = []
 
-        existing_customers_docs = db.collection('customers').stream()
-        existing_customers_map = {doc.id: doc.to_dict() for doc in existing_customers_docs}
+        existing_customer_ids = existing_document_ids(
+            'customers',
+            [customer_data.get('mobileNumber') for customer_data in mapped_customers_data if isinstance(customer_data, dict)]
+        )
 
         for customer_data in mapped_customers_data:
-            name = customer_data.get('name')
-            mobile_number = customer_data.get('mobileNumber')
-            
-            if not name:
-                print(f"Skipping record during analysis due to missing name: {customer_data}")
+            if not analyze_customer_record(customer_data, existing_customer_ids):
                 continue
 
-            doc_id_for_check = mobile_number if mobile_number else None 
-
-            if doc_id_for_check and doc_id_for_check in existing_customers_map:
-                customer_data['_status'] = 'updated'
+            if customer_data['_status'] == 'updated':
                 updated_customers_count += 1
             else:
-                customer_data['_status'] = 'new'
                 new_customers_count += 1
             
             analyzed_customers.append(customer_data)
 
-        return jsonify({
+        return {
             "status": "analysis_complete",
             "new_customers_count": new_customers_count,
             "updated_customers_count": updated_customers_count,
             "analyzed_data": analyzed_customers
-        }), 200
+        }, 200
 
     except json.JSONDecodeError as e:
         print(f"JSON Decode Error from LLM output: {e}")
-        return jsonify({"error": f"AI mapping produced invalid JSON: {e}"}), 500
+        return {"error": f"AI mapping produced invalid JSON: {e}"}, 500
     except Exception as e:
         print(f"Error during customer import analysis: {e}")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+
+# --- Streamed Import Analysis ---
+def stream_import_analysis(kind, import_path, file_format):
+    """
+    Streams an import analysis as Server-Sent Events: 'progress' once the file is chunked, one
+    'record' per mapped record as soon as the model has written it and its status is checked,
+    then 'complete' with the same counts as the analyze routes, or 'error'.
+    Problems with the file itself are still reported as a plain 400 before the stream starts.
+    """
+    tabular_records, read_error = read_tabular_import(import_path, file_format, kind)
+    if read_error:
+        return jsonify(read_error), 400
+
+    chunks = []
+    if tabular_records is None:
+        chunks, chunk_error = load_import_chunks(import_path, file_format)
+        if chunk_error:
+            return jsonify(chunk_error), 400
+
+    if kind == 'customers':
+        response_schema, build_prompt = CUSTOMER_IMPORT_SCHEMA, build_customer_import_prompt
+        counts = {"new_customers_count": 0, "updated_customers_count": 0}
+    else:
+        response_schema, build_prompt = INVOICE_IMPORT_SCHEMA, build_invoice_import_prompt
+        counts = {"new_customers_count": 0, "updated_customers_count": 0,
+                  "new_invoices_count": 0, "updated_invoices_count": 0}
+
+    # Whether each document ID looked up so far exists, per collection. Imports repeat the same
+    # customers across many records, so each ID is read at most once per stream.
+    checked_ids = {'customers': {}, 'invoices': {}}
+
+    def existing_ids(collection_name, doc_ids):
+        known = checked_ids[collection_name]
+        doc_ids = [doc_id for doc_id in doc_ids if isinstance(doc_id, str)]
+        unchecked_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id not in known]
+        if unchecked_ids:
+            found_ids = existing_document_ids(collection_name, unchecked_ids)
+            known.update((doc_id, doc_id in found_ids) for doc_id in unchecked_ids)
+        return {doc_id for doc_id in doc_ids if known[doc_id]}
+
+    def record_ids(record):
+        if kind == 'customers':
+            return {'customers': [record.get('mobileNumber')]}
+        return {'customers': [(record.get('customer') or {}).get('mobileNumber')],
+                'invoices': [(record.get('invoice') or {}).get('invoiceNumber')]}
+
+    def analyze_streamed_record(record):
+        if not isinstance(record, dict):
+            return False
+        ids = record_ids(record)
+        if kind == 'customers':
+            existing_customer_ids = existing_ids('customers', ids['customers'])
+            if not analyze_customer_record(record, existing_customer_ids):
+                return False
+            counts[f"{record['_status']}_customers_count"] += 1
+            return True
+
+        existing_customer_ids = existing_ids('customers', ids['customers'])
+        existing_invoice_ids = existing_ids('invoices', ids['invoices'])
+        if not analyze_invoice_record(record, existing_customer_ids, existing_invoice_ids):
+            return False
+        for record_kind, count_name in (('customer', 'customers'), ('invoice', 'invoices')):
+            status = record[record_kind]['_status']
+            if status != 'skipped':
+                counts[f"{status}_{count_name}_count"] += 1
+        return True
+
+    def generate_events():
+        yield format_sse_event('progress', {"stage": "mapping", "totalChunks": len(chunks)})
+        try:
+            if tabular_records is not None:
+                # Every record is known up front, so check all of their IDs in batched reads.
+                for collection_name in checked_ids:
+                    existing_ids(collection_name, [
+                        doc_id for record in tabular_records if isinstance(record, dict)
+                        for doc_id in record_ids(record).get(collection_name, [])
+                    ])
+                mapped_records = tabular_records
+            else:
+                mapped_records = stream_extract_records(
+                    lambda chunk: build_prompt(chunk, file_format),
+                    response_schema,
+                    chunks,
+                    max_workers=app.config['LLM_MAX_WORKERS'],
+                    max_retries=app.config['LLM_MAX_RETRIES'],
+                    timeout=app.config['LLM_REQUEST_TIMEOUT_SECONDS'],
+                    prompt_version=IMPORT_PROMPT_VERSION
+                )
+            for record in mapped_records:
+                if analyze_streamed_record(record):
+                    yield format_sse_event('record', record)
+            yield format_sse_event('complete', {"status": "analysis_complete", **counts})
+        except Exception as e:
+            print(f"Error during streamed {kind} import analysis: {e}")
+            yield format_sse_event('error', {"error": str(e)})
+
+    return sse_response(generate_events())
+
+@app.route('/customers/import/analyze/stream', methods=['POST'])
+def stream_customers_import_analysis():
+    if db is None:
+        print("Error: Firestore not initialized in stream_customers_import_analysis.")
+        return jsonify({"error": "Firestore not initialized"}), 500
+
+    import_path, file_format, upload_error = receive_import_upload()
+    if upload_error:
+        return upload_error
+
+    try:
+        # The file is fully read before the event stream starts.
+        return stream_import_analysis('customers', import_path, file_format)
+    finally:
+        discard_import_upload(import_path)
+
+@app.route('/invoices/import/analyze/stream', methods=['POST'])
+def stream_invoices_import_analysis():
+    if db is None:
+        print("Error: Firestore not initialized in stream_invoices_import_analysis.")
+        return jsonify({"error": "Firestore not initialized"}), 500
+
+    import_path, file_format, upload_error = receive_import_upload()
+    if upload_error:
+        return upload_error
+
+    try:
+        # The file is fully read before the event stream starts.
+        return stream_import_analysis('invoices', import_path, file_format)
+    finally:
+        discard_import_upload(import_path)
 
 @app.route('/customers/import/confirm', methods=['POST'])
 def confirm_import_customers():
@@ -718,20 +2620,23 @@ def confirm_import_customers():
     if not customers_to_save or not isinstance(customers_to_save, list):
         return jsonify({"error": "No customer data provided for confirmation."}), 400
 
-    imported_count = 0
-    for customer_data in customers_to_save:
-        name = customer_data.get('name')
-        mobile_number = customer_data.get('mobileNumber')
-
-        if not name:
+    results = []
+    # Writes keyed by document ID. Batches commit concurrently, so two writes to one customer
+    # could land in either order; the last row for a mobile number replaces the earlier ones.
+    customer_writes = {}
+    customers_ref = db.collection('customers')
+    for record_index, customer_data in enumerate(customers_to_save):
+        if not isinstance(customer_data, dict) or not customer_data.get('name'):
             print(f"Skipping record during save due to missing name: {customer_data}")
+            results.append({"index": record_index, "status": "skipped", "error": "Missing name"})
             continue
 
+        name = customer_data.get('name')
+        mobile_number = customer_data.get('mobileNumber')
         doc_id = mobile_number if mobile_number else str(uuid.uuid4())
         is_generated_id = bool(not mobile_number)
 
-        customer_ref = db.collection('customers').document(doc_id)
-        customer_ref.set({
+        customer_fields = {
             'name': name,
             'mobileNumber': mobile_number,
             'address': customer_data.get('address'),
@@ -740,10 +2645,40 @@ def confirm_import_customers():
             'taxNumber': customer_data.get('taxNumber'),
             'isGeneratedId': is_generated_id,
             'lastUpdated': firestore.SERVER_TIMESTAMP
-        }, merge=True)
-        imported_count += 1
+        }
+        if doc_id in customer_writes:
+            replaced_index = customer_writes.pop(doc_id)[0]
+            results.append({"index": replaced_index, "customerId": doc_id, "status": "skipped",
+                            "error": f"Replaced by record {record_index} with the same mobile number"})
+        customer_writes[doc_id] = (record_index, doc_id, customer_fields)
+
+    written_customers = list(customer_writes.values())
+    operations = [('merge', customers_ref.document(doc_id), customer_fields) for _, doc_id, customer_fields in written_customers]
+    try:
+        write_errors = commit_batches_concurrently(operations, max_workers=app.config['FIRESTORE_COMMIT_WORKERS'])
+    except Exception as e:
+        print(f"Error committing customer import: {e}")
+        return jsonify({"error": str(e)}), 500
 
-    return jsonify({"message": f"Successfully imported {imported_count} customers."}), 200
+    imported_count = 0
+    for (record_index, doc_id, customer_fields), write_error in zip(written_customers, write_errors):
+        if write_error:
+            results.append({"index": record_index, "customerId": doc_id, "status": "failed", "error": write_error})
+            continue
+        update_customer_index(doc_id, customer_fields)
+        results.append({"index": record_index, "customerId": doc_id, "status": "imported"})
+        imported_count += 1
+    results.sort(key=lambda result: result['index'])
+
+    failed_count = len(written_customers) - imported_count
+    print(f"Imported {imported_count} customers ({failed_count} failed) using batched writes.")
+    return jsonify({
+        "message": f"Successfully imported {imported_count} customers.",
+        "imported_count": imported_count,
+        "failed_count": failed_count,
+        "skipped_count": len(customers_to_save) - len(written_customers),
+        "results": results
+    }), 200
 
 @app.route('/settings', methods=['GET', 'POST']) # MODIFIED: Allow POST requests
 def get_settings():
@@ -800,175 +2735,37 @@ def analyze_invoices_for_import():
         print("Error: Firestore not initialized in analyze_invoices_for_import.")
         return jsonify({"error": "Firestore not initialized"}), 500
 
-    data = request.get_json()
-    file_content_raw = data.get('file_content')
-    file_format = data.get('file_format')
-
-    if not file_content_raw:
-        return jsonify({"error": "No file content provided"}), 400
-
-    content_for_llm = ""
-    if file_format == 'pdf':
-        try:
-            pdf_bytes = base64.b64decode(file_content_raw)
-            reader = PdfReader(io.BytesIO(pdf_bytes))
-            for page in reader.pages:
-                content_for_llm += page.extract_text() + "\n"
-            if not content_for_llm.strip():
-                return jsonify({"error": "Could not extract text from PDF. It might be an image-based PDF or corrupted."}), 400
-            print("Successfully extracted text from PDF for LLM analysis.")
-        except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
-            return jsonify({"error": f"Failed to process PDF file: {e}"}), 400
-    else:
-        content_for_llm = file_content_raw
+    import_path, file_format, upload_error = receive_import_upload()
+    if upload_error:
+        return upload_error
 
+    if wants_async_import():
+        return submit_import_job('invoices', import_path, file_format)
     try:
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash-latest"
-        )
-        
-        # Define the desired JSON schema for invoice and customer data
-        # Each item in the array will represent an invoice, and can optionally include customer details
-        invoice_and_customer_schema = {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "invoice": {
-                        "type": "object",
-                        "properties": {
-                            "invoiceNumber": {"type": "string", "nullable": True}, # Can be null for new invoices
-                            "billToName": {"type": "string"},
-                            "billToAddress": {"type": "string", "nullable": True},
-                            "mobileNumber": {"type": "string", "nullable": True},
-                            "paymentType": {"type": "string", "nullable": True},
-                            "items": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "productId": {"type": "string", "nullable": True},
-                                        "name": {"type": "string"},
-                                        "price": {"type": "number"},
-                                        "quantity": {"type": "integer"},
-                                        "subtotal": {"type": "number"},
-                                    },
-                                    "required": ["name", "price", "quantity", "subtotal"]
-                                }
-                            },
-                            "totalAmount": {"type": "number"},
-                            "invoiceDate": {"type": "string"}, # ISO format
-                            "invoiceTaxPercentage": {"type": "number", "nullable": True},
-                            "invoiceShippingCost": {"type": "number", "nullable": True},
-                            "invoiceDiscountPercentage": {"type": "number", "nullable": True},
-                            "status": {"type": "string", "nullable": True},
-                            "dueDate": {"type": "string", "nullable": True}, # ISO format
-                            "totalPaid": {"type": "number", "nullable": True},
-                            "payments": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "amount": {"type": "number"},
-                                        "date": {"type": "string"}, # ISO format
-                                        "type": {"type": "string", "nullable": True}
-                                    },
-                                    "required": ["amount", "date"]
-                                }
-                            },
-                            "daysDue": {"type": "integer", "nullable": True},
-                            "invoiceType": {"type": "string", "nullable": True},
-                        },
-                        "required": ["billToName", "items", "totalAmount", "invoiceDate"]
-                    },
-                    "customer": { # Extracted customer details, potentially for saving
-                        "type": "object",
-                        "properties": {
-                            "mobileNumber": {"type": "string", "nullable": True},
-                            "name": {"type": "string"},
-                            "address": {"type": "string", "nullable": True},
-                            "email": {"type": "string", "nullable": True},
-                            "taxId": {"type": "string", "nullable": True},
-                            "taxNumber": {"type": "string", "nullable": True},
-                        },
-                        "required": ["name"]
-                    }
-                },
-                "required": ["invoice", "customer"] # Each analyzed item must have an invoice and customer part
-            }
-        }
-
-        prompt = f"""
-        You are an expert data mapper for invoices and customers. Your task is to extract invoice and associated customer information from the provided text and format it as a JSON array.
-        Each item in the array must be an object containing an 'invoice' object and a 'customer' object, adhering to the following JSON schema:
-        {json.dumps(invoice_and_customer_schema, indent=2)}
-
-        For the 'invoice' object:
-        - 'invoiceNumber' can be null if not explicitly found.
-        - 'invoiceDate' and 'dueDate' must be in ISO 8601 format (e.g., "YYYY-MM-DDTHH:MM:SS"). If time is not specified, use "00:00:00". If date is not specified, use today's date.
-        - 'totalAmount' should be the final total after all calculations.
-        - 'items' should be a list of product items. If subtotal is not explicit, calculate it as price * quantity.
-        - 'payments' should be a list of payment records. 'date' in payments must also be ISO 8601.
-        - Set numeric fields (tax, shipping, discount, totalPaid) to 0.0 if not found.
-        - Set 'status' to 'Unpaid' if not found.
-        - Set 'invoiceType' to 'Invoice' if not found.
-        - Set 'daysDue' to 1 if not found.
-
-        For the 'customer' object:
-        - 'mobileNumber' can be null if not explicitly found.
-        - 'name' is required. If 'name' is missing for a customer, discard that customer record.
-        - Combine address lines into a single string separated by newlines if multiple lines are implied.
-
-        If a field is not present in the input text, it should be omitted or set to null, unless a default is specified above.
-        If an invoice record cannot be fully parsed (e.g., missing billToName, items, totalAmount, or invoiceDate), discard that entire invoice record.
-
-        Input data (original format: {file_format}):
-        ---
-        {content_for_llm}
-        ---
-
-        Please return ONLY the JSON array.
-        """
-
-        max_retries = 5
-        llm_output_text = ""
-        for i in range(max_retries):
-            try:
-                response = model.generate_content(
-                    contents=[{"parts": [{"text": prompt}]}],
-                    generation_config={
-                        "response_mime_type": "application/json",
-                        "response_schema": invoice_and_customer_schema
-                    },
-                    safety_settings={
-                        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                    },
-                    request_options={"timeout": 300} # Add this line
-                )
-                
-                if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                    llm_output_text = response.candidates[0].content.parts[0].text
-                    break
-                else:
-                    raise ValueError("LLM response is empty or malformed.")
-            except Exception as e:
-                print(f"LLM call failed (attempt {i+1}/{max_retries}): {e}")
-                if i < max_retries - 1:
-                    time.sleep(2 ** i)
-                else:
-                    raise
+        result, status_code = analyze_invoice_import(import_path, file_format)
+    finally:
+        discard_import_upload(import_path)
+    return jsonify(result), status_code
 
-        if not llm_output_text:
-            return jsonify({"error": "AI mapping failed to produce output."}), 500
+def analyze_invoice_import(import_path, file_format, progress=None):
+    """
+    Extracts, maps and checks an uploaded invoice file. Returns (result, status_code), where
+    result is the response body the analyze route sends.
+    """
+    mapped_data, read_error = read_tabular_import(import_path, file_format, 'invoices')
+    if read_error:
+        return read_error, 400
 
-        mapped_data = json.loads(llm_output_text)
+    if mapped_data is None:
+        chunks, chunk_error = load_import_chunks(import_path, file_format)
+        if chunk_error:
+            return chunk_error, 400
 
-        if not isinstance(mapped_data, list):
-            raise ValueError("LLM did not return a JSON array.")
+    try:
+        if mapped_data is None:
+            mapped_data = map_import_records(
+                chunks, file_format, INVOICE_IMPORT_SCHEMA, build_invoice_import_prompt, progress=progress
+            )
 
         new_customers_count = 0
         updated_customers_count = 0
@@ -976,88 +2773,50 @@ def analyze_invoices_for_import():
         updated_invoices_count = 0
         analyzed_results = [] # Stores {invoice: {...}, customer: {...}} with _status flags
 
-        # Fetch existing customers and invoices for comparison
-        existing_customers_docs = db.collection('customers').stream()
-        existing_customers_map = {doc.id: doc.to_dict() for doc in existing_customers_docs}
-
-        existing_invoices_docs = db.collection('invoices').stream()
-        existing_invoices_map = {doc.id: doc.to_dict() for doc in existing_invoices_docs}
+        # Look up only the customers and invoices referenced by the file
+        mapped_items = [item for item in mapped_data if isinstance(item, dict)]
+        existing_customer_ids = existing_document_ids(
+            'customers',
+            [(item.get('customer') or {}).get('mobileNumber') for item in mapped_items]
+        )
+        existing_invoice_ids = existing_document_ids(
+            'invoices',
+            [(item.get('invoice') or {}).get('invoiceNumber') for item in mapped_items]
+        )
 
 
         for item in mapped_data:
-            invoice_data = item.get('invoice')
-            customer_data = item.get('customer')
-
-            if not invoice_data or not customer_data:
-                print(f"Skipping record due to missing invoice or customer data: {item}")
+            if not analyze_invoice_record(item, existing_customer_ids, existing_invoice_ids):
                 continue
+            invoice_data = item['invoice']
+            customer_data = item['customer']
 
-            # --- Analyze Customer ---
-            customer_mobile_number = customer_data.get('mobileNumber')
-            customer_name = customer_data.get('name')
-
-            if not customer_name:
-                print(f"Skipping customer analysis for record due to missing name: {customer_data}")
-                customer_data['_status'] = 'skipped' # Mark customer as skipped
-            else:
-                customer_doc_id_for_check = customer_mobile_number if customer_mobile_number else None
-                if customer_doc_id_for_check and customer_doc_id_for_check in existing_customers_map:
-                    customer_data['_status'] = 'updated'
-                    updated_customers_count += 1
-                else:
-                    customer_data['_status'] = 'new'
-                    new_customers_count += 1
-            
-            # --- Analyze Invoice ---
-            invoice_number = invoice_data.get('invoiceNumber')
-            
-            if not invoice_data.get('billToName') or not invoice_data.get('items') or not invoice_data.get('totalAmount') or not invoice_data.get('invoiceDate'):
-                print(f"Skipping invoice analysis for record due to missing required fields: {invoice_data}")
-                invoice_data['_status'] = 'skipped' # Mark invoice as skipped
-            else:
-                # Ensure dates are in correct format for comparison
-                try:
-                    invoice_date_str = invoice_data['invoiceDate']
-                    datetime.datetime.fromisoformat(invoice_date_str.replace('Z', '+00:00'))
-                except ValueError:
-                    invoice_data['invoiceDate'] = datetime.datetime.now().isoformat()
-                    print(f"Corrected invoiceDate format for {invoice_number}")
-                
-                if invoice_data.get('dueDate'):
-                    try:
-                        due_date_str = invoice_data['dueDate']
-                        datetime.datetime.fromisoformat(due_date_str.replace('Z', '+00:00'))
-                    except ValueError:
-                        invoice_data['dueDate'] = (datetime.datetime.now() + datetime.timedelta(days=invoice_data.get('daysDue', 1))).isoformat()
-                        print(f"Corrected dueDate format for {invoice_number}")
-                else:
-                    invoice_data['dueDate'] = (datetime.datetime.now() + datetime.timedelta(days=invoice_data.get('daysDue', 1))).isoformat()
-
-
-                if invoice_number and invoice_number in existing_invoices_map:
-                    invoice_data['_status'] = 'updated'
-                    updated_invoices_count += 1
-                else:
-                    invoice_data['_status'] = 'new'
-                    new_invoices_count += 1
+            if customer_data['_status'] == 'updated':
+                updated_customers_count += 1
+            elif customer_data['_status'] == 'new':
+                new_customers_count += 1
+            if invoice_data['_status'] == 'updated':
+                updated_invoices_count += 1
+            elif invoice_data['_status'] == 'new':
+                new_invoices_count += 1
             
             analyzed_results.append({'invoice': invoice_data, 'customer': customer_data})
 
-        return jsonify({
+        return {
             "status": "analysis_complete",
             "new_customers_count": new_customers_count,
             "updated_customers_count": updated_customers_count,
             "new_invoices_count": new_invoices_count,
             "updated_invoices_count": updated_invoices_count,
             "analyzed_data": analyzed_results
-        }), 200
+        }, 200
 
     except json.JSONDecodeError as e:
         print(f"JSON Decode Error from LLM output: {e}")
-        return jsonify({"error": f"AI mapping produced invalid JSON: {e}"}), 500
+        return {"error": f"AI mapping produced invalid JSON: {e}"}, 500
     except Exception as e:
         print(f"Error during invoice import analysis: {e}")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
 
 
 @app.route('/invoices/import/confirm', methods=['POST'])
@@ -1072,14 +2831,16 @@ def confirm_import_invoices():
     if not invoices_to_save or not isinstance(invoices_to_save, list):
         return jsonify({"error": "No invoice data provided for confirmation."}), 400
 
-    imported_invoices_count = 0
-    for item in invoices_to_save:
+    invoices_to_write = []
+    new_invoices_by_prefix = {}
+    for record_index, item in enumerate(invoices_to_save):
         invoice_data = item.get('invoice')
         
         if not invoice_data or invoice_data.get('_status') == 'skipped':
             continue
 
-        if invoice_data.get('_status') == 'new':
+        is_new = invoice_data.get('_status') == 'new'
+        if is_new:
             invoice_date_obj = datetime.datetime.now()
             if 'invoiceDate' in invoice_data and isinstance(invoice_data['invoiceDate'], str):
                 try:
@@ -1087,9 +2848,10 @@ def confirm_import_invoices():
                 except ValueError:
                     print(f"Could not parse invoiceDate string {invoice_data['invoiceDate']}. Using current date for invoice number generation.")
             
-            new_invoice_number = generate_unique_invoice_number(invoice_date_obj)
-            invoice_data['invoiceNumber'] = new_invoice_number
-            invoice_data['invoiceDatePrefix'] = invoice_date_obj.strftime("%Y%m%d")
+            # Numbers are reserved per date once the whole file has been prepared.
+            date_prefix = invoice_date_obj.strftime("%Y%m%d")
+            invoice_data['invoiceDatePrefix'] = date_prefix
+            new_invoices_by_prefix.setdefault(date_prefix, []).append(invoice_data)
 
         if 'invoiceDate' in invoice_data:
             if isinstance(invoice_data['invoiceDate'], str):
@@ -1140,25 +2902,94 @@ def confirm_import_invoices():
                         payment['amount'] = 0.0
 
         invoice_data.pop('_status', None)
-        
-        invoice_ref = db.collection('invoices').document(invoice_data['invoiceNumber'])
-        invoice_ref.set(invoice_data, merge=True)
-        imported_invoices_count += 1
+        # New invoices are created, never merged, so a counter that has fallen behind cannot
+        # overwrite an invoice that already holds the reserved number.
+        invoices_to_write.append((record_index, 'create' if is_new else 'merge', invoice_data))
+
+    try:
+        for date_prefix, new_invoices in new_invoices_by_prefix.items():
+            invoice_numbers = reserve_invoice_numbers(date_prefix, len(new_invoices))
+            for invoice_data, invoice_number in zip(new_invoices, invoice_numbers):
+                invoice_data['invoiceNumber'] = invoice_number
+
+        invoices_ref = db.collection('invoices')
+        write_errors = commit_batches_concurrently([
+            (action, invoices_ref.document(invoice_data['invoiceNumber']), invoice_data)
+            for _, action, invoice_data in invoices_to_write
+        ], max_workers=app.config['FIRESTORE_COMMIT_WORKERS'])
+    except Exception as e:
+        print(f"Error saving imported invoices: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    results = []
+    for (record_index, _, invoice_data), write_error in zip(invoices_to_write, write_errors):
+        result = {"index": record_index, "invoiceNumber": invoice_data['invoiceNumber']}
+        if write_error:
+            results.append({**result, "status": "failed", "error": write_error})
+        else:
+            results.append({**result, "status": "imported"})
+    imported_invoices_count = sum(1 for result in results if result['status'] == 'imported')
+    failed_count = len(results) - imported_invoices_count
+    print(f"Imported {imported_invoices_count} invoices ({failed_count} failed) using batched writes.")
     
-    return jsonify({"message": f"Successfully imported {imported_invoices_count} invoices."}), 200
+    return jsonify({
+        "message": f"Successfully imported {imported_invoices_count} invoices.",
+        "imported_count": imported_invoices_count,
+        "failed_count": failed_count,
+        "results": results
+    }), 200
+
+
+# --- Invoice Number Service ---
+# Each day has a counter document in 'invoice_counters' (keyed by the YYYYMMDD prefix)
+# holding the last suffix handed out. Numbers are reserved inside a transaction, so
+# concurrent requests never receive the same number.
+INVOICE_COUNTERS_COLLECTION = 'invoice_counters'
 
+def _highest_invoice_suffix(date_prefix):
+    """
+    Finds the highest numeric suffix already used for a date prefix. Only needed
+    the first time a day's counter document is created.
+    """
+    invoices_docs = db.collection('invoices') \
+        .where(filter=firestore.FieldFilter('invoiceDatePrefix', '==', date_prefix)) \
+        .select([]) \
+        .stream()
+    highest_suffix = 0
+    for doc in invoices_docs:
+        suffix = doc.id[len(date_prefix):]
+        if doc.id.startswith(date_prefix) and suffix.isdigit():
+            highest_suffix = max(highest_suffix, int(suffix))
+    return highest_suffix
+
+@firestore.transactional
+def _reserve_invoice_suffixes(transaction, counter_ref, date_prefix, count):
+    counter_doc = counter_ref.get(transaction=transaction)
+    if counter_doc.exists:
+        last_issued = counter_doc.to_dict().get('lastIssued', 0)
+    else:
+        # Seed a new day's counter from invoices written before the counter existed.
+        last_issued = _highest_invoice_suffix(date_prefix)
+
+    transaction.set(counter_ref, {
+        'lastIssued': last_issued + count,
+        'lastUpdated': firestore.SERVER_TIMESTAMP
+    })
+    return last_issued + 1
 
-def generate_unique_invoice_number(invoice_date_obj):
+def reserve_invoice_numbers(date_prefix, count=1):
+    """
+    Reserves `count` consecutive invoice numbers for a YYYYMMDD prefix with one
+    transactional read and write of the day's counter document.
+    """
     if db is None:
-        # It's good practice to raise an exception if db is not initialized
         raise Exception("Firestore not initialized.")
-    
-    today_str = invoice_date_obj.strftime("%Y%m%d")
-    invoices_today_docs = db.collection('invoices').where(filter=firestore.FieldFilter('invoiceDatePrefix', '==', today_str)).get()
-    count_today = len(invoices_today_docs)
-    invoice_suffix = str(count_today + 1).zfill(3)
-    return f"{today_str}{invoice_suffix}"
+    if count < 1:
+        return []
 
+    counter_ref = db.collection(INVOICE_COUNTERS_COLLECTION).document(date_prefix)
+    first_suffix = _reserve_invoice_suffixes(db.transaction(), counter_ref, date_prefix, count)
+    return [f"{date_prefix}{str(suffix).zfill(3)}" for suffix in range(first_suffix, first_suffix + count)]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+"""
+Benchmarks fetching the catalog's collection pages from a local HTTP stand-in.
+
+    python -m benchmarks.catalog_fetch --latency-ms 200 --workers 1 4 8
+
+A threaded HTTP server on localhost serves the recorded Dawn collection page in
+benchmarks/fixtures for pages 1-6 (the page count its pagination links advertise) and an
+empty page after that, each response delayed by --latency-ms. The old serial loop (one
+unpooled requests.get per page until a page has no product cards) is timed against
+services.scraping_service.fetch_collection_pages at each worker count.
+"""
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from services import scraping_service
+from services.scraping_service import collection_page_url, discover_page_count, extract_product_cards, fetch_collection_pages
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'dawn_collection_page.html')
+EMPTY_PAGE = b"<html><body><ul id=\"product-grid\"></ul></body></html>"
+
+
+def start_catalog_server(page_html, page_count, latency_seconds):
+    """Serves page_html for /collections/all?page=1..page_count on a free port; returns (server, base_url)."""
+    class CatalogHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            page = int(parse_qs(url.query).get('page', ['1'])[0])
+            time.sleep(latency_seconds)
+            if url.path != '/collections/all':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = page_html if page <= page_count else EMPTY_PAGE
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CatalogHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def fetch_serially(base_url):
+    """The pre-pool scraper loop: fetch page after page until one has no product cards."""
+    page_texts = []
+    page = 1
+    while True:
+        response = requests.get(collection_page_url(base_url, page))
+        response.raise_for_status()
+        if not extract_product_cards(response.text):
+            break
+        page_texts.append(response.text)
+        page += 1
+    return page_texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with open(FIXTURE_PATH, 'rb') as fixture_file:
+        page_html = fixture_file.read()
+    page_count = discover_page_count(page_html.decode('utf-8'))
+    server, base_url = start_catalog_server(page_html, page_count, args.latency_ms / 1000)
+    print(f"{page_count} pages of {len(page_html) // 1024} KB, {args.latency_ms:.0f} ms latency per request")
+    try:
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            fetched_pages = fetch_serially(base_url)
+            timings.append(time.perf_counter() - started)
+        print(f"serial loop: {min(timings):6.2f} s ({len(fetched_pages)} pages)")
+
+        for workers in args.workers:
+            # The shared session's connection pool is sized on first use; start a fresh one per worker count.
+            scraping_service._session = None
+            timings = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                fetched_pages = fetch_collection_pages(base_url, max_workers=workers)
+                timings.append(time.perf_counter() - started)
+            print(f"fetch_collection_pages, {workers} worker(s): {min(timings):6.2f} s ({len(fetched_pages)} pages)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Load-tests single-document mutations against Firestore, comparing a read before every write
+with a write precondition.
+
+    python -m benchmarks.conditional_writes --documents 200 --concurrency 1 8
+
+Documents are created in a scratch collection, then each one is updated and deleted, first
+the old way (get() to check exists, then update()/delete()) and then with
+db.write_option(exists=True), as the invoice and customer routes now do. p50/p99 latency per
+mutation is printed for each mode and concurrency level. Uses the application default
+credentials, like app.py, and removes the scratch documents it creates.
+"""
+import argparse
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import firebase_admin
+from firebase_admin import firestore
+
+
+def read_then_update(db, doc_ref):
+    if not doc_ref.get().exists:
+        raise LookupError(doc_ref.id)
+    doc_ref.update({'status': 'Paid'})
+
+def read_then_delete(db, doc_ref):
+    if not doc_ref.get().exists:
+        raise LookupError(doc_ref.id)
+    doc_ref.delete()
+
+def conditional_update(db, doc_ref):
+    doc_ref.update({'status': 'Paid'}, option=db.write_option(exists=True))
+
+def conditional_delete(db, doc_ref):
+    doc_ref.delete(option=db.write_option(exists=True))
+
+MODES = [
+    ('read + write', read_then_update, read_then_delete),
+    ('precondition', conditional_update, conditional_delete),
+]
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def timed_mutations(db, mutation, doc_refs, concurrency):
+    def timed(doc_ref):
+        started = time.perf_counter()
+        mutation(db, doc_ref)
+        return (time.perf_counter() - started) * 1000
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(timed, doc_refs))
+
+def report(label, latencies):
+    print(f"  {label:22s} p50 {statistics.median(latencies):7.1f} ms   p99 {percentile(latencies, 0.99):7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--collection', default='benchmark_conditional_writes')
+    args = parser.parse_args()
+
+    db = firestore.client(firebase_admin.initialize_app())
+    collection_ref = db.collection(args.collection)
+    run_id = uuid.uuid4().hex[:8]
+
+    for concurrency in args.concurrency:
+        print(f"{args.documents} documents, concurrency {concurrency}:")
+        for mode_name, update, delete in MODES:
+            doc_refs = [collection_ref.document(f"{run_id}-{concurrency}-{mode_name[0]}-{index}")
+                        for index in range(args.documents)]
+            batch = db.batch()
+            for index, doc_ref in enumerate(doc_refs, start=1):
+                batch.set(doc_ref, {'status': 'Unpaid', 'totalAmount': 100.0})
+                if index % 500 == 0 or index == len(doc_refs):
+                    batch.commit()
+                    batch = db.batch()
+            report(f"{mode_name} update", timed_mutations(db, update, doc_refs, concurrency))
+            report(f"{mode_name} delete", timed_mutations(db, delete, doc_refs, concurrency))
+
+
+if __name__ == '__main__':
+    main()
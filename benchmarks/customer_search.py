@@ -0,0 +1,99 @@
+"""
+Benchmarks the customer type-ahead index on synthetic customers.
+
+    python -m benchmarks.customer_search --customers 100000 --queries 20000
+
+Seeds the in-memory Firestore stand-in from tests/ with --customers customers, then reports:
+- the time to load the index from the collection,
+- p50/p99/max latency of search_customer_index for name, word and mobile-number prefixes,
+- the cost of applying one customer write to the loaded index,
+- search latency while an expired index is rebuilt in the background. Searches are not
+  blocked by the rebuild, but share the GIL with it, so the worst case rises by about the
+  time of the longest sort.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.fake_app import load_app_with_fake_firestore
+
+FIRST_NAMES = ['Ramesh', 'Rama', 'Priya', 'Priyanka', 'Arun', 'Aruna', 'Karthik', 'Lakshmi', 'Senthil', 'Meena',
+               'Ganesh', 'Divya', 'Suresh', 'Anitha', 'Vijay', 'Kavya', 'José', 'Zoë', 'Murugan', 'Deepa']
+LAST_NAMES = ['Kumar', 'Raman', 'Subramanian', 'Iyer', 'Nair', 'Reddy', 'Pillai', 'Krishnan', 'Venkatesh',
+              'Srinivasan', 'Natarajan', 'Müller', 'Balaji', 'Rajan', 'Sundaram']
+
+
+def seed_customers(fake_db, customer_count, rng):
+    customers_ref = fake_db.collection('customers')
+    for index in range(customer_count):
+        mobile_number = f"{rng.randint(6, 9)}{index:09d}"
+        customers_ref.document(mobile_number).set({
+            'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {index % 97}",
+            'address': f"{index % 900} Market Street",
+            'email': f"customer{index}@example.com",
+        })
+
+def query_prefixes(customer_count, query_count, rng):
+    queries = []
+    for _ in range(query_count):
+        kind = rng.random()
+        if kind < 0.5:
+            name = rng.choice(FIRST_NAMES)
+            queries.append(name[:rng.randint(1, len(name))].lower())
+        elif kind < 0.8:
+            name = rng.choice(LAST_NAMES)
+            queries.append(name[:rng.randint(2, len(name))])
+        else:
+            queries.append(f"{rng.randint(6, 9)}{rng.randrange(customer_count):09d}"[:rng.randint(3, 10)])
+    return queries
+
+def search_latencies_us(app, queries):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        app.search_customer_index(query, limit=10)
+        latencies.append((time.perf_counter() - started) * 1_000_000)
+    return latencies
+
+def report(label, latencies_us):
+    ordered = sorted(latencies_us)
+    p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+    print(f"{label:32s} p50 {statistics.median(ordered):8.1f} us   p99 {p99:8.1f} us   max {ordered[-1]:10.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    app, fake_db = load_app_with_fake_firestore()
+    seed_customers(fake_db, args.customers, rng)
+    queries = query_prefixes(args.customers, args.queries, rng)
+
+    started = time.perf_counter()
+    app.load_customer_index()
+    print(f"index load ({args.customers} customers):   {time.perf_counter() - started:8.2f} s")
+    report("search", search_latencies_us(app, queries))
+
+    write_latencies = []
+    for index in range(1000):
+        started = time.perf_counter()
+        app.update_customer_index(f"5{index:09d}", {'name': f"{rng.choice(FIRST_NAMES)} New {index}"})
+        write_latencies.append((time.perf_counter() - started) * 1_000_000)
+    report("apply one write", write_latencies)
+
+    # Expire the index: the next search starts a background rebuild and keeps using the old index.
+    app._customer_index['loaded_at'] -= app.app.config['CUSTOMER_INDEX_TTL_SECONDS']
+    app.get_customer_index()
+    rebuild_latencies = []
+    while app._customer_index_refreshing:
+        rebuild_latencies.extend(search_latencies_us(app, queries[:100]))
+    report(f"search during rebuild ({len(rebuild_latencies)})", rebuild_latencies or [0.0])
+
+
+if __name__ == '__main__':
+    main()
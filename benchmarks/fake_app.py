@@ -0,0 +1,20 @@
+"""Loads app.py against the in-memory Firestore stand-in from tests/, for benchmarks."""
+import os
+import sys
+
+
+def load_app_with_fake_firestore():
+    """Imports app.py with firebase_admin pointed at a FakeFirestore; returns (app module, fake db)."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+    import firebase_admin
+    from firebase_admin import firestore
+    from fake_firestore import FakeFirestore
+
+    # The stand-in has no snapshot listeners.
+    os.environ['CUSTOMER_INDEX_USE_LISTENER'] = 'false'
+    os.environ['PRODUCT_CACHE_USE_LISTENER'] = 'false'
+    fake_db = FakeFirestore()
+    firebase_admin.initialize_app = lambda *args, **kwargs: object()
+    firestore.client = lambda app=None: fake_db
+    import app
+    return app, fake_db
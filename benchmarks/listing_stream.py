@@ -0,0 +1,95 @@
+"""
+Benchmarks peak memory and time to first byte of GET /invoices, buffered against streamed.
+
+    python -m benchmarks.listing_stream --documents 50000
+
+Each mode runs in its own process, so peak RSS is not carried over from the previous mode.
+The process loads app.py against the in-memory Firestore stand-in from tests/, seeds
+--documents invoices, then requests every invoice through the Flask test client:
+
+    buffered       GET /invoices                  (one JSON list built in memory)
+    json-stream    GET /invoices?stream=1         (chunked JSON array)
+    ndjson         GET /invoices with Accept: application/x-ndjson
+
+Peak RSS is reported as the growth over the seeded process, so the fixture itself is not counted.
+The stand-in filters and sorts every document before yielding the first one, so NDJSON time to
+first byte includes that; the chunked JSON array sends its opening bracket before any read.
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.fake_app import load_app_with_fake_firestore
+
+MODES = {
+    'buffered': ('/invoices', {}),
+    'json-stream': ('/invoices?stream=1', {}),
+    'ndjson': ('/invoices', {'Accept': 'application/x-ndjson'}),
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def seed_invoices(fake_db, document_count):
+    invoices_ref = fake_db.collection('invoices')
+    for index in range(document_count):
+        invoice_number = f"2024{index % 12 + 1:02d}{index:06d}"
+        invoices_ref.document(invoice_number).set({
+            'invoiceNumber': invoice_number,
+            'invoiceDatePrefix': invoice_number[:8],
+            'invoiceDate': f"2024-{index % 12 + 1:02d}-01T10:00:00",
+            'billToName': f"Customer {index % 5000}",
+            'billToAddress': f"{index % 900} Market Street, Springfield",
+            'mobileNumber': f"98{index % 5000:08d}",
+            'paymentType': 'Cash',
+            'status': 'Unpaid',
+            'totalAmount': 125.5,
+            'totalPaid': 0.0,
+            'items': [{'name': f"Item {item}", 'price': 12.55, 'quantity': 2, 'subtotal': 25.1} for item in range(5)],
+        })
+
+def run_mode(mode, document_count):
+    app, fake_db = load_app_with_fake_firestore()
+    seed_invoices(fake_db, document_count)
+    client = app.app.test_client()
+    path, headers = MODES[mode]
+    rss_before_mb = peak_rss_mb()
+
+    started = time.perf_counter()
+    response = client.get(path, headers=headers)
+    body_chunks = iter(response.response)
+    first_chunk = next(body_chunks)
+    time_to_first_byte = time.perf_counter() - started
+    body_bytes = len(first_chunk) + sum(len(chunk) for chunk in body_chunks)
+    total_time = time.perf_counter() - started
+
+    print(f"{mode:12s} TTFB {time_to_first_byte * 1000:8.1f} ms   total {total_time:6.2f} s   "
+          f"peak RSS +{peak_rss_mb() - rss_before_mb:7.1f} MB   {body_bytes / (1024 * 1024):6.1f} MB body")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=50000)
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--run-mode', choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args.run_mode, args.documents)
+        return
+
+    print(f"{args.documents} invoices")
+    for mode in args.modes:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.listing_stream', '--run-mode', mode, '--documents', str(args.documents)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        print(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
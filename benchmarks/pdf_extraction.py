@@ -0,0 +1,88 @@
+"""
+Benchmarks PDF import text extraction on synthetic statements.
+
+    python -m benchmarks.pdf_extraction --pages 50 200 500 --workers 1 2 4
+
+For each page count, a PDF with one text line per customer row is generated, then extracted
+with services.pdf_service.iter_pdf_page_texts at each worker count. Worker count 1 extracts in
+the calling process, like the old serial loop.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from services.pdf_service import get_pdf_process_pool, iter_pdf_page_texts, shutdown_pdf_process_pool
+
+
+def build_synthetic_pdf(page_count, lines_per_page=45):
+    """Writes a minimal text-only PDF (Helvetica, one customer row per line) and returns its bytes."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages object, filled in once the page object numbers are known.
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_object_numbers = []
+    for page in range(page_count):
+        text_lines = [
+            f"BT /F1 9 Tf 36 {800 - line * 17} Td (Customer {page}-{line}, 98{page:04d}{line:04d}, "
+            f"{line} Market Street, Invoice INV-{page:04d}{line:02d} Total {page * 10 + line}.50) Tj ET"
+            for line in range(lines_per_page)
+        ]
+        content = "\n".join(text_lines).encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_number = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_number
+        )
+        page_object_numbers.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % number for number in page_object_numbers)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, page_count)
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(pdf)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--pages-per-task', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"CPUs: {os.cpu_count()}")
+    for page_count in args.pages:
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_file:
+            pdf_file.write(build_synthetic_pdf(page_count))
+        try:
+            size_mb = os.path.getsize(pdf_file.name) / (1024 * 1024)
+            for workers in args.workers:
+                if workers > 1:
+                    # Warm the pool so process start-up is not counted against the first run.
+                    get_pdf_process_pool(workers).submit(os.getpid).result()
+                started = time.perf_counter()
+                page_texts = list(iter_pdf_page_texts(
+                    pdf_file.name, max_pages=page_count, max_workers=workers, pages_per_task=args.pages_per_task
+                ))
+                elapsed = time.perf_counter() - started
+                characters = sum(len(text) for text in page_texts)
+                print(f"{page_count:5d} pages ({size_mb:5.1f} MB), {workers} worker(s): "
+                      f"{elapsed:7.2f} s, {page_count / elapsed:7.1f} pages/s, {characters} chars")
+                if workers > 1:
+                    # The pool is sized on first use; drop it so the next worker count gets its own.
+                    shutdown_pdf_process_pool()
+        finally:
+            os.unlink(pdf_file.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmarks finding product cards in a saved Dawn-theme collection page.
+
+    python -m benchmarks.product_card_parsing --iterations 200
+
+Times the old approach (parse the whole document with html.parser, then find_all the card
+divs) against services.scraping_service.extract_product_cards, which parses only the card
+subtrees with the faster parser when lxml is installed. The page is
+benchmarks/fixtures/dawn_collection_page.html unless --page is given.
+"""
+import argparse
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+from services.scraping_service import HTML_PARSER, extract_product_cards
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'dawn_collection_page.html')
+
+
+def find_cards_in_full_document(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    return soup.find_all('div', class_='product-card-wrapper') or \
+           soup.find_all('div', class_='product-card')
+
+
+def time_per_page(find_cards, html, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        cards = find_cards(html)
+    return (time.perf_counter() - started) / iterations, len(cards)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page', default=FIXTURE_PATH)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(args.page, encoding='utf-8') as page_file:
+        html = page_file.read()
+    print(f"{os.path.basename(args.page)}: {len(html) // 1024} KB, {args.iterations} iterations")
+
+    full_seconds, full_cards = time_per_page(find_cards_in_full_document, html, args.iterations)
+    print(f"full document (html.parser):   {full_seconds * 1000:7.2f} ms/page, {full_cards} cards")
+    strained_seconds, strained_cards = time_per_page(extract_product_cards, html, args.iterations)
+    print(f"extract_product_cards ({HTML_PARSER}): {strained_seconds * 1000:7.2f} ms/page, {strained_cards} cards")
+    print(f"speedup: {full_seconds / strained_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -19,4 +19,69 @@ class Config:
     FIREBASE_CRED_FILE = os.environ.get('FIREBASE_CRED_FILE', 'nalam-invoice-1-firebase-adminsdk-fbsvc-e687c97f65.json')
 
     # Nalam Foods URL
-    NALAM_FOODS_URL = os.environ.get('NALAM_FOODS_URL', 'https://nalamfoodsusa.com')
\ No newline at end of file
+    NALAM_FOODS_URL = os.environ.get('NALAM_FOODS_URL', 'https://nalamfoodsusa.com')
+
+    # Catalog scraper
+    # 'shopify_json' reads the storefront's /products.json feed; 'html' scrapes the collection pages.
+    CATALOG_SOURCE = os.environ.get('CATALOG_SOURCE', 'shopify_json')
+    SCRAPER_MAX_WORKERS = int(os.environ.get('SCRAPER_MAX_WORKERS', '8'))
+    SCRAPER_TIMEOUT_SECONDS = float(os.environ.get('SCRAPER_TIMEOUT_SECONDS', '15'))
+    SCRAPER_MAX_RETRIES = int(os.environ.get('SCRAPER_MAX_RETRIES', '3'))
+    # Upper bound on products.json pages fetched per sync (250 products each).
+    SCRAPER_MAX_PAGES = int(os.environ.get('SCRAPER_MAX_PAGES', '100'))
+    # Between full syncs, unchanged catalog pages are skipped using conditional requests.
+    CATALOG_FULL_SYNC_INTERVAL_HOURS = float(os.environ.get('CATALOG_FULL_SYNC_INTERVAL_HOURS', '24'))
+
+    # Scheduled product sync (/tasks/sync-products)
+    # Callers must send it as X-Task-Token. Without it, ?force=1 is ignored.
+    SYNC_TASK_TOKEN = os.environ.get('SYNC_TASK_TOKEN')
+    SYNC_LEASE_SECONDS = int(os.environ.get('SYNC_LEASE_SECONDS', '900'))
+    SYNC_MIN_INTERVAL_SECONDS = int(os.environ.get('SYNC_MIN_INTERVAL_SECONDS', '1800'))
+
+    # Product catalog cache
+    PRODUCT_CACHE_TTL_SECONDS = int(os.environ.get('PRODUCT_CACHE_TTL_SECONDS', '300'))
+    PRODUCT_CACHE_USE_LISTENER = os.environ.get('PRODUCT_CACHE_USE_LISTENER', 'false').lower() == 'true'
+
+    # Customer search index
+    # Rebuild interval, used only when the snapshot listener is disabled.
+    CUSTOMER_INDEX_TTL_SECONDS = int(os.environ.get('CUSTOMER_INDEX_TTL_SECONDS', '900'))
+    CUSTOMER_INDEX_USE_LISTENER = os.environ.get('CUSTOMER_INDEX_USE_LISTENER', 'true').lower() == 'true'
+
+    # LLM import mapping
+    # Files are split into chunks of about LLM_CHUNK_MAX_CHARS characters that are mapped concurrently.
+    LLM_CHUNK_MAX_CHARS = int(os.environ.get('LLM_CHUNK_MAX_CHARS', '20000'))
+    LLM_MAX_WORKERS = int(os.environ.get('LLM_MAX_WORKERS', '4'))
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '5'))
+    LLM_REQUEST_TIMEOUT_SECONDS = int(os.environ.get('LLM_REQUEST_TIMEOUT_SECONDS', '300'))
+
+    # LLM mapping cache
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '256'))
+    LLM_CACHE_TTL_HOURS = float(os.environ.get('LLM_CACHE_TTL_HOURS', '24'))
+    # Also keep cached mappings in Firestore so every instance can reuse them.
+    LLM_CACHE_PERSISTENT = os.environ.get('LLM_CACHE_PERSISTENT', 'false').lower() == 'true'
+
+    # Background import jobs (?async=1 on the import analyze routes)
+    IMPORT_JOB_WORKERS = int(os.environ.get('IMPORT_JOB_WORKERS', '2'))
+    # Jobs accepted beyond this many queued or running ones are rejected with 503.
+    IMPORT_JOB_MAX_PENDING = int(os.environ.get('IMPORT_JOB_MAX_PENDING', '20'))
+    IMPORT_JOB_RETENTION_HOURS = int(os.environ.get('IMPORT_JOB_RETENTION_HOURS', '72'))
+    # A running job whose updatedAt is older than this is reported as failed: the instance
+    # running it was most likely stopped. Defaults to the longest a single chunk's LLM call may take.
+    IMPORT_JOB_STALE_SECONDS = int(os.environ.get(
+        'IMPORT_JOB_STALE_SECONDS', str(LLM_REQUEST_TIMEOUT_SECONDS * (LLM_MAX_RETRIES + 1))
+    ))
+
+    # Import uploads (multipart, raw body or JSON) are spooled to disk up to this size.
+    IMPORT_MAX_UPLOAD_BYTES = int(os.environ.get('IMPORT_MAX_UPLOAD_BYTES', str(32 * 1024 * 1024)))
+
+    # PDF imports
+    PDF_MAX_BYTES = int(os.environ.get('PDF_MAX_BYTES', str(25 * 1024 * 1024)))
+    PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '500'))
+    # Worker processes for page text extraction; 1 extracts in the request thread.
+    PDF_EXTRACT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS', str(min(4, os.cpu_count() or 1))))
+    PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', '10'))
+
+    # Concurrent Firestore batch commits for bulk writes (e.g. customer import confirm)
+    FIRESTORE_COMMIT_WORKERS = int(os.environ.get('FIRESTORE_COMMIT_WORKERS', '4'))
+    # Most operations accepted by one POST /invoices:batch or /customers:batch request
+    BULK_MAX_OPERATIONS = int(os.environ.get('BULK_MAX_OPERATIONS', '2000'))
@@ -0,0 +1,419 @@
+import copy
+import datetime
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import google.generativeai as genai
+from google.generativeai.types import HarmCategory, HarmBlockThreshold
+
+
+GEMINI_MODEL_NAME = "gemini-1.5-flash-latest"
+
+SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
+
+
+# --- JSON Generation ---
+def generate_json(prompt, response_schema, model_name=GEMINI_MODEL_NAME, max_retries=5, timeout=300):
+    """
+    Asks the model for a JSON response matching response_schema and returns it parsed.
+    Empty, malformed or unparseable responses are retried with exponential backoff.
+    """
+    model = genai.GenerativeModel(model_name=model_name)
+
+    for i in range(max_retries):
+        try:
+            response = model.generate_content(
+                contents=[{"parts": [{"text": prompt}]}],
+                generation_config={
+                    "response_mime_type": "application/json",
+                    "response_schema": response_schema
+                },
+                safety_settings=SAFETY_SETTINGS,
+                request_options={"timeout": timeout}
+            )
+
+            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+                return json.loads(response.candidates[0].content.parts[0].text)
+            raise ValueError("LLM response is empty or malformed.")
+        except Exception as e:
+            print(f"LLM call failed (attempt {i+1}/{max_retries}): {e}")
+            if i < max_retries - 1:
+                time.sleep(2 ** i)
+            else:
+                raise
+
+
+# --- Mapping Cache ---
+# Mapped records are cached by a hash of (schema, prompt version, model, full prompt), so
+# re-uploading an unchanged file, or a file where only some chunks changed, skips the model for
+# every unchanged chunk. Entries live in a bounded in-memory LRU, and optionally in a Firestore
+# collection shared by all instances. Both tiers expire entries after the configured TTL.
+# Records are kept as JSON text and decoded on every hit, so callers get their own copy and
+# can annotate the records without changing the cached entry.
+_mapping_cache = OrderedDict()
+_mapping_cache_lock = threading.Lock()
+_mapping_cache_settings = {"max_entries": 256, "ttl_seconds": 86400, "persistent_collection": None}
+_mapping_cache_stats = {"hits": 0, "persistentHits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def configure_mapping_cache(max_entries=256, ttl_seconds=86400, persistent_collection=None):
+    _mapping_cache_settings.update({
+        "max_entries": max_entries,
+        "ttl_seconds": ttl_seconds,
+        "persistent_collection": persistent_collection
+    })
+
+def mapping_cache_key(prompt, response_schema, prompt_version, model_name=GEMINI_MODEL_NAME):
+    key_source = json.dumps({
+        "schema": response_schema,
+        "promptVersion": prompt_version,
+        "model": model_name,
+        "prompt": prompt
+    }, sort_keys=True)
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def _count_cache_event(event):
+    with _mapping_cache_lock:
+        _mapping_cache_stats[event] += 1
+
+def get_cached_mapping(key):
+    now = time.time()
+    with _mapping_cache_lock:
+        entry = _mapping_cache.get(key)
+        if entry is not None and entry['expiresAt'] > now:
+            _mapping_cache.move_to_end(key)
+            _mapping_cache_stats['hits'] += 1
+            records_json = entry['recordsJson']
+        else:
+            records_json = None
+            if entry is not None:
+                del _mapping_cache[key]
+    if records_json is not None:
+        return json.loads(records_json)
+
+    persistent_collection = _mapping_cache_settings['persistent_collection']
+    if persistent_collection is not None:
+        try:
+            cache_doc = persistent_collection.document(key).get()
+            if cache_doc.exists:
+                cache_data = cache_doc.to_dict()
+                expires_at = cache_data['expiresAt'].timestamp()
+                if expires_at > now:
+                    _store_in_memory(key, cache_data['records'], expires_at)
+                    _count_cache_event('persistentHits')
+                    return json.loads(cache_data['records'])
+        except Exception as e:
+            print(f"Error reading LLM mapping cache entry {key}: {e}")
+
+    _count_cache_event('misses')
+    return None
+
+def _store_in_memory(key, records_json, expires_at):
+    with _mapping_cache_lock:
+        _mapping_cache[key] = {"recordsJson": records_json, "expiresAt": expires_at}
+        _mapping_cache.move_to_end(key)
+        while len(_mapping_cache) > _mapping_cache_settings['max_entries']:
+            _mapping_cache.popitem(last=False)
+            _mapping_cache_stats['evictions'] += 1
+
+def store_cached_mapping(key, records):
+    expires_at = time.time() + _mapping_cache_settings['ttl_seconds']
+    records_json = json.dumps(records)
+    _store_in_memory(key, records_json, expires_at)
+    _count_cache_event('stores')
+
+    persistent_collection = _mapping_cache_settings['persistent_collection']
+    if persistent_collection is not None:
+        try:
+            # Stored as a JSON string: Firestore cannot hold nested arrays and the records are only read back whole.
+            persistent_collection.document(key).set({
+                "records": records_json,
+                "expiresAt": datetime.datetime.fromtimestamp(expires_at, tz=datetime.timezone.utc)
+            })
+        except Exception as e:
+            print(f"Error writing LLM mapping cache entry {key}: {e}")
+
+def mapping_cache_stats():
+    with _mapping_cache_lock:
+        stats = dict(_mapping_cache_stats)
+        stats['entries'] = len(_mapping_cache)
+    lookups = stats['hits'] + stats['persistentHits'] + stats['misses']
+    stats['hitRate'] = round((stats['hits'] + stats['persistentHits']) / lookups, 4) if lookups else 0.0
+    stats['maxEntries'] = _mapping_cache_settings['max_entries']
+    stats['persistent'] = _mapping_cache_settings['persistent_collection'] is not None
+    return stats
+
+
+# --- Chunked Extraction ---
+# Large files are split on record or page boundaries and the chunks are mapped concurrently,
+# so no single call hits the output-token limit and latency tracks the slowest chunk.
+def split_import_records(content, file_format):
+    """
+    Splits raw import text into (header, records). CSV/TSV files keep their header row so it
+    can be repeated in every chunk; JSON arrays are split per element; other text is split
+    on blank lines.
+    """
+    if file_format in ('csv', 'tsv'):
+        lines = [line for line in content.splitlines() if line.strip()]
+        if not lines:
+            return None, []
+        return lines[0], lines[1:]
+
+    if file_format == 'json':
+        try:
+            parsed_content = json.loads(content)
+        except ValueError:
+            parsed_content = None
+        if isinstance(parsed_content, list):
+            return None, [json.dumps(record) for record in parsed_content]
+
+    records = [record.strip() for record in content.replace('\r\n', '\n').split('\n\n')]
+    return None, [record for record in records if record]
+
+def chunk_segments(segments, max_chars, header=None):
+    """
+    Groups text segments (records or PDF pages) into chunks of roughly max_chars characters,
+    never splitting a segment unless it is longer than max_chars on its own, in which case it
+    is split on line boundaries. header is repeated at the top of every chunk.
+    segments may be an iterator; each segment is consumed as it is reached, so only the
+    finished chunks and the segment in hand are held in memory.
+    """
+    def iter_pieces():
+        for segment in segments:
+            if len(segment) <= max_chars:
+                yield segment
+                continue
+            oversized_piece = []
+            oversized_length = 0
+            for line in segment.splitlines():
+                if oversized_piece and oversized_length + len(line) + 1 > max_chars:
+                    yield "\n".join(oversized_piece)
+                    oversized_piece, oversized_length = [], 0
+                oversized_piece.append(line)
+                oversized_length += len(line) + 1
+            if oversized_piece:
+                yield "\n".join(oversized_piece)
+
+    prefix = [header] if header else []
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    for piece in iter_pieces():
+        if current_chunk and current_length + len(piece) + 1 > max_chars:
+            chunks.append("\n".join(prefix + current_chunk))
+            current_chunk, current_length = [], 0
+        current_chunk.append(piece)
+        current_length += len(piece) + 1
+    if current_chunk:
+        chunks.append("\n".join(prefix + current_chunk))
+    return chunks
+
+def extract_records(build_prompt, response_schema, chunks, max_workers=4, max_retries=5, timeout=300, prompt_version=None,
+                    progress=None):
+    """
+    Maps every chunk with its own model call, running up to max_workers calls at once, and merges
+    the returned JSON arrays in chunk order with exact duplicate records removed.
+    A failing chunk is retried on its own by generate_json. When prompt_version is given, chunk
+    results are read from and written to the mapping cache. progress, if given, is called with
+    (completed_chunks, total_chunks) as chunks finish.
+    """
+    if not chunks:
+        return []
+
+    def extract_chunk(chunk):
+        prompt = build_prompt(chunk)
+        cache_key = None
+        if prompt_version is not None:
+            cache_key = mapping_cache_key(prompt, response_schema, prompt_version)
+            cached_records = get_cached_mapping(cache_key)
+            if cached_records is not None:
+                return cached_records
+
+        records = generate_json(prompt, response_schema, max_retries=max_retries, timeout=timeout)
+        if not isinstance(records, list):
+            raise ValueError("LLM did not return a JSON array.")
+        if cache_key is not None:
+            store_cached_mapping(cache_key, records)
+        return records
+
+    completed_chunks = 0
+    progress_lock = threading.Lock()
+
+    def extract_and_report(chunk):
+        nonlocal completed_chunks
+        records = extract_chunk(chunk)
+        if progress is not None:
+            with progress_lock:
+                completed_chunks += 1
+                progress(completed_chunks, len(chunks))
+        return records
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        chunk_results = list(executor.map(extract_and_report, chunks))
+    print(f"Extracted records from {len(chunks)} chunks.")
+
+    merged_records = []
+    seen_records = set()
+    for records in chunk_results:
+        for record in records:
+            record_key = json.dumps(record, sort_keys=True)
+            if record_key in seen_records:
+                continue
+            seen_records.add(record_key)
+            merged_records.append(record)
+    return merged_records
+
+
+# --- Streaming Extraction ---
+# With the model's streaming API the JSON array arrives in fragments. Each top-level element is
+# handed on as soon as it is complete, so callers can show records long before the response ends.
+_JSON_DECODER = json.JSONDecoder()
+
+def iter_json_array_items(text_fragments):
+    """
+    Incrementally parses a JSON array delivered as text fragments and yields each top-level
+    element once it has been fully received. Raises ValueError if the text is not a JSON array.
+    """
+    buffer = ""
+    position = 0
+    array_started = False
+    array_closed = False
+    for fragment in text_fragments:
+        buffer += fragment
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer):
+                break
+            if not array_started:
+                if buffer[position] != '[':
+                    raise ValueError("LLM did not return a JSON array.")
+                array_started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                array_closed = True
+                break
+            try:
+                item, end = _JSON_DECODER.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            if end == len(buffer) and not isinstance(item, (dict, list)):
+                # A bare number may still be growing; wait for the next fragment.
+                break
+            yield item
+            position = end
+        if array_closed:
+            return
+        # Drop consumed text so the buffer only ever holds the record being received.
+        buffer = buffer[position:]
+        position = 0
+
+    if not array_closed:
+        raise ValueError("LLM response ended before the JSON array was complete.")
+
+def stream_json_records(prompt, response_schema, model_name=GEMINI_MODEL_NAME, max_retries=5, timeout=300):
+    """
+    Streams a JSON array response and yields its elements as they complete. Failures are retried
+    with exponential backoff until the first element has been yielded; after that a retry could
+    repeat records, so the error is raised.
+    """
+    model = genai.GenerativeModel(model_name=model_name)
+
+    for i in range(max_retries):
+        yielded_any = False
+        try:
+            response = model.generate_content(
+                contents=[{"parts": [{"text": prompt}]}],
+                generation_config={
+                    "response_mime_type": "application/json",
+                    "response_schema": response_schema
+                },
+                safety_settings=SAFETY_SETTINGS,
+                request_options={"timeout": timeout},
+                stream=True
+            )
+            fragments = (
+                part.text
+                for response_chunk in response
+                if response_chunk.candidates and response_chunk.candidates[0].content
+                for part in response_chunk.candidates[0].content.parts
+            )
+            for item in iter_json_array_items(fragments):
+                yielded_any = True
+                yield item
+            return
+        except Exception as e:
+            print(f"Streaming LLM call failed (attempt {i+1}/{max_retries}): {e}")
+            if yielded_any or i >= max_retries - 1:
+                raise
+            time.sleep(2 ** i)
+
+def stream_extract_records(build_prompt, response_schema, chunks, max_workers=4, max_retries=5, timeout=300,
+                           prompt_version=None):
+    """
+    Streaming counterpart of extract_records: maps the chunks concurrently and yields each record
+    as soon as the model has finished writing it, from whichever chunk produces it first.
+    Exact duplicate records are dropped. Fully streamed chunks are stored in the mapping cache.
+    """
+    if not chunks:
+        return
+
+    record_queue = queue.Queue()
+
+    def stream_chunk(chunk):
+        try:
+            prompt = build_prompt(chunk)
+            cache_key = None
+            if prompt_version is not None:
+                cache_key = mapping_cache_key(prompt, response_schema, prompt_version)
+                cached_records = get_cached_mapping(cache_key)
+                if cached_records is not None:
+                    for record in cached_records:
+                        record_queue.put(('record', record))
+                    return
+
+            records = []
+            for record in stream_json_records(prompt, response_schema, max_retries=max_retries, timeout=timeout):
+                # The consumer annotates the records it receives; cache the record as the model wrote it.
+                records.append(copy.deepcopy(record))
+                record_queue.put(('record', record))
+            if cache_key is not None:
+                store_cached_mapping(cache_key, records)
+        except Exception as e:
+            record_queue.put(('error', e))
+        finally:
+            record_queue.put(('done', None))
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)))
+    try:
+        for chunk in chunks:
+            executor.submit(stream_chunk, chunk)
+
+        pending_chunks = len(chunks)
+        seen_records = set()
+        while pending_chunks:
+            event, value = record_queue.get()
+            if event == 'done':
+                pending_chunks -= 1
+            elif event == 'error':
+                raise value
+            else:
+                record_key = json.dumps(value, sort_keys=True)
+                if record_key in seen_records:
+                    continue
+                seen_records.add(record_key)
+                yield value
+        print(f"Streamed records from {len(chunks)} chunks.")
+    finally:
+        # Stop queued chunks if the caller gave up (e.g. the client disconnected).
+        executor.shutdown(wait=False, cancel_futures=True)
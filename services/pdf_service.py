@@ -0,0 +1,87 @@
+import mmap
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pypdf import PdfReader
+
+
+# --- Process Pool ---
+# pypdf text extraction is pure Python and holds the GIL, so large PDFs are split into page
+# ranges that are extracted in worker processes. The pool uses the spawn start method (forking
+# a process that holds Firestore/gRPC threads is unsafe) and is created once, on first use.
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_pdf_process_pool(max_workers):
+    global _process_pool
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+    return _process_pool
+
+def shutdown_pdf_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+# --- Extraction ---
+@contextmanager
+def open_pdf(pdf_path):
+    """
+    Opens the PDF at pdf_path through a read-only memory map. Given a path, PdfReader would read
+    the whole file into a private buffer in every process; the map is shared via the page cache.
+    """
+    with open(pdf_path, 'rb') as pdf_file, mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ) as pdf_map:
+        yield PdfReader(pdf_map)
+
+def _extract_page_range(pdf_path, start, stop):
+    """Worker task: extracts the text of pages [start, stop) of the PDF at pdf_path."""
+    with open_pdf(pdf_path) as reader:
+        return [(reader.pages[page_index].extract_text() or "") for page_index in range(start, stop)]
+
+def count_pdf_pages(pdf_path):
+    with open_pdf(pdf_path) as reader:
+        return len(reader.pages)
+
+def iter_pdf_page_texts(pdf_path, max_pages=500, max_workers=2, pages_per_task=10):
+    """
+    Yields the text of every page of the PDF at pdf_path, in page order. Documents longer than
+    one page range are extracted range by range in the process pool; each range is yielded as
+    soon as it and the ranges before it are done. Raises ValueError when the PDF has more than
+    max_pages pages.
+    """
+    page_count = count_pdf_pages(pdf_path)
+    if page_count > max_pages:
+        raise ValueError(f"PDF has {page_count} pages; the limit is {max_pages}.")
+
+    page_ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    if max_workers <= 1 or len(page_ranges) <= 1:
+        for start, stop in page_ranges:
+            yield from _extract_page_range(pdf_path, start, stop)
+        return
+
+    try:
+        pool = get_pdf_process_pool(max_workers)
+        futures = [pool.submit(_extract_page_range, pdf_path, start, stop) for start, stop in page_ranges]
+    except BrokenProcessPool:
+        shutdown_pdf_process_pool()
+        raise
+    try:
+        for future in futures:
+            yield from future.result()
+    except BrokenProcessPool:
+        # A crashed worker breaks the whole pool; start a fresh one for the next document.
+        shutdown_pdf_process_pool()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
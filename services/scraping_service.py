@@ -0,0 +1,182 @@
+import hashlib
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# lxml is much faster than the pure-Python parser; fall back to html.parser when it is not installed.
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+
+# --- HTTP Session ---
+# One pooled session is shared by every scrape so connections to the storefront are reused
+# across pages and across sync runs. Retries with backoff cover transient 429/5xx responses.
+_session = None
+_session_lock = threading.Lock()
+
+def create_scraping_session(pool_size=8, max_retries=3, backoff_factor=0.5):
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD'])
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_scraping_session(pool_size=8, max_retries=3):
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_scraping_session(pool_size=pool_size, max_retries=max_retries)
+    return _session
+
+
+# --- Collection Pages ---
+_PAGE_LINK_PATTERN = re.compile(r'[?&]page=(\d+)')
+
+def collection_page_url(base_url, page):
+    return f"{base_url}/collections/all?page={page}"
+
+def fetch_page(session, url, timeout, validators=None):
+    """
+    GETs a page, sending If-None-Match / If-Modified-Since when validators from an earlier
+    fetch are given. Returns a dict with the status, body text, the response validators and
+    a SHA-256 fingerprint of the body. A 304 result has no text and keeps the earlier fingerprint.
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('lastModified'):
+        headers['If-Modified-Since'] = validators['lastModified']
+
+    response = session.get(url, timeout=timeout, headers=headers)
+    if response.status_code == 304:
+        return {
+            "status": 304,
+            "text": None,
+            "etag": response.headers.get('ETag', validators.get('etag')),
+            "lastModified": response.headers.get('Last-Modified', validators.get('lastModified')),
+            "fingerprint": validators.get('fingerprint')
+        }
+    response.raise_for_status()
+    return {
+        "status": response.status_code,
+        "text": response.text,
+        "etag": response.headers.get('ETag'),
+        "lastModified": response.headers.get('Last-Modified'),
+        "fingerprint": hashlib.sha256(response.content).hexdigest()
+    }
+
+def discover_page_count(html):
+    """
+    Reads the number of collection pages from the pagination links of a collection page.
+    Returns 1 when the page has no pagination.
+    """
+    page_links = BeautifulSoup(html, HTML_PARSER, parse_only=SoupStrainer('a', href=_PAGE_LINK_PATTERN))
+    page_numbers = [int(_PAGE_LINK_PATTERN.search(link['href']).group(1)) for link in page_links.find_all('a')]
+    return max(page_numbers, default=1)
+
+def fetch_collection_pages(base_url, max_workers=8, timeout=15, max_retries=3, page_validators=None):
+    """
+    Fetches every page of /collections/all. The first page is fetched on its own to
+    discover the page count, then the remaining pages are fetched concurrently.
+    page_validators maps page numbers to the validators returned by an earlier fetch.
+    Returns a dict of fetch_page results keyed by page number, in page order.
+    Raises if any page still fails after retries, so callers never see a partial catalog.
+    """
+    session = get_scraping_session(pool_size=max_workers, max_retries=max_retries)
+    page_validators = page_validators or {}
+
+    first_page_url = collection_page_url(base_url, 1)
+    print(f"Scraping page 1: {first_page_url}")
+    first_page = fetch_page(session, first_page_url, timeout, page_validators.get(1))
+    if first_page['text'] is None:
+        # An unchanged first page means the pagination is unchanged too.
+        page_count = max(page_validators, default=1)
+    else:
+        page_count = discover_page_count(first_page['text'])
+    print(f"Found {page_count} collection pages.")
+
+    pages = {1: first_page}
+    if page_count > 1:
+        remaining_pages = range(2, page_count + 1)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(remaining_pages))) as executor:
+            remaining_results = executor.map(
+                lambda page: fetch_page(session, collection_page_url(base_url, page), timeout, page_validators.get(page)),
+                remaining_pages
+            )
+            pages.update(zip(remaining_pages, remaining_results))
+    return pages
+
+
+# --- Storefront JSON Feed ---
+# Shopify storefronts publish the catalog at /products.json, which is far smaller than
+# the rendered collection pages and includes every variant price.
+STOREFRONT_PAGE_SIZE = 250
+STOREFRONT_MAX_PAGES = 100
+
+def storefront_products_url(base_url, page, page_size=STOREFRONT_PAGE_SIZE):
+    return f"{base_url}/products.json?limit={page_size}&page={page}"
+
+def fetch_storefront_pages(base_url, timeout=15, max_retries=3, page_size=STOREFRONT_PAGE_SIZE,
+                           page_validators=None, max_pages=STOREFRONT_MAX_PAGES):
+    """
+    Pages through the storefront's products.json feed until a short page is returned, or until
+    a page repeats the previous one (a storefront that ignores ?page= serves page 1 forever).
+    page_validators maps page numbers to the validators (and 'itemCount') of an earlier fetch.
+    Returns a dict of fetch_page results keyed by page number; changed pages also carry the
+    raw Shopify product objects under 'products'.
+    Raises ValueError when pages are still full after max_pages, rather than returning a
+    catalog that may be incomplete.
+    """
+    session = get_scraping_session(max_retries=max_retries)
+    page_validators = page_validators or {}
+    pages = {}
+    for page in range(1, max_pages + 1):
+        feed_url = storefront_products_url(base_url, page, page_size)
+        print(f"Fetching storefront products page {page}: {feed_url}")
+        validators = page_validators.get(page)
+        result = fetch_page(session, feed_url, timeout, validators)
+        previous_page = pages.get(page - 1)
+        if previous_page and result['fingerprint'] and result['fingerprint'] == previous_page['fingerprint']:
+            print(f"Storefront products page {page} repeats page {page - 1}; stopping.")
+            return pages
+        if result['text'] is None:
+            result['itemCount'] = validators.get('itemCount', 0)
+        else:
+            result['products'] = json.loads(result['text']).get('products', [])
+            result['itemCount'] = len(result['products'])
+        pages[page] = result
+        if result['itemCount'] < page_size:
+            return pages
+    raise ValueError(f"Storefront products feed still returned full pages after {max_pages} pages.")
+
+
+# --- Product Cards ---
+# The strainer sees the raw class attribute ("card-wrapper product-card-wrapper ..."),
+# so match either card class as a whole word rather than comparing against a list.
+_PRODUCT_CARD_CLASS_PATTERN = re.compile(r'(?:^|\s)product-card(?:-wrapper)?(?:\s|$)')
+
+def extract_product_cards(html):
+    """
+    Parses only the product-card subtrees of a collection page instead of the whole document.
+    Returns the 'product-card-wrapper' divs, or the 'product-card' divs for themes without wrappers.
+    """
+    cards = BeautifulSoup(html, HTML_PARSER, parse_only=SoupStrainer('div', class_=_PRODUCT_CARD_CLASS_PATTERN))
+    return cards.find_all('div', class_='product-card-wrapper') or \
+           cards.find_all('div', class_='product-card')
@@ -0,0 +1,244 @@
+import csv
+import datetime
+import hashlib
+import io
+import json
+import re
+
+# openpyxl is only needed for .xlsx uploads; CSV/TSV imports work without it.
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+
+
+TABULAR_IMPORT_FORMATS = ('csv', 'tsv', 'xlsx')
+
+# Target fields a column can be mapped to. Invoice files may carry one line item per row,
+# so item fields are prefixed with 'item' and customer fields with 'customer'.
+CUSTOMER_COLUMN_FIELDS = ['name', 'mobileNumber', 'address', 'email', 'taxId', 'taxNumber']
+INVOICE_COLUMN_FIELDS = [
+    'invoiceNumber', 'billToName', 'billToAddress', 'mobileNumber', 'paymentType', 'totalAmount',
+    'invoiceDate', 'dueDate', 'daysDue', 'invoiceTaxPercentage', 'invoiceShippingCost',
+    'invoiceDiscountPercentage', 'status', 'totalPaid', 'invoiceType',
+    'itemProductId', 'itemName', 'itemPrice', 'itemQuantity', 'itemSubtotal',
+    'customerName', 'customerMobileNumber', 'customerAddress', 'customerEmail', 'customerTaxId', 'customerTaxNumber'
+]
+
+
+# --- Reading Tables ---
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        # Spreadsheets store phone numbers and quantities as floats.
+        return str(int(value))
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value).strip()
+
+def read_table(path, file_format):
+    """
+    Parses a spooled CSV/TSV/XLSX file into (headers, rows), where every row is a list of
+    cell strings as long as headers. Fully empty rows are dropped.
+    Raises ValueError when the file cannot be read.
+    """
+    if file_format == 'xlsx':
+        if load_workbook is None:
+            raise ValueError("XLSX imports require the openpyxl package.")
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            raw_rows = [[_cell_text(value) for value in row] for row in workbook.worksheets[0].iter_rows(values_only=True)]
+        finally:
+            workbook.close()
+    else:
+        delimiter = '\t' if file_format == 'tsv' else ','
+        # utf-8-sig drops the byte-order mark Excel puts at the start of CSV exports.
+        with open(path, newline='', encoding='utf-8-sig', errors='replace') as table_file:
+            raw_rows = [[cell.strip() for cell in row] for row in csv.reader(table_file, delimiter=delimiter)]
+
+    raw_rows = [row for row in raw_rows if any(row)]
+    if not raw_rows:
+        return [], []
+
+    headers = raw_rows[0]
+    while headers and not headers[-1]:
+        headers = headers[:-1]
+    rows = [(row + [""] * len(headers))[:len(headers)] for row in raw_rows[1:]]
+    return headers, rows
+
+def table_to_csv_lines(headers, rows):
+    """Renders a parsed table back to CSV lines, for files that have to go through row-by-row mapping."""
+    def to_line(cells):
+        line_buffer = io.StringIO()
+        csv.writer(line_buffer).writerow(cells)
+        return line_buffer.getvalue().rstrip('\r\n')
+    return to_line(headers), [to_line(row) for row in rows]
+
+def header_fingerprint(headers):
+    """Identifies a file layout by its header row, ignoring case and surrounding whitespace."""
+    normalized_headers = [header.strip().lower() for header in headers]
+    return hashlib.sha256(json.dumps(normalized_headers).encode('utf-8')).hexdigest()
+
+
+# --- Column Mappings ---
+def column_mapping_schema(target_fields):
+    """Gemini response schema for mapping target fields to lists of source column names."""
+    properties = {field: {"type": "array", "items": {"type": "string"}} for field in target_fields}
+    properties['dateFormat'] = {"type": "string", "nullable": True}
+    return {"type": "object", "properties": properties}
+
+def resolve_column_mapping(llm_mapping, headers, target_fields):
+    """
+    Turns the model's {field: [column names]} answer into {field: [column indexes]}, dropping
+    unknown fields and columns. Indexes, unlike names, stay valid for every file with the same
+    header fingerprint.
+    """
+    header_positions = {}
+    for position, header in enumerate(headers):
+        header_positions.setdefault(header.strip().lower(), position)
+
+    column_mapping = {}
+    for field in target_fields:
+        column_names = llm_mapping.get(field) or []
+        if isinstance(column_names, str):
+            column_names = [column_names]
+        positions = [header_positions[name.strip().lower()] for name in column_names
+                     if isinstance(name, str) and name.strip().lower() in header_positions]
+        if positions:
+            column_mapping[field] = positions
+    date_format = llm_mapping.get('dateFormat')
+    if isinstance(date_format, str) and '%' in date_format:
+        column_mapping['dateFormat'] = date_format
+    return column_mapping
+
+
+# --- Building Records ---
+_NUMBER_PATTERN = re.compile(r'-?\d+(?:\.\d+)?')
+
+def _mapped_text(row, column_mapping, field, separator="\n"):
+    values = [row[position] for position in column_mapping.get(field, []) if position < len(row) and row[position]]
+    return separator.join(values) if values else None
+
+def _mapped_number(row, column_mapping, field):
+    text = _mapped_text(row, column_mapping, field, separator=" ")
+    if text is None:
+        return None
+    match = _NUMBER_PATTERN.search(text.replace(',', ''))
+    return float(match.group()) if match else None
+
+def _mapped_date(row, column_mapping, field):
+    text = _mapped_text(row, column_mapping, field, separator=" ")
+    if text is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(text.replace('Z', '+00:00')).isoformat()
+    except ValueError:
+        pass
+    date_format = column_mapping.get('dateFormat')
+    if date_format:
+        try:
+            return datetime.datetime.strptime(text, date_format).isoformat()
+        except ValueError:
+            pass
+    # Left as-is; import analysis replaces dates it cannot parse.
+    return text
+
+def _without_empty_values(record):
+    return {key: value for key, value in record.items() if value is not None}
+
+def build_customer_records(rows, column_mapping):
+    """Builds customer import records from table rows using a resolved column mapping."""
+    customers = []
+    for row in rows:
+        customers.append(_without_empty_values({
+            "name": _mapped_text(row, column_mapping, 'name', separator=" "),
+            "mobileNumber": _mapped_text(row, column_mapping, 'mobileNumber', separator=" "),
+            "address": _mapped_text(row, column_mapping, 'address'),
+            "email": _mapped_text(row, column_mapping, 'email', separator=" "),
+            "taxId": _mapped_text(row, column_mapping, 'taxId', separator=" "),
+            "taxNumber": _mapped_text(row, column_mapping, 'taxNumber', separator=" "),
+        }))
+    return customers
+
+def _build_invoice_item(row, column_mapping):
+    quantity = _mapped_number(row, column_mapping, 'itemQuantity')
+    quantity = int(quantity) if quantity else 1
+    price = _mapped_number(row, column_mapping, 'itemPrice')
+    subtotal = _mapped_number(row, column_mapping, 'itemSubtotal')
+    if price is None:
+        price = round(subtotal / quantity, 2) if subtotal is not None else 0.0
+    if subtotal is None:
+        subtotal = round(price * quantity, 2)
+    return _without_empty_values({
+        "productId": _mapped_text(row, column_mapping, 'itemProductId', separator=" "),
+        "name": _mapped_text(row, column_mapping, 'itemName', separator=" "),
+        "price": price,
+        "quantity": quantity,
+        "subtotal": subtotal,
+    })
+
+def build_invoice_records(rows, column_mapping, today=None):
+    """
+    Builds {invoice, customer} import records from table rows using a resolved column mapping.
+    Rows sharing an invoice number become line items of one invoice.
+    Defaults match what the LLM import prompt asks for.
+    """
+    today = today or datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    grouped_rows = {}
+    for row_index, row in enumerate(rows):
+        invoice_number = _mapped_text(row, column_mapping, 'invoiceNumber', separator=" ")
+        # Rows without an invoice number are invoices of their own. The tuple key cannot collide
+        # with a real invoice number, even one that looks like "row-3".
+        grouped_rows.setdefault(invoice_number or ('row', row_index), []).append(row)
+
+    records = []
+    for group_key, group_rows in grouped_rows.items():
+        first_row = group_rows[0]
+        items = [_build_invoice_item(row, column_mapping) for row in group_rows]
+        items = [item for item in items if item.get('name')]
+
+        tax_percentage = _mapped_number(first_row, column_mapping, 'invoiceTaxPercentage') or 0.0
+        shipping_cost = _mapped_number(first_row, column_mapping, 'invoiceShippingCost') or 0.0
+        discount_percentage = _mapped_number(first_row, column_mapping, 'invoiceDiscountPercentage') or 0.0
+        total_amount = _mapped_number(first_row, column_mapping, 'totalAmount')
+        if total_amount is None:
+            items_total = sum(item['subtotal'] for item in items)
+            total_amount = round(items_total * (1 - discount_percentage / 100) * (1 + tax_percentage / 100) + shipping_cost, 2)
+        days_due = _mapped_number(first_row, column_mapping, 'daysDue')
+
+        bill_to_name = _mapped_text(first_row, column_mapping, 'billToName', separator=" ") or \
+            _mapped_text(first_row, column_mapping, 'customerName', separator=" ")
+        bill_to_address = _mapped_text(first_row, column_mapping, 'billToAddress') or \
+            _mapped_text(first_row, column_mapping, 'customerAddress')
+        mobile_number = _mapped_text(first_row, column_mapping, 'mobileNumber', separator=" ") or \
+            _mapped_text(first_row, column_mapping, 'customerMobileNumber', separator=" ")
+
+        invoice = _without_empty_values({
+            "invoiceNumber": group_key if isinstance(group_key, str) else None,
+            "billToName": bill_to_name,
+            "billToAddress": bill_to_address,
+            "mobileNumber": mobile_number,
+            "paymentType": _mapped_text(first_row, column_mapping, 'paymentType', separator=" "),
+            "items": items,
+            "totalAmount": total_amount,
+            "invoiceDate": _mapped_date(first_row, column_mapping, 'invoiceDate') or today.isoformat(),
+            "dueDate": _mapped_date(first_row, column_mapping, 'dueDate'),
+            "invoiceTaxPercentage": tax_percentage,
+            "invoiceShippingCost": shipping_cost,
+            "invoiceDiscountPercentage": discount_percentage,
+            "status": _mapped_text(first_row, column_mapping, 'status', separator=" ") or 'Unpaid',
+            "totalPaid": _mapped_number(first_row, column_mapping, 'totalPaid') or 0.0,
+            "daysDue": int(days_due) if days_due is not None else 1,
+            "invoiceType": _mapped_text(first_row, column_mapping, 'invoiceType', separator=" ") or 'Invoice',
+        })
+        customer = _without_empty_values({
+            "name": _mapped_text(first_row, column_mapping, 'customerName', separator=" ") or bill_to_name,
+            "mobileNumber": _mapped_text(first_row, column_mapping, 'customerMobileNumber', separator=" ") or mobile_number,
+            "address": _mapped_text(first_row, column_mapping, 'customerAddress') or bill_to_address,
+            "email": _mapped_text(first_row, column_mapping, 'customerEmail', separator=" "),
+            "taxId": _mapped_text(first_row, column_mapping, 'customerTaxId', separator=" "),
+            "taxNumber": _mapped_text(first_row, column_mapping, 'customerTaxNumber', separator=" "),
+        })
+        records.append({"invoice": invoice, "customer": customer})
+    return records
@@ -0,0 +1,90 @@
+import base64
+import binascii
+import os
+import re
+import tempfile
+
+
+# --- Upload Spooling ---
+# Import files are written to a temporary file as they arrive instead of being held in memory,
+# and later stages read them from disk. The caller deletes the file once it is done with it.
+SPOOL_BLOCK_BYTES = 1024 * 1024
+BASE64_DECODE_BLOCK_CHARS = 4 * 1024 * 1024  # Multiple of 4 so every block decodes on its own.
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+    def __init__(self, max_bytes):
+        super().__init__(f"File is larger than the {max_bytes} byte upload limit.")
+        self.max_bytes = max_bytes
+
+def _new_spool_file(suffix):
+    return tempfile.NamedTemporaryFile(prefix='import-', suffix=f".{suffix}" if suffix else "", delete=False)
+
+def _discard(spool_file):
+    spool_file.close()
+    os.unlink(spool_file.name)
+
+def spool_stream_to_file(stream, max_bytes, suffix=None):
+    """
+    Copies a binary stream into a temporary file block by block and returns its path.
+    Raises UploadTooLargeError as soon as more than max_bytes have been read, and ValueError
+    when the stream is empty.
+    """
+    spool_file = _new_spool_file(suffix)
+    try:
+        with spool_file:
+            spooled_bytes = 0
+            while True:
+                block = stream.read(SPOOL_BLOCK_BYTES)
+                if not block:
+                    break
+                spooled_bytes += len(block)
+                if spooled_bytes > max_bytes:
+                    raise UploadTooLargeError(max_bytes)
+                spool_file.write(block)
+        if spooled_bytes == 0:
+            raise ValueError("No file content provided")
+    except Exception:
+        _discard(spool_file)
+        raise
+    return spool_file.name
+
+def decoded_base64_size(encoded):
+    return len(encoded) * 3 // 4 - encoded[-2:].count('=')
+
+def spool_base64_to_file(encoded, max_bytes, suffix=None):
+    """
+    Decodes base64 content block by block into a temporary file and returns its path, so the
+    decoded file never sits in memory next to the encoded one. Raises UploadTooLargeError when
+    the decoded size exceeds max_bytes and ValueError when the content is not valid base64.
+    """
+    if re.search(r'\s', encoded):
+        encoded = re.sub(r'\s+', '', encoded)
+    if decoded_base64_size(encoded) > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+
+    spool_file = _new_spool_file(suffix)
+    try:
+        with spool_file:
+            for start in range(0, len(encoded), BASE64_DECODE_BLOCK_CHARS):
+                spool_file.write(base64.b64decode(encoded[start:start + BASE64_DECODE_BLOCK_CHARS], validate=True))
+    except (binascii.Error, ValueError):
+        _discard(spool_file)
+        raise ValueError("File content is not valid base64.")
+    return spool_file.name
+
+def spool_text_to_file(text, max_bytes, suffix=None):
+    """Writes text content to a temporary UTF-8 file and returns its path."""
+    encoded_text = text.encode('utf-8')
+    if len(encoded_text) > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+    spool_file = _new_spool_file(suffix)
+    with spool_file:
+        spool_file.write(encoded_text)
+    return spool_file.name
+
+def read_spooled_text(path):
+    # utf-8-sig drops the byte-order mark Excel puts at the start of CSV exports.
+    with open(path, encoding='utf-8-sig', errors='replace') as text_file:
+        return text_file.read()
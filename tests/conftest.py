@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import firebase_admin
+from firebase_admin import firestore
+
+from fake_firestore import FakeFirestore
+
+# app.py connects to Firestore at import time; point it at the in-memory stand-in instead.
+os.environ.setdefault('CUSTOMER_INDEX_USE_LISTENER', 'false')
+os.environ.setdefault('PRODUCT_CACHE_USE_LISTENER', 'false')
+firebase_admin.initialize_app = lambda *args, **kwargs: object()
+firestore.client = lambda app=None: FakeFirestore()
+
+import app as app_module
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """A fresh in-memory Firestore installed as app.db for one test."""
+    fake = FakeFirestore()
+    monkeypatch.setattr(app_module, 'db', fake)
+    return fake
+
+@pytest.fixture
+def app(fake_db):
+    return app_module
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
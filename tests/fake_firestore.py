@@ -0,0 +1,393 @@
+"""
+In-memory stand-in for the parts of the Firestore client that app.py uses: documents,
+collection queries, batches, transactions (usable with @firestore.transactional), get_all,
+write preconditions and the SERVER_TIMESTAMP/Increment/ArrayUnion transforms.
+
+Transactions are serialized: a transaction holds a store-wide lock from its first read until
+it commits or rolls back, standing in for the locks Firestore takes on documents read inside
+a transaction. Reads made outside a transaction do not take that lock.
+"""
+import copy
+import datetime
+import threading
+import uuid
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _field_value(data, field_path):
+    for part in field_path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+def _apply_transform(current, value):
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        values = list(current or [])
+        values.extend(item for item in value.values if item not in values)
+        return values
+    if isinstance(value, transforms.ArrayRemove):
+        return [item for item in (current or []) if item not in value.values]
+    return copy.deepcopy(value)
+
+def _merge_fields(target, fields):
+    for field_path, value in fields.items():
+        *parents, name = field_path.split('.')
+        node = target
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        if value is transforms.DELETE_FIELD:
+            node.pop(name, None)
+        else:
+            node[name] = _apply_transform(node.get(name), value)
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, update_time=None, field_paths=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+        self._field_paths = field_paths
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        data = copy.deepcopy(self._data)
+        if self._field_paths is not None:
+            data = {key: value for key, value in data.items() if key in self._field_paths}
+        return data
+
+    def get(self, field_path):
+        return _field_value(self._data, field_path)
+
+
+class FakeFirestore:
+    def __init__(self):
+        self._documents = {}  # path -> (data, update_time)
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.Lock()
+        self.read_count = 0
+        self.write_count = 0
+        self.commit_count = 0
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self)
+
+    def write_option(self, **kwargs):
+        return kwargs
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        for reference in list(references):
+            yield reference.get(field_paths=field_paths, transaction=transaction)
+
+    def _read(self, path):
+        with self._lock:
+            self.read_count += 1
+            return self._documents.get(path)
+
+    def _write(self, path, action, data=None, merge=False, option=None):
+        with self._lock:
+            current = self._documents.get(path)
+            option = option or {}
+            if 'exists' in option and option['exists'] != (current is not None):
+                raise exceptions.NotFound(path) if option['exists'] else exceptions.AlreadyExists(path)
+            if 'last_update_time' in option and (current is None or current[1] != option['last_update_time']):
+                raise exceptions.FailedPrecondition(path)
+            if action == 'update' and current is None:
+                raise exceptions.NotFound(path)
+            if action == 'create' and current is not None:
+                raise exceptions.AlreadyExists(path)
+
+            self.write_count += 1
+            update_time = _now()
+            if action == 'delete':
+                self._documents.pop(path, None)
+                return update_time
+            document = copy.deepcopy(current[0]) if current and (merge or action == 'update') else {}
+            if action == 'update':
+                _merge_fields(document, data)
+            else:
+                for field, value in data.items():
+                    if value is not transforms.DELETE_FIELD:
+                        document[field] = _apply_transform(document.get(field), value)
+                    else:
+                        document.pop(field, None)
+            self._documents[path] = (document, update_time)
+            return WriteResult(update_time)
+
+
+class DocumentReference:
+    def __init__(self, client, collection_path, document_id):
+        self._client = client
+        self.id = document_id
+        self.path = f"{collection_path}/{document_id}"
+
+    def get(self, field_paths=None, transaction=None):
+        if transaction is not None:
+            transaction._lock_store()
+        stored = self._client._read(self.path)
+        if stored is None:
+            return DocumentSnapshot(self, None)
+        return DocumentSnapshot(self, copy.deepcopy(stored[0]), stored[1], field_paths)
+
+    def set(self, data, merge=False):
+        return self._client._write(self.path, 'set', data, merge=merge)
+
+    def create(self, data):
+        return self._client._write(self.path, 'create', data)
+
+    def update(self, data, option=None):
+        return self._client._write(self.path, 'update', data, option=option)
+
+    def delete(self, option=None):
+        return self._client._write(self.path, 'delete', option=option)
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+
+_OPERATORS = {
+    '==': lambda value, operand: value == operand,
+    '!=': lambda value, operand: value is not None and value != operand,
+    '<': lambda value, operand: value is not None and value < operand,
+    '<=': lambda value, operand: value is not None and value <= operand,
+    '>': lambda value, operand: value is not None and value > operand,
+    '>=': lambda value, operand: value is not None and value >= operand,
+    'in': lambda value, operand: value in operand,
+    'array_contains': lambda value, operand: isinstance(value, list) and operand in value,
+}
+
+
+class Query:
+    def __init__(self, client, collection_path, filters=(), order=None, limit_count=None,
+                 start_after_values=None, field_paths=None, offset_count=0):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = list(filters)
+        self._order = order
+        self._limit_count = limit_count
+        self._start_after_values = start_after_values
+        self._field_paths = field_paths
+        self._offset_count = offset_count
+
+    def _copy(self, **changes):
+        settings = dict(filters=self._filters, order=self._order, limit_count=self._limit_count,
+                        start_after_values=self._start_after_values, field_paths=self._field_paths,
+                        offset_count=self._offset_count)
+        settings.update(changes)
+        return Query(self._client, self._collection_path, **settings)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(order=(field_path, direction))
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def offset(self, count):
+        return self._copy(offset_count=count)
+
+    def start_after(self, values):
+        return self._copy(start_after_values=values)
+
+    def select(self, field_paths):
+        return self._copy(field_paths=list(field_paths))
+
+    def _matching_documents(self):
+        with self._client._lock:
+            documents = [
+                (path.rsplit('/', 1)[1], data, update_time)
+                for path, (data, update_time) in self._client._documents.items()
+                if path.rsplit('/', 1)[0] == self._collection_path
+            ]
+        matching = []
+        for document_id, data, update_time in documents:
+            fields = dict(data, __name__=document_id)
+            if all(_OPERATORS[op](_field_value(fields, field), operand) for field, op, operand in self._filters):
+                matching.append((document_id, data, update_time))
+
+        if self._order:
+            field_path, direction = self._order
+            descending = direction == 'DESCENDING'
+            def sort_value(document):
+                return document[0] if field_path == '__name__' else _field_value(document[1], field_path)
+            matching.sort(key=lambda document: (sort_value(document) is None, sort_value(document) or ''), reverse=descending)
+            if self._start_after_values is not None:
+                after = self._start_after_values
+                after_value = after[field_path] if isinstance(after, dict) else after.get(field_path)
+                matching = [document for document in matching
+                            if sort_value(document) is not None
+                            and (sort_value(document) < after_value if descending else sort_value(document) > after_value)]
+        else:
+            matching.sort(key=lambda document: document[0])
+
+        matching = matching[self._offset_count:]
+        if self._limit_count is not None:
+            matching = matching[:self._limit_count]
+        return matching
+
+    def stream(self, transaction=None):
+        for document_id, data, update_time in self._matching_documents():
+            self._client.read_count += 1
+            reference = DocumentReference(self._client, self._collection_path, document_id)
+            yield DocumentSnapshot(reference, copy.deepcopy(data), update_time, self._field_paths)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def count(self, alias=None):
+        return AggregationQuery(self, [('count', None, alias or 'count')])
+
+    def sum(self, field_path, alias=None):
+        return AggregationQuery(self, [('sum', field_path, alias or field_path)])
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class AggregationQuery:
+    def __init__(self, query, aggregations):
+        self._query = query
+        self._aggregations = aggregations
+
+    def count(self, alias=None):
+        return AggregationQuery(self._query, self._aggregations + [('count', None, alias or 'count')])
+
+    def sum(self, field_path, alias=None):
+        return AggregationQuery(self._query, self._aggregations + [('sum', field_path, alias or field_path)])
+
+    def get(self, transaction=None):
+        documents = self._query._matching_documents()
+        self._query._client.read_count += 1
+        results = []
+        for kind, field_path, alias in self._aggregations:
+            if kind == 'count':
+                value = len(documents)
+            else:
+                values = [_field_value(data, field_path) for _, data, _ in documents]
+                value = sum(value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool))
+            results.append(AggregationResult(alias, value))
+        return [results]
+
+
+class CollectionReference(Query):
+    def __init__(self, client, collection_path):
+        super().__init__(client, collection_path)
+        self.id = collection_path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._collection_path, document_id or uuid.uuid4().hex)
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference.path, 'set', data, merge, None))
+
+    def create(self, reference, data):
+        self._writes.append((reference.path, 'create', data, False, None))
+
+    def update(self, reference, data, option=None):
+        self._writes.append((reference.path, 'update', data, False, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append((reference.path, 'delete', None, False, option))
+
+    def commit(self):
+        if len(self._writes) > 500:
+            raise exceptions.InvalidArgument("A batch can contain at most 500 writes.")
+        with self._client._lock:
+            # Batches are atomic: restore the previous state if any write fails.
+            snapshot = dict(self._client._documents)
+            try:
+                results = [self._client._write(*write) for write in self._writes]
+            except Exception:
+                self._client._documents = snapshot
+                raise
+            self._client.commit_count += 1
+        self._writes = []
+        return results
+
+
+class Transaction(WriteBatch):
+    """Implements the hooks @firestore.transactional calls on a transaction."""
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+        self._holds_store_lock = False
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _lock_store(self):
+        if not self._holds_store_lock:
+            self._client._transaction_lock.acquire()
+            self._holds_store_lock = True
+
+    def _unlock_store(self):
+        if self._holds_store_lock:
+            self._holds_store_lock = False
+            self._client._transaction_lock.release()
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().hex
+
+    def _rollback(self):
+        self._clean_up()
+        self._unlock_store()
+
+    def _commit(self):
+        try:
+            return self.commit()
+        finally:
+            self._clean_up()
+            self._unlock_store()
+
+    def get(self, reference_or_query):
+        if isinstance(reference_or_query, DocumentReference):
+            return iter([reference_or_query.get(transaction=self)])
+        self._lock_store()
+        return reference_or_query.stream()
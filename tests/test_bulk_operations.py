@@ -0,0 +1,33 @@
+import pytest
+
+import fake_firestore
+
+
+@pytest.fixture
+def strict_field_paths(monkeypatch):
+    """Rejects invalid field paths while a write is added, as the Firestore client does."""
+    update = fake_firestore.WriteBatch.update
+
+    def checked_update(self, reference, data, option=None):
+        for field_path in data:
+            if not field_path or '' in field_path.split('.'):
+                raise ValueError(f"Invalid field path: {field_path!r}")
+        return update(self, reference, data, option=option)
+
+    monkeypatch.setattr(fake_firestore.WriteBatch, 'update', checked_update)
+
+
+def test_invalid_field_path_fails_only_its_operation(client, fake_db, strict_field_paths):
+    for invoice_number in ('20240501001', '20240501002', '20240501003'):
+        fake_db.collection('invoices').document(invoice_number).set({'invoiceNumber': invoice_number, 'status': 'Unpaid'})
+
+    response = client.post('/invoices:batch', json={'operations': [
+        {'op': 'update', 'invoiceNumber': '20240501001', 'data': {'status': 'Paid'}},
+        {'op': 'update', 'invoiceNumber': '20240501002', 'data': {'a..b': 1}},
+        {'op': 'update', 'invoiceNumber': '20240501003', 'data': {'': 1}},
+    ]})
+
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == ['updated', 'failed', 'failed']
+    assert 'Invalid field path' in results[1]['error']
+    assert fake_db.collection('invoices').document('20240501001').get().to_dict()['status'] == 'Paid'
@@ -0,0 +1,88 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from services import scraping_service
+
+COLLECTION_PAGE = """<html><body><ul id="product-grid">
+  <li><div class="card-wrapper product-card-wrapper">
+    <a class="full-width-link" href="/products/ponni-rice">Ponni Rice - {page}</a>
+    <span class="price-item price-item--regular">$12.99</span>
+  </div></li>
+</ul>
+<nav class="pagination"><a href="/collections/all?page=1">1</a><a href="/collections/all?page=2">2</a></nav>
+</body></html>"""
+
+STOREFRONT_PRODUCTS = [
+    {'title': 'Ponni Rice', 'variants': [{'price': '12.99'}, {'price': '24.99'}]},
+    {'title': 'Toor Dal', 'variants': [{'price': '5.49'}]},
+]
+
+
+@pytest.fixture
+def storefront(app, monkeypatch):
+    """Serves two collection pages and, unless disabled, a one-page products.json on localhost."""
+    state = {'json_feed': True, 'requests': []}
+
+    class StorefrontHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            page = int(parse_qs(url.query).get('page', ['1'])[0])
+            state['requests'].append(url.path)
+            if url.path == '/collections/all':
+                body, content_type = COLLECTION_PAGE.format(page=page).encode('utf-8'), 'text/html'
+            elif url.path == '/products.json' and state['json_feed']:
+                body, content_type = json.dumps({'products': STOREFRONT_PRODUCTS}).encode('utf-8'), 'application/json'
+            else:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StorefrontHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(app, 'NALAM_FOODS_URL', f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setitem(app.app.config, 'SCRAPER_MAX_RETRIES', 0)
+    monkeypatch.setattr(scraping_service, '_session', None)
+    yield state
+    server.shutdown()
+
+def product_names_and_prices(app, pages):
+    return [(product['name'], product['price']) for product in app.flatten_catalog_pages(pages)]
+
+
+def test_json_source_reads_the_products_feed(app, storefront):
+    source, pages = app.fetch_catalog_pages()
+
+    assert source == 'shopify_json'
+    assert product_names_and_prices(app, pages) == [('Ponni Rice', 12.99), ('Toor Dal', 5.49)]
+
+
+def test_html_source_scrapes_the_collection_pages(app, storefront, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'CATALOG_SOURCE', 'html')
+
+    source, pages = app.fetch_catalog_pages()
+
+    assert source == 'html'
+    assert product_names_and_prices(app, pages) == [('Ponni Rice - 1', 12.99), ('Ponni Rice - 2', 12.99)]
+    assert '/products.json' not in storefront['requests']
+
+
+def test_missing_json_feed_falls_back_to_the_collection_pages(app, storefront):
+    storefront['json_feed'] = False
+
+    source, pages = app.fetch_catalog_pages()
+
+    assert source == 'html'
+    assert len(app.flatten_catalog_pages(pages)) == 2
@@ -0,0 +1,12 @@
+def test_last_row_for_a_mobile_number_wins(fake_db, client):
+    customers = [{'name': 'Ramesh', 'mobileNumber': '9876543210', 'address': 'Old Street'},
+                 {'name': 'Priya', 'mobileNumber': '9123456780'},
+                 {'name': 'Ramesh K', 'mobileNumber': '9876543210', 'address': 'New Street'}]
+
+    body = client.post('/customers/import/confirm', json={'customers_to_save': customers}).get_json()
+
+    assert body['imported_count'] == 2
+    assert body['skipped_count'] == 1
+    assert [result['status'] for result in body['results']] == ['skipped', 'imported', 'imported']
+    saved = fake_db.collection('customers').document('9876543210').get().to_dict()
+    assert (saved['name'], saved['address']) == ('Ramesh K', 'New Street')
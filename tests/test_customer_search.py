@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def customer_index(app, monkeypatch):
+    """Starts each test without a loaded index, in TTL mode."""
+    monkeypatch.setattr(app, '_customer_index', None)
+    monkeypatch.setattr(app, '_customer_index_watch', None)
+    monkeypatch.setattr(app, '_customer_index_refreshing', False)
+    return app
+
+def add_customer(fake_db, mobile_number, name):
+    fake_db.collection('customers').document(mobile_number).set({'name': name})
+
+def names(results):
+    return [customer['name'] for customer in results]
+
+
+def test_prefix_search_is_case_and_accent_insensitive(customer_index, fake_db):
+    add_customer(fake_db, '5550001', 'Ramesh Kumar')
+    add_customer(fake_db, '5550002', 'José Raman')
+    add_customer(fake_db, '5550003', 'Priya')
+
+    assert names(customer_index.search_customer_index('ram')) == ['Ramesh Kumar', 'José Raman']
+    assert names(customer_index.search_customer_index('jose')) == ['José Raman']
+    assert names(customer_index.search_customer_index('555000', limit=2)) == ['Ramesh Kumar', 'José Raman']
+
+
+def test_expired_index_is_served_while_it_rebuilds(customer_index, fake_db, monkeypatch):
+    add_customer(fake_db, '5550001', 'Ramesh Kumar')
+    customer_index.load_customer_index()
+    add_customer(fake_db, '5550002', 'Rama Iyer')
+
+    stream_started = threading.Event()
+    release_stream = threading.Event()
+    collection = fake_db.collection('customers')
+    original_stream = type(collection).stream
+
+    def slow_stream(query, transaction=None):
+        stream_started.set()
+        release_stream.wait(5)
+        return original_stream(query, transaction)
+
+    monkeypatch.setattr(type(collection), 'stream', slow_stream)
+    customer_index._customer_index['loaded_at'] -= customer_index.app.config['CUSTOMER_INDEX_TTL_SECONDS']
+
+    # The rebuild is stuck reading the collection; searches and writes still go through.
+    assert names(customer_index.search_customer_index('ram')) == ['Ramesh Kumar']
+    assert stream_started.wait(5)
+    customer_index.update_customer_index('5550003', {'name': 'Ramya'})
+    assert names(customer_index.search_customer_index('ram')) == ['Ramesh Kumar', 'Ramya']
+
+    release_stream.set()
+    for _ in range(500):
+        if not customer_index._customer_index_refreshing:
+            break
+        threading.Event().wait(0.01)
+    # The rebuilt index has the new document and the write made during the rebuild.
+    assert names(customer_index.search_customer_index('ram')) == ['Rama Iyer', 'Ramesh Kumar', 'Ramya']
@@ -0,0 +1,46 @@
+import pytest
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / 'invoices.pdf'
+    path.write_bytes(b'%PDF-1.4 stand-in')
+    return str(path)
+
+def fake_page_texts(pages, consumed):
+    def iter_pages(*args, **kwargs):
+        for page_text in pages:
+            if isinstance(page_text, Exception):
+                raise page_text
+            consumed.append(page_text)
+            yield page_text
+    return iter_pages
+
+
+def test_pdf_pages_are_chunked_as_they_are_extracted(app, pdf_path, monkeypatch):
+    consumed = []
+    monkeypatch.setattr(app, 'iter_pdf_page_texts', fake_page_texts(['page one', 'page two', 'page three'], consumed))
+    monkeypatch.setitem(app.app.config, 'LLM_CHUNK_MAX_CHARS', 18)
+
+    app.load_import_segments(pdf_path, 'pdf')
+    assert consumed == []
+
+    assert app.load_import_chunks(pdf_path, 'pdf') == (['page one\npage two', 'page three'], None)
+
+
+def test_pdf_extraction_errors_are_a_bad_request(app, pdf_path, monkeypatch):
+    monkeypatch.setattr(app, 'iter_pdf_page_texts', fake_page_texts(['page one', ValueError("bad xref")], []))
+
+    chunks, error = app.load_import_chunks(pdf_path, 'pdf')
+
+    assert chunks is None
+    assert error == {"error": "Failed to process PDF file: bad xref"}
+
+
+def test_pdf_without_text_is_a_bad_request(app, pdf_path, monkeypatch):
+    monkeypatch.setattr(app, 'iter_pdf_page_texts', fake_page_texts(['', '  \n'], []))
+
+    chunks, error = app.load_import_chunks(pdf_path, 'pdf')
+
+    assert chunks is None
+    assert 'Could not extract text' in error['error']
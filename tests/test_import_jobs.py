@@ -0,0 +1,21 @@
+import time
+
+
+def add_job(fake_db, app, job_id, status, updated_seconds_ago):
+    fake_db.collection(app.IMPORT_JOBS_COLLECTION).document(job_id).set({
+        'kind': 'customers',
+        'status': status,
+        'progress': {'stage': 'mapping'},
+        'updatedAt': time.time() - updated_seconds_ago,
+    })
+
+
+def test_only_stale_running_jobs_are_reported_as_failed(app, fake_db, client):
+    stale_after = app.app.config['IMPORT_JOB_STALE_SECONDS']
+    add_job(fake_db, app, 'stale', 'running', stale_after + 1)
+    add_job(fake_db, app, 'stale-queued', 'queued', stale_after + 1)
+    add_job(fake_db, app, 'live', 'running', 1)
+
+    assert client.get('/jobs/stale').get_json()['status'] == 'failed'
+    assert client.get('/jobs/stale-queued').get_json()['status'] == 'queued'
+    assert client.get('/jobs/live').get_json()['status'] == 'running'
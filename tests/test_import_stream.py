@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def get_all_calls(fake_db, monkeypatch):
+    """Records the document IDs sent in each get_all call."""
+    calls = []
+    get_all = fake_db.get_all
+
+    def recording_get_all(references, **kwargs):
+        references = list(references)
+        calls.append([reference.id for reference in references])
+        return get_all(references, **kwargs)
+
+    monkeypatch.setattr(fake_db, 'get_all', recording_get_all)
+    return calls
+
+@pytest.fixture
+def upload(app, tmp_path, monkeypatch):
+    import_path = tmp_path / 'import.csv'
+    import_path.write_text('unused')
+    monkeypatch.setattr(app, 'receive_import_upload', lambda: (str(import_path), 'csv', None))
+
+def invoice_records(count):
+    return [{
+        'customer': {'name': 'Ramesh', 'mobileNumber': '9876543210'},
+        'invoice': {'invoiceNumber': f"20240501{index:03d}", 'billToName': 'Ramesh', 'items': [{'name': 'Rice'}],
+                    'totalAmount': 10, 'invoiceDate': '2024-05-01'},
+    } for index in range(count)]
+
+def stream_events(client, path):
+    body = client.post(path).get_data(as_text=True)
+    return [
+        (lines[0].split(': ', 1)[1], json.loads(lines[1].split(': ', 1)[1]))
+        for lines in (event.splitlines() for event in body.strip().split('\n\n'))
+    ]
+
+
+def test_streamed_records_reuse_checked_ids(app, fake_db, client, upload, get_all_calls, monkeypatch):
+    fake_db.collection('customers').document('9876543210').set({'name': 'Ramesh'})
+    monkeypatch.setattr(app, 'read_tabular_import', lambda *args: (None, None))
+    monkeypatch.setattr(app, 'load_import_segments', lambda *args: (None, ['page']))
+    monkeypatch.setattr(app, 'stream_extract_records', lambda *args, **kwargs: iter(invoice_records(3)))
+
+    events = stream_events(client, '/invoices/import/analyze/stream')
+
+    assert events[-1] == ('complete', {'status': 'analysis_complete', 'new_customers_count': 0,
+                                       'updated_customers_count': 3, 'new_invoices_count': 3,
+                                       'updated_invoices_count': 0})
+    assert get_all_calls.count(['9876543210']) == 1
+    assert len(get_all_calls) == 4
+
+
+def test_tabular_records_are_checked_in_batches(app, client, upload, get_all_calls, monkeypatch):
+    monkeypatch.setattr(app, 'read_tabular_import', lambda *args: (invoice_records(150), None))
+
+    events = stream_events(client, '/invoices/import/analyze/stream')
+
+    assert events[-1][1]['new_invoices_count'] == 150
+    assert [len(ids) for ids in get_all_calls] == [1, 100, 50]
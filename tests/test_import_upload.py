@@ -0,0 +1,23 @@
+import base64
+
+import pytest
+
+
+def test_oversized_json_upload_is_rejected_before_parsing(app, client, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'IMPORT_MAX_UPLOAD_BYTES', 1024)
+    monkeypatch.setattr(app, 'spool_base64_to_file', lambda *args, **kwargs: pytest.fail("body was parsed"))
+    file_content = base64.b64encode(b'x' * (2 * 1024 * 1024)).decode('ascii')
+
+    response = client.post('/customers/import/analyze/stream', json={'file_content': file_content, 'file_format': 'xlsx'})
+
+    assert response.status_code == 413
+    assert 'upload limit' in response.get_json()['error']
+
+
+def test_non_string_file_content_is_a_bad_request(client):
+    for body in ({'file_content': 12345, 'file_format': 'csv'}, {'file_content': {'rows': [1]}, 'file_format': 'xlsx'},
+                 ['not', 'an', 'object']):
+        response = client.post('/customers/import/analyze/stream', json=body)
+
+        assert response.status_code == 400
+        assert 'error' in response.get_json()
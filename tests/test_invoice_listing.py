@@ -0,0 +1,53 @@
+from google.api_core.exceptions import FailedPrecondition
+
+import fake_firestore
+
+
+def test_non_integer_limit_is_rejected(client, fake_db):
+    fake_db.collection('invoices').document('20240501001').set({'invoiceNumber': '20240501001'})
+
+    response = client.get('/invoices?limit=abc')
+
+    assert response.status_code == 400
+    assert 'limit' in response.get_json()['error']
+
+
+def test_limit_below_one_is_rejected(client):
+    for limit in ('0', '-5'):
+        response = client.get(f'/invoices?limit={limit}')
+
+        assert response.status_code == 400
+        assert response.get_json()['error'] == "limit must be at least 1."
+
+
+def test_pages_follow_the_next_page_token(client, fake_db):
+    for suffix in range(1, 6):
+        invoice_number = f"20240501{suffix:03d}"
+        fake_db.collection('invoices').document(invoice_number).set({'invoiceNumber': invoice_number})
+
+    first_page = client.get('/invoices?limit=3').get_json()
+    second_page = client.get(f"/invoices?limit=3&pageToken={first_page['nextPageToken']}").get_json()
+
+    assert [invoice['invoiceNumber'] for invoice in first_page['invoices']] == ['20240501005', '20240501004', '20240501003']
+    assert [invoice['invoiceNumber'] for invoice in second_page['invoices']] == ['20240501002', '20240501001']
+    assert second_page['nextPageToken'] is None
+
+
+def test_streamed_query_error_is_a_json_error(client, monkeypatch):
+    def failing_stream(self, *args, **kwargs):
+        raise FailedPrecondition("The query requires an index.")
+        yield
+
+    monkeypatch.setattr(fake_firestore.Query, 'stream', failing_stream)
+
+    for headers, path in (({}, '/invoices?stream=1'), ({'Accept': 'application/x-ndjson'}, '/invoices')):
+        response = client.get(path, headers=headers)
+
+        assert response.status_code == 500
+        assert 'requires an index' in response.get_json()['error']
+
+
+def test_empty_stream_is_an_empty_array(client):
+    response = client.get('/invoices?stream=1')
+
+    assert response.get_json() == []
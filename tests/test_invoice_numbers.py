@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+DATE_PREFIX = '20240501'
+
+
+def test_concurrent_reservations_never_issue_a_number_twice(app):
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        reservations = list(executor.map(
+            lambda call_index: app.reserve_invoice_numbers(DATE_PREFIX, count=call_index % 3 + 1), range(60)
+        ))
+
+    numbers = [number for reservation in reservations for number in reservation]
+    assert len(numbers) == len(set(numbers)) == 120
+    assert sorted(numbers) == [f"{DATE_PREFIX}{suffix:03d}" for suffix in range(1, 121)]
+    for reservation in reservations:
+        suffixes = [int(number[len(DATE_PREFIX):]) for number in reservation]
+        assert suffixes == list(range(suffixes[0], suffixes[0] + len(suffixes)))
+
+
+def test_new_counter_continues_after_existing_invoices(app, fake_db):
+    for suffix in ('001', '007'):
+        fake_db.collection('invoices').document(f"{DATE_PREFIX}{suffix}").set({'invoiceDatePrefix': DATE_PREFIX})
+
+    assert app.reserve_invoice_numbers(DATE_PREFIX, count=2) == [f"{DATE_PREFIX}008", f"{DATE_PREFIX}009"]
+
+
+def test_concurrent_invoice_creation_gives_distinct_invoices(client, fake_db):
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        responses = list(executor.map(
+            lambda index: client.post('/invoices', json={'totalAmount': float(index), 'items': []}), range(40)
+        ))
+
+    assert all(response.status_code == 201 for response in responses)
+    invoice_numbers = [response.get_json()['invoiceNumber'] for response in responses]
+    assert len(set(invoice_numbers)) == 40
+    assert len(fake_db.collection('invoices').get()) == 40
+
+
+def test_create_invoice_does_not_overwrite_when_the_counter_falls_behind(app, client, fake_db):
+    invoice_number = client.post('/invoices', json={'totalAmount': 10.0, 'items': []}).get_json()['invoiceNumber']
+    # Simulate a reset counter document.
+    fake_db.collection(app.INVOICE_COUNTERS_COLLECTION).document(invoice_number[:8]).delete()
+    fake_db.collection('invoices').document(invoice_number).update({'invoiceDatePrefix': 'legacy'})
+
+    response = client.post('/invoices', json={'totalAmount': 99.0, 'items': []})
+
+    assert response.status_code == 409
+    assert fake_db.collection('invoices').document(invoice_number).get().to_dict()['totalAmount'] == 10.0
+
+
+def import_item(invoice_date, total_amount):
+    return {'invoice': {'_status': 'new', 'invoiceDate': invoice_date, 'totalAmount': total_amount, 'items': []}}
+
+
+def test_concurrent_import_confirms_reserve_distinct_numbers(client, fake_db):
+    def confirm(call_index):
+        items = [import_item(f"2024-05-0{day}T10:00:00", float(call_index)) for day in (1, 1, 2)]
+        return client.post('/invoices/import/confirm', json={'invoices_to_save': items})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(confirm, range(12)))
+
+    assert all(response.get_json()['imported_count'] == 3 for response in responses)
+    invoice_ids = sorted(doc.id for doc in fake_db.collection('invoices').get())
+    assert invoice_ids == sorted([f"{DATE_PREFIX}{suffix:03d}" for suffix in range(1, 25)] +
+                                 [f"20240502{suffix:03d}" for suffix in range(1, 13)])
+
+
+def test_import_confirm_does_not_overwrite_when_the_counter_falls_behind(app, client, fake_db):
+    fake_db.collection('invoices').document(f"{DATE_PREFIX}002").set({'invoiceDatePrefix': 'legacy', 'totalAmount': 10.0})
+    fake_db.collection(app.INVOICE_COUNTERS_COLLECTION).document(DATE_PREFIX).set({'lastIssued': 0})
+    items = [import_item('2024-05-01T10:00:00', amount) for amount in (1.0, 2.0, 3.0)]
+
+    body = client.post('/invoices/import/confirm', json={'invoices_to_save': items}).get_json()
+
+    assert [result['status'] for result in body['results']] == ['imported', 'failed', 'imported']
+    assert body['results'][1]['invoiceNumber'] == f"{DATE_PREFIX}002"
+    assert (body['imported_count'], body['failed_count']) == (2, 1)
+    assert fake_db.collection('invoices').document(f"{DATE_PREFIX}002").get().to_dict()['totalAmount'] == 10.0
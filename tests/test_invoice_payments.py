@@ -0,0 +1,21 @@
+def test_balance_is_taken_from_the_stored_balance(fake_db, client):
+    # The balance carries an adjustment that totalAmount - totalPaid does not show.
+    fake_db.collection('invoices').document('20240501001').set({
+        'invoiceNumber': '20240501001', 'totalAmount': 100.0, 'totalPaid': 0.0, 'balanceAmount': 90.0,
+    })
+
+    body = client.post('/invoices/20240501001/payments', json={'amount': 40}).get_json()
+
+    stored = fake_db.collection('invoices').document('20240501001').get().to_dict()
+    assert body['balanceAmount'] == stored['balanceAmount'] == 50.0
+    assert body['totalPaid'] == stored['totalPaid'] == 40.0
+
+
+def test_missing_balance_is_derived_from_the_totals(fake_db, client):
+    fake_db.collection('invoices').document('20240501002').set({
+        'invoiceNumber': '20240501002', 'totalAmount': 100.0, 'totalPaid': 25.0,
+    })
+
+    body = client.post('/invoices/20240501002/payments', json={'amount': 40}).get_json()
+
+    assert body['balanceAmount'] == fake_db.collection('invoices').document('20240501002').get().to_dict()['balanceAmount'] == 35.0
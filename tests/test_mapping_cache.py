@@ -0,0 +1,26 @@
+from services import gemini_service
+
+
+def test_cached_records_are_copies():
+    records = [{"name": "Ramesh", "items": [{"name": "Rice"}]}]
+    gemini_service.store_cached_mapping('copy-test', records)
+    records[0]['_status'] = 'new'
+
+    first_hit = gemini_service.get_cached_mapping('copy-test')
+    first_hit[0]['items'][0]['name'] = 'changed'
+    second_hit = gemini_service.get_cached_mapping('copy-test')
+
+    assert second_hit == [{"name": "Ramesh", "items": [{"name": "Rice"}]}]
+    assert second_hit[0] is not first_hit[0]
+
+
+def test_streamed_records_are_cached_before_the_consumer_annotates_them(monkeypatch):
+    monkeypatch.setattr(gemini_service, 'stream_json_records',
+                        lambda prompt, schema, **kwargs: iter([{"name": "Priya"}]))
+
+    for record in gemini_service.stream_extract_records(lambda chunk: chunk, {}, ['stream-copy-test'],
+                                                        prompt_version='test'):
+        record['_status'] = 'new'
+
+    cache_key = gemini_service.mapping_cache_key('stream-copy-test', {}, 'test')
+    assert gemini_service.get_cached_mapping(cache_key) == [{"name": "Priya"}]
@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+@pytest.fixture
+def sync_calls(app, monkeypatch):
+    """Replaces synchronize_products with a slow stub and records each call."""
+    calls = []
+    calls_lock = threading.Lock()
+
+    def fake_synchronize_products(force_full=False):
+        with calls_lock:
+            calls.append(force_full)
+        time.sleep(0.05)
+        return {"status": "success"}
+
+    monkeypatch.setattr(app, 'synchronize_products', fake_synchronize_products)
+    return calls
+
+def lease_ref(app, fake_db):
+    return fake_db.collection(app.SYNC_LEASE_COLLECTION).document(app.SYNC_LEASE_DOCUMENT)
+
+
+def test_concurrent_callers_run_the_sync_once(app, sync_calls):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = [status for status, _ in executor.map(lambda _: app.run_product_sync_task(), range(8))]
+
+    assert len(sync_calls) == 1
+    assert statuses.count('success') == 1
+    assert set(statuses) <= {'success', 'locked', 'recent'}
+
+
+def test_recent_successful_run_is_skipped(app, fake_db, sync_calls):
+    assert app.run_product_sync_task()[0] == 'success'
+
+    status, details = app.run_product_sync_task()
+
+    assert status == 'recent'
+    assert details['lastSuccessAt'] == lease_ref(app, fake_db).get().to_dict()['lastSuccessAt']
+    assert len(sync_calls) == 1
+    assert app.run_product_sync_task(force=True)[0] == 'success'
+    assert len(sync_calls) == 2
+
+
+def test_live_lease_blocks_other_callers(app, fake_db, sync_calls):
+    lease_ref(app, fake_db).set({'holder': 'other-instance', 'expiresAt': time.time() + 60})
+
+    assert app.run_product_sync_task(force=True)[0] == 'locked'
+    assert sync_calls == []
+
+
+def test_expired_lease_is_taken_over(app, fake_db, sync_calls):
+    lease_ref(app, fake_db).set({'holder': 'dead-instance', 'acquiredAt': time.time() - 120, 'expiresAt': time.time() - 1})
+
+    status, last_run = app.run_product_sync_task()
+
+    assert status == 'success'
+    assert len(sync_calls) == 1
+    lease = lease_ref(app, fake_db).get().to_dict()
+    assert lease['holder'] is None
+    assert lease['lastRun']['holder'] == last_run['holder'] != 'dead-instance'
+
+
+def test_late_release_by_an_expired_holder_keeps_the_new_lease(app, fake_db):
+    ref = lease_ref(app, fake_db)
+    assert app._acquire_product_sync_lease(fake_db.transaction(), ref, 'first', -1, 0)[0] == 'acquired'
+    assert app._acquire_product_sync_lease(fake_db.transaction(), ref, 'second', 60, 0)[0] == 'acquired'
+
+    app._release_product_sync_lease(fake_db.transaction(), ref, 'first', {"status": "error"})
+
+    assert ref.get().to_dict()['holder'] == 'second'
+
+
+def test_force_needs_a_configured_task_token(app, client, sync_calls, monkeypatch):
+    assert client.post('/tasks/sync-products').get_json()['status'] == 'success'
+
+    assert client.post('/tasks/sync-products?force=1').get_json()['status'] == 'skipped'
+    assert len(sync_calls) == 1
+
+    monkeypatch.setitem(app.app.config, 'SYNC_TASK_TOKEN', 'secret')
+    assert client.post('/tasks/sync-products?force=1').status_code == 403
+    response = client.post('/tasks/sync-products?force=1', headers={'X-Task-Token': 'secret'})
+    assert response.get_json()['status'] == 'success'
+    assert len(sync_calls) == 2
@@ -0,0 +1,51 @@
+from google.api_core.exceptions import FailedPrecondition
+
+
+def add_invoice(fake_db, invoice_number, status, total_amount, total_paid, balance_amount=None):
+    fake_db.collection('invoices').document(invoice_number).set({
+        'invoiceNumber': invoice_number, 'invoiceDatePrefix': invoice_number[:8], 'status': status,
+        'totalAmount': total_amount, 'totalPaid': total_paid, 'paymentType': 'Cash',
+        'balanceAmount': total_amount - total_paid if balance_amount is None else balance_amount,
+    })
+
+
+def test_summary_breaks_totals_down_by_status(fake_db, client):
+    add_invoice(fake_db, '20240501001', 'Paid', 100.0, 100.0)
+    add_invoice(fake_db, '20240502001', 'Unpaid', 50.0, 0.0)
+
+    summary = client.get('/reports/summary?year=2024').get_json()
+
+    assert (summary['invoiceCount'], summary['outstandingAmount']) == (2, 50.0)
+    assert summary['statuses']['Paid']['invoiceCount'] == 1
+    assert summary['months'][4]['invoiceCount'] == 2
+
+
+def test_outstanding_amount_sums_the_stored_balances(fake_db, client):
+    add_invoice(fake_db, '20240501001', 'Partially Paid', 100.0, 40.0, balance_amount=50.0)
+    add_invoice(fake_db, '20240502001', 'Unpaid', 30.0, 0.0)
+
+    summary = client.get('/reports/summary?year=2024').get_json()
+
+    assert summary['outstandingAmount'] == 80.0
+    assert summary['statuses']['Partially Paid']['outstandingAmount'] == 50.0
+    assert summary['months'][4]['outstandingAmount'] == 80.0
+
+
+def test_missing_index_leaves_out_only_the_status_breakdown(app, fake_db, client, monkeypatch):
+    add_invoice(fake_db, '20240501001', 'Paid', 100.0, 100.0)
+    aggregate_invoice_totals = app.aggregate_invoice_totals
+
+    def aggregate_without_status_index(query):
+        if any(field_path == 'status' for field_path, _, _ in query._filters):
+            raise FailedPrecondition("The query requires an index.")
+        return aggregate_invoice_totals(query)
+
+    monkeypatch.setattr(app, 'aggregate_invoice_totals', aggregate_without_status_index)
+
+    response = client.get('/reports/summary?year=2024')
+
+    summary = response.get_json()
+    assert response.status_code == 200
+    assert summary['invoiceCount'] == 1
+    assert 'statuses' not in summary
+    assert len(summary['months']) == 12
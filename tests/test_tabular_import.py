@@ -0,0 +1,131 @@
+import datetime
+from collections import OrderedDict
+
+import pytest
+
+from services import gemini_service
+from services.tabular_service import (
+    CUSTOMER_COLUMN_FIELDS, INVOICE_COLUMN_FIELDS, build_customer_records, build_invoice_records, header_fingerprint,
+    read_table, resolve_column_mapping
+)
+
+INVOICE_HEADERS = ['Invoice No', 'Customer', 'Phone', 'Product', 'Qty', 'Rate', 'Date']
+INVOICE_MAPPING = {
+    'invoiceNumber': [0], 'billToName': [1], 'mobileNumber': [2], 'itemName': [3], 'itemQuantity': [4],
+    'itemPrice': [5], 'invoiceDate': [6], 'dateFormat': '%d/%m/%Y'
+}
+
+
+@pytest.fixture
+def mapping_cache(monkeypatch):
+    monkeypatch.setattr(gemini_service, '_mapping_cache', OrderedDict())
+
+@pytest.fixture
+def column_mapping_calls(app, mapping_cache, monkeypatch):
+    """Answers column mapping prompts with llm_mapping['answer'] and records each prompt."""
+    calls = {'prompts': [], 'answer': {'name': ['Full Name'], 'mobileNumber': ['Mobile'], 'email': ['E-mail']}}
+
+    def fake_generate_json(prompt, response_schema, **kwargs):
+        calls['prompts'].append(prompt)
+        return calls['answer']
+
+    monkeypatch.setattr(app, 'generate_json', fake_generate_json)
+    return calls
+
+
+def test_read_table_parses_csv(tmp_path):
+    csv_path = tmp_path / 'customers.csv'
+    csv_path.write_bytes('\ufeffName, Mobile ,\n Ramesh ,9876543210\n,,\n"Priya, K"\n'.encode('utf-8'))
+
+    assert read_table(str(csv_path), 'csv') == (['Name', 'Mobile'], [['Ramesh', '9876543210'], ['Priya, K', '']])
+
+
+def test_read_table_parses_xlsx(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['Name', 'Mobile', 'Joined'])
+    workbook.active.append(['Ramesh', 9876543210.0, datetime.datetime(2024, 5, 1)])
+    workbook.active.append([None, None, None])
+    xlsx_path = tmp_path / 'customers.xlsx'
+    workbook.save(xlsx_path)
+
+    assert read_table(str(xlsx_path), 'xlsx') == (
+        ['Name', 'Mobile', 'Joined'], [['Ramesh', '9876543210', '2024-05-01T00:00:00']]
+    )
+
+
+def test_header_fingerprint_ignores_case_and_whitespace():
+    assert header_fingerprint(['Name', ' Mobile ']) == header_fingerprint(['name', 'MOBILE'])
+    assert header_fingerprint(['Name', 'Mobile']) != header_fingerprint(['Mobile', 'Name'])
+
+
+def test_resolve_column_mapping_uses_column_indexes():
+    headers = ['Full Name', 'Mobile', 'Street', 'City']
+    llm_mapping = {'name': 'full name', 'address': ['Street', 'City'], 'email': ['Missing'],
+                   'unknownField': ['Mobile'], 'dateFormat': 'not a format'}
+
+    assert resolve_column_mapping(llm_mapping, headers, CUSTOMER_COLUMN_FIELDS) == {'name': [0], 'address': [2, 3]}
+    assert resolve_column_mapping({'invoiceDate': ['Street'], 'dateFormat': '%d/%m/%Y'}, headers, INVOICE_COLUMN_FIELDS) == \
+        {'invoiceDate': [2], 'dateFormat': '%d/%m/%Y'}
+
+
+def test_build_customer_records_joins_mapped_columns():
+    rows = [['Ramesh', '9876543210', '12 Market St', 'Chennai'], ['Priya', '', '', '']]
+    mapping = {'name': [0], 'mobileNumber': [1], 'address': [2, 3]}
+
+    assert build_customer_records(rows, mapping) == [
+        {'name': 'Ramesh', 'mobileNumber': '9876543210', 'address': '12 Market St\nChennai'},
+        {'name': 'Priya'},
+    ]
+
+
+def test_build_invoice_records_groups_rows_by_invoice_number():
+    rows = [
+        ['INV-1', 'Ramesh', '9876543210', 'Rice', '2', '10.50', '01/05/2024'],
+        ['INV-1', 'Ramesh', '9876543210', 'Dal', '', '4', '01/05/2024'],
+        ['', 'Priya', '9123456780', 'Ghee', '1', '8', '2024-05-02'],
+        ['', 'Arun', '', 'Salt', '1', '1', ''],
+        ['row-3', 'Meena', '', 'Oil', '1', '6', ''],
+    ]
+
+    records = build_invoice_records(rows, INVOICE_MAPPING, today=datetime.datetime(2024, 6, 1))
+
+    assert [record['invoice'].get('invoiceNumber') for record in records] == ['INV-1', None, None, 'row-3']
+    first_invoice = records[0]['invoice']
+    assert [(item['name'], item['quantity'], item['subtotal']) for item in first_invoice['items']] == \
+        [('Rice', 2, 21.0), ('Dal', 1, 4.0)]
+    assert first_invoice['totalAmount'] == 25.0
+    assert first_invoice['invoiceDate'] == '2024-05-01T00:00:00'
+    assert records[1]['invoice']['invoiceDate'] == '2024-05-02T00:00:00'
+    assert records[2]['invoice']['invoiceDate'] == '2024-06-01T00:00:00'
+    assert records[1]['customer'] == {'name': 'Priya', 'mobileNumber': '9123456780'}
+    assert records[3]['invoice']['items'][0]['name'] == 'Oil'
+
+
+def test_column_mapping_is_cached_by_header_fingerprint(app, column_mapping_calls):
+    first = app.map_tabular_import((['Full Name', 'Mobile', 'E-mail'], [['Ramesh', '9876543210', 'r@example.com']]), 'customers')
+    second = app.map_tabular_import((['full name', 'MOBILE', 'e-mail'], [['Priya', '9123456780', '']]), 'customers')
+
+    assert len(column_mapping_calls['prompts']) == 1
+    assert first == [{'name': 'Ramesh', 'mobileNumber': '9876543210', 'email': 'r@example.com'}]
+    assert second == [{'name': 'Priya', 'mobileNumber': '9123456780'}]
+
+
+def test_unusable_column_mapping_falls_back_to_the_llm(app, fake_db, column_mapping_calls, tmp_path, monkeypatch):
+    column_mapping_calls['answer'] = {'email': ['E-mail']}
+    csv_path = tmp_path / 'customers.csv'
+    csv_path.write_text('Full Name,Mobile,E-mail\nRamesh,9876543210,r@example.com\n')
+    mapped_chunks = []
+
+    def fake_map_import_records(chunks, *args, **kwargs):
+        mapped_chunks.extend(chunks)
+        return [{'name': 'Ramesh', 'mobileNumber': '9876543210'}]
+
+    monkeypatch.setattr(app, 'map_import_records', fake_map_import_records)
+
+    result, status_code = app.analyze_customer_import(str(csv_path), 'csv')
+
+    assert status_code == 200
+    assert len(column_mapping_calls['prompts']) == 1
+    assert mapped_chunks == ['Full Name,Mobile,E-mail\nRamesh,9876543210,r@example.com']
+    assert result['new_customers_count'] == 1